@@ -0,0 +1,341 @@
+import os
+import struct
+import time
+
+import numpy as np
+
+from pyavaspec.calibration import PyAvaSpecCalibration
+
+# Binary spectrum archive
+#
+# The file starts with a fixed size (256 byte) little endian header containing
+# calibration, integration time, averaging settings and creation timestamp. It
+# is followed by fixed size records, each holding the acquisition timestamp
+# (float64, seconds) and one frame stored as uint16, int32, float32 or float64
+# samples. Since records are only ever appended a capture can grow while it is
+# running and the file can be memory mapped and sliced without loading it
+# completely.
+#
+# Archives whose wavelength axis is not described by the calibration (for
+# example converted text files) carry a wavelength table of pixelCount float64
+# values right after the header (flag ARCHIVEFLAG_WAVELENGTHS). The records
+# start at headerSize in any case.
+
+class PyAvaSpecArchiveException(Exception):
+    pass
+
+ARCHIVEMAGIC = b"AVASPEC\x00"
+ARCHIVEVERSION = 1
+ARCHIVEHEADERSIZE = 256
+ARCHIVEMAXCALIBRATION = 8
+ARCHIVEHEADERFORMAT = "<8sHHIIdIIdII{}d".format(ARCHIVEMAXCALIBRATION)
+ARCHIVEFLAG_WAVELENGTHS = 0x01
+
+ARCHIVEDTYPES = {
+    0 : np.dtype('<u2'),
+    1 : np.dtype('<f4'),
+    2 : np.dtype('<i4'),
+    3 : np.dtype('<f8')
+}
+
+def archiveDtypeCode(dtype):
+    dtype = np.dtype(dtype).newbyteorder('<')
+    for code in ARCHIVEDTYPES:
+        if ARCHIVEDTYPES[code] == dtype:
+            return code
+    raise PyAvaSpecArchiveException("Unsupported archive sample type {}, supported are uint16, int32, float32 and float64".format(dtype))
+
+def archiveRecordDtype(pixelCount, dtype):
+    return np.dtype([ ('timestamp', '<f8'), ('data', dtype, (pixelCount,)) ])
+
+def packArchiveHeader(header):
+    calibration = list(header['calibration'])
+    if len(calibration) > ARCHIVEMAXCALIBRATION:
+        raise PyAvaSpecArchiveException("At most {} calibration coefficients can be stored".format(ARCHIVEMAXCALIBRATION))
+    raw = struct.pack(
+        ARCHIVEHEADERFORMAT,
+        ARCHIVEMAGIC,
+        ARCHIVEVERSION,
+        archiveDtypeCode(header['dtype']),
+        header['pixelCount'],
+        header.get('headerSize', ARCHIVEHEADERSIZE),
+        float(header['integrationTime']),
+        header['softAverages'],
+        header['hardAverages'],
+        float(header['timestamp']),
+        len(calibration),
+        ARCHIVEFLAG_WAVELENGTHS if header.get('wavelengths') is not None else 0,
+        *(calibration + [ 0.0 ] * (ARCHIVEMAXCALIBRATION - len(calibration)))
+    )
+    return raw.ljust(ARCHIVEHEADERSIZE, b"\x00")
+
+def unpackArchiveHeader(raw):
+    if len(raw) < struct.calcsize(ARCHIVEHEADERFORMAT):
+        raise PyAvaSpecArchiveException("Archive header truncated")
+    fields = struct.unpack_from(ARCHIVEHEADERFORMAT, raw)
+    if fields[0] != ARCHIVEMAGIC:
+        raise PyAvaSpecArchiveException("Not a spectrum archive (bad magic)")
+    if fields[1] != ARCHIVEVERSION:
+        raise PyAvaSpecArchiveException("Unsupported archive version {}".format(fields[1]))
+    if fields[2] not in ARCHIVEDTYPES:
+        raise PyAvaSpecArchiveException("Unsupported archive sample type code {}".format(fields[2]))
+    return {
+        'dtype'           : ARCHIVEDTYPES[fields[2]],
+        'pixelCount'      : fields[3],
+        'headerSize'      : fields[4],
+        'integrationTime' : fields[5],
+        'softAverages'    : fields[6],
+        'hardAverages'    : fields[7],
+        'timestamp'       : fields[8],
+        'calibration'     : list(fields[11:11 + fields[9]]),
+        'wavelengths'     : None,
+        'flags'           : fields[10]
+    }
+
+def readArchiveHeader(f):
+    # Header and (if present) wavelength table of an archive opened for reading
+    header = unpackArchiveHeader(f.read(ARCHIVEHEADERSIZE))
+    if header['flags'] & ARCHIVEFLAG_WAVELENGTHS:
+        raw = f.read(8 * header['pixelCount'])
+        if (len(raw) != 8 * header['pixelCount']) or (header['headerSize'] != ARCHIVEHEADERSIZE + len(raw)):
+            raise PyAvaSpecArchiveException("Archive wavelength table truncated")
+        header['wavelengths'] = np.frombuffer(raw, dtype = '<f8').copy()
+    return header
+
+def selectArchiveDtype(filename, frames, exact = False):
+    # Frames appended to an existing archive keep its sample type. Otherwise
+    # uint16 is used for integer data in the counter range and float32 for
+    # anything else. With exact set integer data outside of the counter range
+    # is stored as int32 and fractional data as float64 unless float32
+    # represents it exactly, integer data is recognized by its dtype then
+    if os.path.isfile(filename) and (os.path.getsize(filename) > 0):
+        with open(filename, 'rb') as f:
+            return unpackArchiveHeader(f.read(ARCHIVEHEADERSIZE))['dtype']
+    frames = np.asarray(frames)
+    if not exact:
+        if np.all(frames == np.rint(frames)) and (np.min(frames) >= 0) and (np.max(frames) <= 65535):
+            return np.uint16
+        return np.float32
+    if frames.dtype.kind in 'iub':
+        if (np.min(frames) >= 0) and (np.max(frames) <= 65535):
+            return np.uint16
+        if (np.min(frames) >= -2**31) and (np.max(frames) < 2**31):
+            return np.int32
+    if np.array_equal(frames.astype(np.float32).astype(np.float64), frames.astype(np.float64), equal_nan = True):
+        return np.float32
+    return np.float64
+
+class PyAvaSpecArchiveWriter:
+    # Append only writer. Opening an existing archive appends to it, sample
+    # type, pixel count, calibration and wavelength table have to match its
+    # header. wavelengths stores an explicit wavelength axis (pixelCount
+    # values) in addition to the calibration
+
+    def __init__(self, filename, pixelCount = 2048, dtype = np.uint16, calibration = [ 0.546875, 299.67 ], integrationTime = 0, softAverages = 1, hardAverages = 1, timestamp = None, wavelengths = None):
+        if wavelengths is not None:
+            wavelengths = np.array(wavelengths, dtype = np.float64)
+            if wavelengths.shape != (pixelCount,):
+                raise PyAvaSpecArchiveException("Wavelength table has {} entries, archive stores {} pixels".format(len(wavelengths), pixelCount))
+        if os.path.isfile(filename) and (os.path.getsize(filename) > 0):
+            with open(filename, 'rb') as f:
+                self.header = readArchiveHeader(f)
+            if self.header['dtype'] != np.dtype(dtype).newbyteorder('<'):
+                raise PyAvaSpecArchiveException("Archive {} stores {} frames, got {}".format(filename, self.header['dtype'], np.dtype(dtype)))
+            if self.header['pixelCount'] != pixelCount:
+                raise PyAvaSpecArchiveException("Archive {} stores frames of {} pixels, got {}".format(filename, self.header['pixelCount'], pixelCount))
+            if (len(self.header['calibration']) != len(calibration)) or not np.allclose(self.header['calibration'], calibration, rtol = 1e-9, atol = 1e-9):
+                raise PyAvaSpecArchiveException("Archive {} uses calibration {}, got {}".format(filename, self.header['calibration'], list(calibration)))
+            if (self.header['wavelengths'] is None) != (wavelengths is None):
+                raise PyAvaSpecArchiveException("Archive {} {} a wavelength table".format(filename, "stores" if wavelengths is None else "does not store"))
+            if (wavelengths is not None) and not np.array_equal(self.header['wavelengths'], wavelengths):
+                raise PyAvaSpecArchiveException("Archive {} uses a different wavelength table".format(filename))
+            self.f = open(filename, 'ab')
+        else:
+            self.header = {
+                'dtype'           : np.dtype(dtype).newbyteorder('<'),
+                'pixelCount'      : pixelCount,
+                'headerSize'      : ARCHIVEHEADERSIZE + (0 if wavelengths is None else 8 * pixelCount),
+                'integrationTime' : integrationTime,
+                'softAverages'    : softAverages,
+                'hardAverages'    : hardAverages,
+                'timestamp'       : time.time() if timestamp == None else timestamp,
+                'calibration'     : list(calibration),
+                'wavelengths'     : wavelengths
+            }
+            self.f = open(filename, 'wb')
+            self.f.write(packArchiveHeader(self.header))
+            if wavelengths is not None:
+                self.f.write(wavelengths.astype('<f8').tobytes())
+
+        self.filename = filename
+        self.record = np.zeros(1, dtype = archiveRecordDtype(self.header['pixelCount'], self.header['dtype']))
+
+    def checkValues(self, data):
+        # Integer archives only accept values that are stored exactly (no
+        # wrap around of negative values, no truncation of fractions)
+        dtype = self.header['dtype']
+        if (dtype.kind not in 'iu') or (data.dtype == dtype) or (data.size == 0):
+            return
+        info = np.iinfo(dtype)
+        if (np.min(data) < info.min) or (np.max(data) > info.max):
+            raise PyAvaSpecArchiveException("Frame values outside of {} to {} cannot be stored as {}".format(info.min, info.max, dtype))
+        if (data.dtype.kind == 'f') and not np.all(data == np.rint(data)):
+            raise PyAvaSpecArchiveException("Fractional frame values cannot be stored as {}".format(dtype))
+
+    def append(self, frame, timestamp = None):
+        frame = np.asarray(frame)
+        if frame.shape != (self.header['pixelCount'],):
+            raise PyAvaSpecArchiveException("Frame has {} pixels, archive stores {}".format(len(frame), self.header['pixelCount']))
+        self.checkValues(frame)
+        self.record['timestamp'][0] = time.time() if timestamp == None else timestamp
+        self.record['data'][0] = frame
+        self.f.write(self.record.tobytes())
+
+    def appendMany(self, frames, timestamps):
+        frames = np.asarray(frames)
+        if (frames.ndim != 2) or (frames.shape[1] != self.header['pixelCount']):
+            raise PyAvaSpecArchiveException("Frames have shape {}, archive stores {} pixels per frame".format(frames.shape, self.header['pixelCount']))
+        self.checkValues(frames)
+        records = np.zeros(len(frames), dtype = self.record.dtype)
+        records['timestamp'] = timestamps
+        records['data'] = frames
+        self.f.write(records.tobytes())
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        if self.f != None:
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class PyAvaSpecArchive:
+    # Memory mapped, read only view of an archive. frames is a (N x pixels)
+    # array view, timestamps a vector of N entries. Call refresh to pick up
+    # records appended after opening.
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.header = readArchiveHeader(f)
+        self.recordDtype = archiveRecordDtype(self.header['pixelCount'], self.header['dtype'])
+        self.refresh()
+
+    def refresh(self):
+        count = (os.path.getsize(self.filename) - self.header['headerSize']) // self.recordDtype.itemsize
+        if count > 0:
+            self.records = np.memmap(self.filename, dtype = self.recordDtype, mode = 'r', offset = self.header['headerSize'], shape = (count,))
+        else:
+            self.records = np.zeros(0, dtype = self.recordDtype)
+        return count
+
+    @property
+    def frames(self):
+        return self.records['data']
+
+    @property
+    def timestamps(self):
+        return self.records['timestamp']
+
+    @property
+    def calibration(self):
+        return self.header['calibration']
+
+    def series(self):
+        # Time series view: seconds since the first frame and the memory
+        # mapped (time x pixel) frames
+        timestamps = np.asarray(self.timestamps, dtype = np.float64)
+        if len(timestamps) > 0:
+            timestamps = timestamps - timestamps[0]
+        return timestamps, self.frames
+
+    def wavelengths(self):
+        # The stored wavelength table or the axis of the calibration (stored
+        # in the order used throughout the package, highest order first)
+        if self.header['wavelengths'] is not None:
+            return self.header['wavelengths']
+        return PyAvaSpecCalibration.get(self.header['calibration'], self.header['pixelCount']).axis(self.header['pixelCount'])
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, key):
+        return self.records['data'][key]
+
+    def close(self):
+        self.records = np.zeros(0, dtype = self.recordDtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def loadDatFile(filename):
+    # Returns wavelengths and values of a text data file written by dumpData.
+    # Values written as integers are returned as int64 array, others as float64
+    tbl = np.loadtxt(filename, ndmin = 2, dtype = str)
+    if (tbl.ndim != 2) or (tbl.shape[1] != 2):
+        raise PyAvaSpecArchiveException("{} is not a two column spectrum file".format(filename))
+    try:
+        wavelengths = tbl[:,0].astype(np.float64)
+        if all([ v.lstrip("+-").isdigit() for v in tbl[:,1] ]):
+            return wavelengths, tbl[:,1].astype(np.int64)
+        return wavelengths, tbl[:,1].astype(np.float64)
+    except ValueError as e:
+        raise PyAvaSpecArchiveException("{} is not a two column spectrum file: {}".format(filename, e))
+
+def convertDatToArchive(datFiles, archiveFile, integrationTime = 0, softAverages = 1, hardAverages = 1, defaultCalibration = [ 0.546875, 299.67 ], tolerance = 1e-9):
+    # Appends the supplied text spectra to an archive so exportArchiveToDat
+    # reproduces them. If the wavelength column of the first file matches the
+    # default calibration within tolerance (nm) only the default coefficients
+    # are stored, otherwise the wavelength column itself is stored in addition
+    # to a fitted calibration. Samples are stored in the smallest type that
+    # keeps them exactly (see selectArchiveDtype)
+    if isinstance(datFiles, str):
+        datFiles = [ datFiles ]
+    frames = []
+    timestamps = []
+    wavelengths = None
+    for fname in datFiles:
+        fileWavelengths, values = loadDatFile(fname)
+        if wavelengths is None:
+            wavelengths = fileWavelengths
+        frames.append(values)
+        timestamps.append(os.path.getmtime(fname))
+
+    if len(set([ len(f) for f in frames ])) != 1:
+        raise PyAvaSpecArchiveException("All spectra have to contain the same number of pixels")
+    frames = np.asarray(frames)
+
+    defaultAxis = PyAvaSpecCalibration.get(defaultCalibration, len(wavelengths)).axis(len(wavelengths))
+    if np.allclose(defaultAxis, wavelengths, rtol = 0, atol = tolerance):
+        calibration, table = list(defaultCalibration), None
+    else:
+        calibration, table = np.polyfit(np.arange(len(wavelengths)), wavelengths, 1).tolist(), wavelengths
+
+    with PyAvaSpecArchiveWriter(
+        archiveFile,
+        pixelCount = frames.shape[1],
+        dtype = selectArchiveDtype(archiveFile, frames, exact = True),
+        calibration = calibration,
+        integrationTime = integrationTime,
+        softAverages = softAverages,
+        hardAverages = hardAverages,
+        wavelengths = table
+    ) as writer:
+        writer.appendMany(frames, timestamps)
+
+def exportArchiveToDat(archiveFile, index, filename):
+    # Writes a single frame of the archive in the text format used by dumpData
+    with PyAvaSpecArchive(archiveFile) as archive:
+        wavelengths = archive.wavelengths().tolist()
+        values = archive[index].tolist()
+    with open(filename, 'w') as f:
+        f.write("".join([ "{} {}\n".format(wavelengths[i], values[i]) for i in range(len(values)) ]))
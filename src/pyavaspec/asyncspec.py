@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pyavaspec.stream import PyAvaSpecFrame
+
+# asyncio facade for the spectrometer and the external gate. All blocking
+# USB and network I/O is executed on dedicated single worker threads (one
+# for the spectrometer, one per gate) so the event loop never stalls, device
+# access stays serialized and gate switching can run concurrently with an
+# exposure:
+#
+#   spec = PyAvaSpecAsync(PyAvaSpec_2048_2())
+#   gate = await PyAvaSpecAsyncGate.connect("10.0.0.14", channel = 2)
+#
+#   await gate.on()
+#   data = await spec.measure(integrationTime = 100)
+#
+#   async for frame in spec.frames(integrationTime = 100):
+#       process(frame.data)       # the next exposure is already running
+#
+# Note that a running USB transfer cannot be cancelled, cancelling an awaiting
+# task only abandons the result.
+
+class PyAvaSpecAsync:
+    def __init__(self, spec):
+        self.spec = spec
+        self.executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "pyavaspec-usb")
+        self.sequence = 0
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: func(*args, **kwargs))
+
+    def measureBlocking(self, integrationTime, averageCount, softAverages):
+        if softAverages > 1:
+            data = self.spec.cmdMeasureSoftAverages(integrationTime = integrationTime, softAverages = softAverages, hardAverages = averageCount, statistics = True).mean
+        else:
+            data = self.spec.cmdMeasure(integrationTime = integrationTime, averageCount = averageCount, asArray = True)
+        frame = PyAvaSpecFrame(data, self.sequence, time.monotonic())
+        self.sequence = self.sequence + 1
+        return frame
+
+    async def measureFrame(self, integrationTime = 1000, averageCount = 1, softAverages = 1):
+        return await self.run(self.measureBlocking, integrationTime, averageCount, softAverages)
+
+    async def measure(self, integrationTime = 1000, averageCount = 1, softAverages = 1):
+        frame = await self.measureFrame(integrationTime, averageCount, softAverages)
+        return frame.data
+
+    async def frames(self, integrationTime = 1000, averageCount = 1, softAverages = 1, count = None):
+        # Asynchronous frame stream. The next measurement is submitted before the
+        # current frame is handed to the consumer so processing overlaps exposure
+        loop = asyncio.get_running_loop()
+        delivered = 0
+        pending = loop.run_in_executor(self.executor, self.measureBlocking, integrationTime, averageCount, softAverages)
+        try:
+            while pending != None:
+                frame = await pending
+                delivered = delivered + 1
+                if (count == None) or (delivered < count):
+                    pending = loop.run_in_executor(self.executor, self.measureBlocking, integrationTime, averageCount, softAverages)
+                else:
+                    pending = None
+                yield frame
+        finally:
+            if pending != None:
+                # Do not leave a transfer running when the consumer stops early
+                try:
+                    await pending
+                except Exception:
+                    pass
+
+    async def close(self):
+        await self.run(self.spec.close)
+        self.executor.shutdown(wait = True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+class PyAvaSpecAsyncGate:
+    # Awaitable wrapper around a gate device providing outputEnable and
+    # outputDisable (for example an SDG1032X function generator)
+
+    def __init__(self, gate, channel = 1):
+        self.gate = gate
+        self.channel = channel
+        self.executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "pyavaspec-gate")
+
+    @staticmethod
+    async def connect(hostname, channel = 1):
+        def connectBlocking():
+            from sdg1032x.sdg1032x import SDG1032X
+            return SDG1032X(hostname)
+        loop = asyncio.get_running_loop()
+        gate = await loop.run_in_executor(None, connectBlocking)
+        return PyAvaSpecAsyncGate(gate, channel = channel)
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: func(*args, **kwargs))
+
+    async def on(self):
+        await self.run(self.gate.outputEnable, channel = self.channel)
+
+    async def off(self):
+        await self.run(self.gate.outputDisable, channel = self.channel)
+
+    async def close(self):
+        if hasattr(self.gate, "close"):
+            await self.run(self.gate.close)
+        self.executor.shutdown(wait = True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
@@ -1,331 +1,533 @@
+import os
+import shlex
 import sys
 import time
-from pyavaspec.pyavaspec import PyAvaSpec_2048_2
-from sdg1032x.sdg1032x import SDG1032X
+import numpy as np
+from pyavaspec.pyavaspec import PyAvaSpec_2048_2, PyAvaSpecProcessing
+from pyavaspec.archive import PyAvaSpecArchive, PyAvaSpecArchiveWriter, PyAvaSpecArchiveException, selectArchiveDtype
+from pyavaspec.calibration import PyAvaSpecCalibration
+from pyavaspec.profiling import PROFILER
+from pyavaspec.darkframes import PyAvaSpecDarkFrameLibrary, defaultDarkFrameLibraryFile
+from pyavaspec.references import PyAvaSpecReferenceLibrary, REFERENCEMETHODS
+from pyavaspec.averaging import STACKMETHODS
 
 class PyAvaSpecCliException(Exception):
     pass
 
 class PyAvaSpecCli:
-    def parsevalidate_inttime(self, i):
+    def parsevalidate_inttime(self, args):
         try:
-            inttime = int(sys.argv[i+1])
+            inttime = int(args[0])
             if (inttime <= 0) or (inttime > 1000):
                 raise PyAvaSpecCliException("Integration time should be in range from 1 to 1000ms")
         except ValueError:
-            raise PyAvaSpecCliException("Integration time {} is not a valid numeric expression".format(sys.argv[i+1]))
+            raise PyAvaSpecCliException("Integration time {} is not a valid numeric expression".format(args[0]))
 
-    def parsevalidate_avgcount_soft(self, i):
+    def parsevalidate_avgcount_soft(self, args):
         try:
-            n = int(sys.argv[i+1])
+            n = int(args[0])
             if (n < 1) or (n > 1000):
                 raise PyAvaSpecCliException("Software average count should be at least 1 and maximum 1000 times")
         except ValueError:
-            raise PyAvaSpecCliException("Software average count {} is not a valid numeric expression".format(sys.argv[i+1]))
-    def parsevalidate_avgcount_hard(self, i):
+            raise PyAvaSpecCliException("Software average count {} is not a valid numeric expression".format(args[0]))
+    def parsevalidate_avgmethod(self, args):
+        if args[0] not in STACKMETHODS:
+            raise PyAvaSpecCliException("Averaging method has to be one of {}".format(", ".join(STACKMETHODS)))
+    def parsevalidate_avgsigma(self, args):
         try:
-            n = int(sys.argv[i+1])
+            n = float(args[0])
+            if n <= 0:
+                raise PyAvaSpecCliException("Outlier rejection threshold has to be a positive number of standard deviations")
+        except ValueError:
+            raise PyAvaSpecCliException("Outlier rejection threshold {} is not a valid floating point expression".format(args[0]))
+    def parsevalidate_avgcount_hard(self, args):
+        try:
+            n = int(args[0])
             if (n < 1) or (n > 1):
                 raise PyAvaSpecCliException("Hardware average count should be at least 1 and maximum 1 times")
         except ValueError:
-            raise PyAvaSpecCliException("Hardware average count {} is not a valid numeric expression".format(sys.argv[i+1]))
-    def parsevalidate_avgcount(self, i):
+            raise PyAvaSpecCliException("Hardware average count {} is not a valid numeric expression".format(args[0]))
+    def parsevalidate_avgcount(self, args):
         try:
-            n1 = int(sys.argv[i+1])
-            n2 = int(sys.argv[i+2])
+            n1 = int(args[0])
+            n2 = int(args[1])
             if (n2 < 1) or (n2 > 1):
                 raise PyAvaSpecCliException("Hardware average count should be at least 1 and maximum 1 times")
             if (n1 < 1) or (n1 > 1000):
                 raise PyAvaSpecCliException("Software average count should be at least 1 and maximum 1000 times")
         except ValueError:
-            raise PyAvaSpecCliException("Software average count {} or hardware average count {} is not a valid numeric expression".format(sys.argv[i+1], sys.argv[i+2]))
-    def parsevalidate_peakmaxcount(self, i):
+            raise PyAvaSpecCliException("Software average count {} or hardware average count {} is not a valid numeric expression".format(args[0], args[1]))
+    def parsevalidate_peakmaxcount(self, args):
         try:
-            n = int(sys.argv[i+1])
+            n = int(args[0])
             if (n < 1) or (n > 100):
                 raise PyAvaSpecCliException("Maximum peak count should be at least 1 and maximum 100 times")
         except ValueError:
-            raise PyAvaSpecCliException("Maximum peak count {} is not a valid numeric expression".format(sys.argv[i+1]))
-    def parsevalidate_peakavgwindow(self, i):
+            raise PyAvaSpecCliException("Maximum peak count {} is not a valid numeric expression".format(args[0]))
+    def parsevalidate_peakavgwindow(self, args):
         try:
-            n = int(sys.argv[i+1])
+            n = int(args[0])
             if (n < 1) or (n > 100):
                 raise PyAvaSpecCliException("Maximum average window size should be at least 1 and maximum 100 times")
         except ValueError:
-            raise PyAvaSpecCliException("Maximum average window size {} is not a valid numeric expression".format(sys.argv[i+1]))
-    def parsevalidate_plotformat(self, i):
-        fmt = sys.argv[i+1]
+            raise PyAvaSpecCliException("Maximum average window size {} is not a valid numeric expression".format(args[0]))
+    def parsevalidate_peakminheight(self, args):
+        try:
+            float(args[0])
+        except ValueError:
+            raise PyAvaSpecCliException("Minimum peak height {} is not a valid floating point expression".format(args[0]))
+    def parsevalidate_peakminprominence(self, args):
+        try:
+            n = float(args[0])
+            if n < 0:
+                raise PyAvaSpecCliException("Minimum peak prominence has to be positive")
+        except ValueError:
+            raise PyAvaSpecCliException("Minimum peak prominence {} is not a valid floating point expression".format(args[0]))
+    def parsevalidate_peakmindistance(self, args):
+        try:
+            n = int(args[0])
+            if (n < 1) or (n > 2048):
+                raise PyAvaSpecCliException("Minimum peak distance should be at least 1 and maximum 2048 pixels")
+        except ValueError:
+            raise PyAvaSpecCliException("Minimum peak distance {} is not a valid numeric expression".format(args[0]))
+    def parsevalidate_plotformat(self, args):
+        fmt = args[0]
         if (fmt != "png") and (fmt != "svg"):
             raise PyAvaSpecCliException("Plot format has to be either png or svg, format {} is unknown".format(fmt))
 
-    def parsevalidate_sdg1032xCh(self, i):
+    def parsevalidate_calibration(self, args):
+        if args[0].endswith(".json"):
+            return
+        try:
+            coefficients = [ float(c) for c in args[0].split(",") ]
+        except ValueError:
+            raise PyAvaSpecCliException("Calibration {} is neither a JSON file nor a comma separated list of coefficients".format(args[0]))
+        try:
+            PyAvaSpecCalibration.get(coefficients)
+        except ValueError as e:
+            raise PyAvaSpecCliException("Calibration {} is invalid: {}".format(args[0], e))
+
+    def parsevalidate_autoexposure(self, args):
+        try:
+            n = float(args[0])
+            if (n <= 0) or (n >= 1):
+                raise PyAvaSpecCliException("Auto exposure target has to be a fraction of full scale between 0 and 1")
+        except ValueError:
+            raise PyAvaSpecCliException("Auto exposure target {} is not a valid floating point expression".format(args[0]))
+    def parsevalidate_darkmaxage(self, args):
+        try:
+            n = int(args[0])
+            if n < 0:
+                raise PyAvaSpecCliException("Maximum background age has to be zero or a positive number of seconds")
+        except ValueError:
+            raise PyAvaSpecCliException("Maximum background age {} is not a valid numeric expression".format(args[0]))
+    def parsevalidate_darkinterp(self, args):
+        if args[0] not in [ "on", "off" ]:
+            raise PyAvaSpecCliException("Background interpolation has to be either on or off")
+
+    def parsevalidate_identify(self, args):
+        try:
+            n = int(args[0])
+            if n < 1:
+                raise PyAvaSpecCliException("Number of reported matches has to be a positive number")
+        except ValueError:
+            raise PyAvaSpecCliException("Number of reported matches {} is not a valid numeric expression".format(args[0]))
+    def parsevalidate_refmethod(self, args):
+        if args[0] not in REFERENCEMETHODS:
+            raise PyAvaSpecCliException("Similarity measure has to be one of {}".format(", ".join(REFERENCEMETHODS)))
+
+    def parsevalidate_loadfarc(self, args):
+        try:
+            int(args[1])
+        except ValueError:
+            raise PyAvaSpecCliException("Archive frame index {} is not a valid numeric expression".format(args[1]))
+
+    def parsevalidate_sdg1032xCh(self, args):
         try:
-            n = int(sys.argv[i+1])
+            n = int(args[0])
             if (n < 1) or (n > 2):
                 raise PyAvaSpecCliException("SDG1032X only supplied channels 1 and 2")
         except ValueError:
-            raise PyAvaSpecCliException("SDG1032X channel {} is not a valid channel number".format(sys.argv[i+1]))
-    def parsevalidate_sdg1032xFrq(self, i):
+            raise PyAvaSpecCliException("SDG1032X channel {} is not a valid channel number".format(args[0]))
+    def parsevalidate_sdg1032xFrq(self, args):
         try:
-            n = float(sys.argv[i+1])
+            n = float(args[0])
             if n < 0:
                 raise PyAvaSpecCliException("SDG1032X frequency has to be positive")
         except ValueError:
-            raise PyAvaSpecCliException("SDG1032X frequency {} is not a valid floating point expression".format(sys.argv[i+1]))
-    def parsevalidate_sdg1032xPeriod(self, i):
+            raise PyAvaSpecCliException("SDG1032X frequency {} is not a valid floating point expression".format(args[0]))
+    def parsevalidate_sdg1032xPeriod(self, args):
         try:
-            n = float(sys.argv[i+1])
+            n = float(args[0])
             if n < 0:
                 raise PyAvaSpecCliException("SDG1032X frequency has to be positive")
         except ValueError:
-            raise PyAvaSpecCliException("SDG1032X frequency {} is not a valid floating point expression".format(sys.argv[i+1]))
+            raise PyAvaSpecCliException("SDG1032X frequency {} is not a valid floating point expression".format(args[0]))
 
-    def parsevalidate_sleep(self, i):
+    def parsevalidate_kinetics(self, args):
+        count = args[1][:-1] if args[1].endswith("s") else args[1]
         try:
-            sleeptime = int(sys.argv[i+1])
+            if float(count) <= 0:
+                raise PyAvaSpecCliException("Kinetics frame count or duration has to be positive")
+        except ValueError:
+            raise PyAvaSpecCliException("Kinetics frame count or duration {} is not a valid numeric expression".format(args[1]))
+        if not args[1].endswith("s"):
+            try:
+                int(args[1])
+            except ValueError:
+                raise PyAvaSpecCliException("Kinetics frame count {} has to be an integer (append s for a duration in seconds)".format(args[1]))
+        try:
+            if float(args[2]) < 0:
+                raise PyAvaSpecCliException("Kinetics interval has to be zero (maximum rate) or a positive number of seconds")
+        except ValueError:
+            raise PyAvaSpecCliException("Kinetics interval {} is not a valid floating point expression".format(args[2]))
+
+    def parsevalidate_sleep(self, args):
+        try:
+            sleeptime = float(args[0])
             if (sleeptime <= 0):
                 raise PyAvaSpecCliException("Sleep time has to be a positive number of seconds")
         except ValueError:
-            raise PyAvaSpecCliException("Sleep time {} is not a valid numeric expression".format(sys.argv[i+1]))
+            raise PyAvaSpecCliException("Sleep time {} is not a valid numeric expression".format(args[0]))
 
 
-    def exec_inttime(self, state, i):
-        newinttime = int(sys.argv[i+1])
+    def exec_inttime(self, state, args):
+        newinttime = int(args[0])
         state['cfg']['inttime'] = newinttime
         if state['cfg']['verbose']:
             print("Setting integration time to {} ms".format(newinttime))
         return state
-    def exec_avgsoft(self, state, i):
-        newsoftavg = int(sys.argv[i+1])
+    def exec_avgsoft(self, state, args):
+        newsoftavg = int(args[0])
         state['cfg']['avgsoft'] = newsoftavg
         if state['cfg']['verbose']:
             print("Setting software averaging count to {}".format(newsoftavg))
         return state
-    def exec_avghard(self, state, i):
-        newhardavg = int(sys.argv[i+1])
+    def exec_avghard(self, state, args):
+        newhardavg = int(args[0])
         state['cfg']['avghard'] = newhardavg
         if state['cfg']['verbose']:
             print("Setting hardware averaging count to {}".format(newhardavg))
         return state
-    def exec_avg(self, state, i):
-        newsoftavg = int(sys.argv[i+1])
-        newhardavg = int(sys.argv[i+2])
+    def exec_avg(self, state, args):
+        newsoftavg = int(args[0])
+        newhardavg = int(args[1])
         state['cfg']['avghard'] = newhardavg
         state['cfg']['avgsoft'] = newsoftavg
         if state['cfg']['verbose']:
             print("Setting hardware averaging count to {}".format(newhardavg))
             print("Setting software averaging count to {}".format(newsoftavg))
         return state
-    def exec_maxpeaks(self, state, i):
-        newpeaks = int(sys.argv[i+1])
+    def exec_avgmethod(self, state, args):
+        state['cfg']['avgmethod'] = args[0]
+        if state['cfg']['verbose']:
+            print("Setting software averaging method to {}".format(args[0]))
+        return state
+    def exec_avgsigma(self, state, args):
+        state['cfg']['avgsigma'] = float(args[0])
+        if state['cfg']['verbose']:
+            print("Setting outlier rejection threshold to {} standard deviations".format(state['cfg']['avgsigma']))
+        return state
+    def exec_maxpeaks(self, state, args):
+        newpeaks = int(args[0])
         state['cfg']['peakmaxcount'] = newpeaks
         if state['cfg']['verbose']:
             print("Setting maximum peak count to {}".format(newpeaks))
         return state
-    def exec_peakavgwindow(self, state, i):
-        newpeaks = int(sys.argv[i+1])
+    def exec_peakavgwindow(self, state, args):
+        newpeaks = int(args[0])
         state['cfg']['peakavgwindow'] = newpeaks
         if state['cfg']['verbose']:
             print("Setting peak search averaging window to {}".format(newpeaks))
         return state
+    def exec_peakminheight(self, state, args):
+        newheight = float(args[0])
+        state['cfg']['peakminheight'] = newheight
+        if state['cfg']['verbose']:
+            print("Setting minimum peak height to {}".format(newheight))
+        return state
+    def exec_peakminprominence(self, state, args):
+        newprominence = float(args[0])
+        state['cfg']['peakminprominence'] = newprominence
+        if state['cfg']['verbose']:
+            print("Setting minimum peak prominence to {}".format(newprominence))
+        return state
+    def exec_peakmindistance(self, state, args):
+        newdistance = int(args[0])
+        state['cfg']['peakmindistance'] = newdistance
+        if state['cfg']['verbose']:
+            print("Setting minimum peak distance to {} pixels".format(newdistance))
+        return state
 
-    def exec_measure(self, state, i):
+    def exec_calibration(self, state, args):
+        if args[0].endswith(".json"):
+            cal = PyAvaSpecCalibration.load(args[0])
+        else:
+            cal = PyAvaSpecCalibration.get([ float(c) for c in args[0].split(",") ])
+        self.proc.calibration = cal
+        if state['cfg']['verbose']:
+            print("Setting wavelength calibration to {}".format(cal.coefficients))
+        return state
+
+    def exec_measure(self, state, args):
         # Run a measurement using out spectrometer and store in foreground data
         if state['cfg']['verbose']:
             print("Acquiring foreground data ...")
+        rejected = 0
         if state['cfg']['avgsoft'] == 1:
-            state['fgdata'] = self.spec.cmdMeasure(integrationTime = state['cfg']['inttime'], averageCount = state['cfg']['avghard'])
+            state['fgdata'] = self.getSpectrometer().cmdMeasure(integrationTime = state['cfg']['inttime'], averageCount = state['cfg']['avghard'])
         else:
-            state['fgdata'] = self.spec.cmdMeasureSoftAverages(integrationTime = state['cfg']['inttime'], softAverages = state['cfg']['avgsoft'], hardAverages = state['cfg']['avghard'])
+            res = self.getSpectrometer().cmdMeasureSoftAverages(integrationTime = state['cfg']['inttime'], softAverages = state['cfg']['avgsoft'], hardAverages = state['cfg']['avghard'], statistics = True, method = state['cfg']['avgmethod'], sigma = state['cfg']['avgsigma'])
+            state['fgdata'] = res.mean.tolist()
+            rejected = res.rejected
+        state['fgkey'] = self.getAcquisitionKey(state)
         state['bgsubtracted'] = False
         if state['cfg']['verbose']:
             print("... done")
+            if rejected > 0:
+                print("Rejected {} outlier samples ({} averaging)".format(rejected, state['cfg']['avgmethod']))
+            saturated = self.proc.findSaturatedPixels(state['fgdata'], level = self.getSpectrometer().SATURATIONCOUNTS)
+            if len(saturated) > 0:
+                print("Warning: {} saturated pixels (first at index {})".format(len(saturated), saturated[0]))
         return state
 
-    def exec_measurebg(self, state, i):
-        # Run a measurement using out spectrometer and store in background data
+    def exec_autoexposure(self, state, args):
+        # Searches an integration time reaching the target fraction of full
+        # scale using single (hardware averaged) exposures
         if state['cfg']['verbose']:
-            print("Acquiring background data ...")
-        if state['cfg']['avgsoft'] == 1:
-            state['bgdata'] = self.spec.cmdMeasure(integrationTime = state['cfg']['inttime'], averageCount = state['cfg']['avghard'])
+            print("Searching integration time for {:.0f}% of full scale ...".format(float(args[0]) * 100))
+        res = self.getSpectrometer().cmdAutoExposure(
+            targetFraction = float(args[0]),
+            startIntegrationTime = state['cfg']['inttime'] if state['cfg']['inttime'] <= 100 else 10,
+            averageCount = state['cfg']['avghard']
+        )
+        state['cfg']['inttime'] = res.integrationTime
+        if state['cfg']['verbose']:
+            print("Selected integration time {} ms ({} counts, {:.1f}% of full scale, {} saturated pixels) after {} exposures{}".format(
+                res.integrationTime,
+                res.peakCounts,
+                res.fraction * 100,
+                res.saturated,
+                res.iterations,
+                "" if res.converged else " - target not reached"
+            ))
+        return state
+
+    def exec_measurebg(self, state, args):
+        # Run a measurement using out spectrometer and store in background data.
+        # Only when enabled by darkmaxage a background with the same settings
+        # from the dark frame library is reused as long as it is not older than
+        # darkmaxage. With darkmaxage 0 (default) the background is always
+        # measured and never stored in the library
+        if state['cfg']['darkmaxage'] == 0:
+            if state['cfg']['verbose']:
+                print("Acquiring background data ...")
+            if state['cfg']['avgsoft'] == 1:
+                state['bgdata'] = self.getSpectrometer().cmdMeasure(integrationTime = state['cfg']['inttime'], averageCount = state['cfg']['avghard'])
+            else:
+                state['bgdata'] = self.getSpectrometer().cmdMeasureSoftAverages(integrationTime = state['cfg']['inttime'], softAverages = state['cfg']['avgsoft'], hardAverages = state['cfg']['avghard'], method = state['cfg']['avgmethod'], sigma = state['cfg']['avgsigma'])
         else:
-            state['bgdata'] = self.spec.cmdMeasureSoftAverages(integrationTime = state['cfg']['inttime'], softAverages = state['cfg']['avgsoft'], hardAverages = state['cfg']['avghard'])
+            if state['cfg']['verbose']:
+                print("Acquiring background data (or using the dark frame library) ...")
+            data, cached = self.getDarkFrameLibrary(state).acquire(
+                self.getSpectrometer(),
+                integrationTime = state['cfg']['inttime'],
+                softAverages = state['cfg']['avgsoft'],
+                hardAverages = state['cfg']['avghard'],
+                method = state['cfg']['avgmethod'],
+                sigma = state['cfg']['avgsigma']
+            )
+            state['bgdata'] = data.tolist()
+            if cached and state['cfg']['verbose']:
+                print("Using cached background")
+        state['bgkey'] = self.getAcquisitionKey(state)
         if state['cfg']['verbose']:
             print("... done")
         return state
 
-    def exec_dump(self, state, i):
+    def exec_dump(self, state, args):
         if state['cfg']['verbose']:
             print("Foreground data:")
-        self.spec.dumpData(state['fgdata'])
+        self.proc.dumpData(state['fgdata'])
         return state
-    def exec_dumpbg(self, state, i):
+    def exec_dumpbg(self, state, args):
         if state['cfg']['verbose']:
             print("Background data:")
-        self.spec.dumpData(state['bgdata'])
+        self.proc.dumpData(state['bgdata'])
         return state
-    def exec_dumpf(self, state, i):
+    def exec_dumpf(self, state, args):
         if state['cfg']['verbose']:
-            print("Dumping foreground data in {}".format(sys.argv[i+1]))
-        self.spec.dumpData(state['fgdata'], filename = sys.argv[i+1])
+            print("Dumping foreground data in {}".format(args[0]))
+        self.proc.dumpData(state['fgdata'], filename = args[0])
         return state
 
-    def exec_dumppeak(self, state, i):
+    def exec_dumppeak(self, state, args):
         if not state['peaks']:
             if state['cfg']['verbose']:
                 print("Cannot dump peak data - no peaks acquired")
             return state
-        print("# peak fwhm idx counts fwhm_leftidx fwhm_rightidx fwhm_left fwhm_right")
-        for pk in state['peaks']:
-            print("{} {} {} {} {} {} {} {}".format(
-                pk['peak'],
-                pk['fwhm'],
-                pk['idx'],
-                pk['counts'],
-                pk['fwhm_leftidx'],
-                pk['fwhm_rightidx'],
-                pk['fwhm_left'],
-                pk['fwhm_right']
-            ))
+        self.proc.dumpPeaks(state['peaks'])
         return state
 
-    def exec_dumpfpeak(self, state, i):
+    def exec_dumpfpeak(self, state, args):
         if not state['peaks']:
             if state['cfg']['verbose']:
                 print("Cannot dump peak data - no peaks acquired")
             return state
         if state['cfg']['verbose']:
-            print("Dumping peak data into {}".format(sys.argv[i+1]))
-        with open(sys.argv[i+1], 'w') as f:
-            f.write("# peak fwhm idx counts fwhm_leftidx fwhm_rightidx fwhm_left fwhm_right\n")
-            for pk in state['peaks']:
-                f.write("{} {} {} {} {} {} {} {}\n".format(
-                    pk['peak'],
-                    pk['fwhm'],
-                    pk['idx'],
-                    pk['counts'],
-                    pk['fwhm_leftidx'],
-                    pk['fwhm_rightidx'],
-                    pk['fwhm_left'],
-                    pk['fwhm_right']
-                ))
-        return state
-
-    def exec_loadfpeak(self, state, i):
-        peaks = []
-
-        if state['cfg']['verbose']:
-            print("Loading peak data from {}".format(sys.argv[i+1]))
-        with open(sys.argv[i+1], 'r') as f:
-            lns = f.readlines()
-            for i in range(1, len(lns)):
-                parts = lns[i].split()
-                if len(parts) != 8:
-                    continue
-
-                peaks.append({
-                    'peak' : float(parts[0]),
-                    'fwhm' : float(parts[1]),
-                    'idx' : int(parts[2]),
-                    'counts' : float(parts[3]),
-                    'fwhm_leftidx' : int(parts[4]),
-                    'fwhm_rightidx' : int(parts[5]),
-                    'fwhm_left' : float(parts[6]),
-                    'fwhm_right' : float(parts[7])
-                })
-        state['peaks'] = peaks
+            print("Dumping peak data into {}".format(args[0]))
+        self.proc.dumpPeaks(state['peaks'], filename = args[0])
         return state
 
-    def exec_loadf(self, state, i):
+    def exec_loadfpeak(self, state, args):
         if state['cfg']['verbose']:
-            print("Loading foreground data from {}".format(sys.argv[i+1]))
-        state['fgdata'] = self.spec.loadData(sys.argv[i+1])
+            print("Loading peak data from {}".format(args[0]))
+        state['peaks'] = self.proc.loadPeaks(args[0])
         return state
 
-    def exec_loadfbg(self, state, i):
+    def exec_loadf(self, state, args):
         if state['cfg']['verbose']:
-            print("Loading background data from {}".format(sys.argv[i+1]))
-        state['bgdata'] = self.spec.loadData(sys.argv[i+1])
+            print("Loading foreground data from {}".format(args[0]))
+        state['fgdata'] = self.proc.loadData(args[0])
+        state['fgkey'] = None
+        return state
+
+    def exec_loadfbg(self, state, args):
+        if state['cfg']['verbose']:
+            print("Loading background data from {}".format(args[0]))
+        state['bgdata'] = self.proc.loadData(args[0])
+        state['bgkey'] = None
         return state
 
 
-    def exec_dumpfbg(self, state, i):
+    def exec_dumpfarc(self, state, args):
+        if not state['fgdata']:
+            if state['cfg']['verbose']:
+                print("Cannot append to archive - no foreground data present")
+            return state
+        if state['cfg']['verbose']:
+            print("Appending foreground data to archive {}".format(args[0]))
+        frame = np.asarray(state['fgdata'])
+        try:
+            writer = PyAvaSpecArchiveWriter(
+                args[0],
+                pixelCount = len(frame),
+                dtype = selectArchiveDtype(args[0], frame),
+                calibration = self.proc.getCalibration().coefficients,
+                integrationTime = state['cfg']['inttime'],
+                softAverages = state['cfg']['avgsoft'],
+                hardAverages = state['cfg']['avghard']
+            )
+        except PyAvaSpecArchiveException as e:
+            raise PyAvaSpecCliException("Cannot append to archive {}: {}".format(args[0], e))
+        with writer:
+            writer.append(frame)
+        return state
+
+    def exec_loadfarc(self, state, args):
         if state['cfg']['verbose']:
-            print("Dumping background data in {}".format(sys.argv[i+1]))
-        self.spec.dumpData(state['bgdata'], filename = sys.argv[i+1])
+            print("Loading foreground data from archive {} (frame {})".format(args[0], args[1]))
+        with PyAvaSpecArchive(args[0]) as archive:
+            state['fgdata'] = archive[int(args[1])].tolist()
+        state['fgkey'] = None
+        state['bgsubtracted'] = False
         return state
-    def exec_plotfmt(self, state, i):
-        newfmt = sys.argv[i+1]
+
+    def exec_dumpfbg(self, state, args):
+        if state['cfg']['verbose']:
+            print("Dumping background data in {}".format(args[0]))
+        self.proc.dumpData(state['bgdata'], filename = args[0])
+        return state
+    def exec_plotfmt(self, state, args):
+        newfmt = args[0]
         state['cfg']['plotformat'] = newfmt
         if state['cfg']['verbose']:
             print("Setting plot format to {}".format(newfmt))
         return state
 
-    def exec_plot(self, state, i):
-        self.spec.plotData(
+    def exec_plot(self, state, args):
+        self.proc.plotData(
             state['fgdata'],
             xrange = state['cfg']['xrange'],
             showtimeout = state['cfg']['plottimeout'],
             peaks = state['peaks'],
-            title = sys.argv[i+1]
+            title = args[0]
         )
         return state
-    def exec_plotf(self, state, i):
+    def exec_plotf(self, state, args):
         if state['cfg']['verbose']:
-            print("Storing foreground data in plot {}".format(sys.argv[i+1]))
-        self.spec.plotData(
+            print("Storing foreground data in plot {}".format(args[0]))
+        self.proc.plotData(
             state['fgdata'],
             xrange = state['cfg']['xrange'],
-            filename = sys.argv[i+1],
+            filename = args[0],
             fileformat = state['cfg']['plotformat'],
             peaks = state['peaks'],
-            title = sys.argv[i+2]
+            title = args[1]
         )
         return state
-    def exec_plotbg(self, state, i):
-        self.spec.plotData(
+    def exec_plotbg(self, state, args):
+        self.proc.plotData(
             state['bgdata'],
             xrange = state['cfg']['xrange'],
             showtimeout = state['cfg']['plottimeout'],
-            title = sys.argv[i+1]
+            title = args[0]
         )
         return state
-    def exec_plotfbg(self, state, i):
+    def exec_plotfbg(self, state, args):
         if state['cfg']['verbose']:
-            print("Storing background data in plot {}".format(sys.argv[i+1]))
-        self.spec.plotData(
+            print("Storing background data in plot {}".format(args[0]))
+        self.proc.plotData(
             state['bgdata'],
             xrange = state['cfg']['xrange'],
-            filename = sys.argv[i+1],
+            filename = args[0],
             fileformat = state['cfg']['plotformat'],
-            title = sys.argv[i+2]
+            title = args[1]
         )
         return state
-    def exec_subbg(self, state, i):
+    def exec_subbg(self, state, args):
         # Perform background subtraction
         if state['bgsubtracted']:
             if state['cfg']['verbose']:
                 print("Skipping background subtraction - already performed")
             return state
-        if not state['bgdata']:
-            if state['cfg']['verbose']:
-                print("Skipping background subtraction - no background data available")
-            return state
         if not state['fgdata']:
             if state['cfg']['verbose']:
                 print("Skipping background subtraction - no foreground data available")
             return state
 
+        # With the dark frame library enabled (darkmaxage > 0) a measured
+        # background only matches a measured foreground taken with the same
+        # settings, otherwise the library is consulted. Without it the
+        # background is subtracted as before and a mismatch is only reported
+        bgdata = state['bgdata']
+        mismatch = bool(bgdata and state['fgkey'] and state['bgkey'] and (state['bgkey'] != state['fgkey']))
+        if mismatch and (state['cfg']['darkmaxage'] == 0):
+            if state['cfg']['verbose']:
+                print("Warning: background has been taken with different settings than the foreground")
+        elif mismatch:
+            bgdata = None
+        if (not bgdata) and state['fgkey'] and (state['cfg']['darkmaxage'] != 0):
+            cached = self.getDarkFrameLibrary(state).get(*state['fgkey'][:4], method = state['fgkey'][4], sigma = state['fgkey'][5])
+            if cached is not None:
+                if state['cfg']['verbose']:
+                    print("Using background from dark frame library")
+                bgdata = cached.tolist()
+        if not bgdata:
+            if state['cfg']['verbose']:
+                print("Skipping background subtraction - no background data available")
+            return state
+
         if state['cfg']['verbose']:
             print("Performing background subtraction")
 
         for i in range(len(state['fgdata'])):
-            state['fgdata'][i] = state['fgdata'][i] - state['bgdata'][i]
+            state['fgdata'][i] = state['fgdata'][i] - bgdata[i]
 
         state['bgsubtracted'] = True
 
         return state
-    def exec_moveavg(self, state, i):
+    def exec_moveavg(self, state, args):
         wndsize = state['cfg']['peakavgwindow']
 
         if not state['fgdata']:
@@ -335,38 +537,45 @@ class PyAvaSpecCli:
         if state['cfg']['verbose']:
             print("Performing moving average filtering on data (window size {})".format(wndsize))
 
-        state['fgdata'] = self.spec.applyMovingAverage(state['fgdata'], windowSize = wndsize)
+        state['fgdata'] = self.proc.applyMovingAverage(state['fgdata'], windowSize = wndsize)
         return state
 
-    def exec_peaks(self, state, i):
+    def exec_peaks(self, state, args):
         if not state['fgdata']:
             if state['cfg']['verbose']:
                 print("Cannot perform peak search - no data present")
             return state
 
-        state['peaks'] = self.spec.searchPeaks(state['fgdata'], maxPeaks = state['cfg']['peakmaxcount'])
+        state['peaks'] = self.proc.searchPeaks(
+            state['fgdata'],
+            maxPeaks = state['cfg']['peakmaxcount'],
+            minHeight = state['cfg']['peakminheight'],
+            minProminence = state['cfg']['peakminprominence'],
+            minDistance = state['cfg']['peakmindistance']
+        )
         return state
 
-    def exec_SDG1032XDEV(self, state, i):
+    def exec_SDG1032XDEV(self, state, args):
         if state['sdg1032x']:
             state['sdg1032x'].close()
             state['sdg1032x'] = None
             state['cfg']['sdg1032xdev'] = None
 
         if state['cfg']['verbose']:
-            print("Connecting to SDG1032X at {}".format(sys.argv[i+1]))
+            print("Connecting to SDG1032X at {}".format(args[0]))
 
-        state['cfg']['sdg1032xdev'] = sys.argv[i+1]
-        state['sdg1032x'] = SDG1032X(sys.argv[i+1])
+        state['cfg']['sdg1032xdev'] = args[0]
+        from sdg1032x.sdg1032x import SDG1032X
+        state['sdg1032x'] = SDG1032X(args[0])
         return state
-    def exec_SDG1032XChannel(self, state, i):
-        newchan = int(sys.argv[i+1])
+    def exec_SDG1032XChannel(self, state, args):
+        newchan = int(args[0])
         state['cfg']['sdg1032xch'] = newchan
         if state['cfg']['verbose']:
             print("Setting SDG1032X channel to {}".format(newchan))
         return state
-    def exec_SDG1032XFrequency(self, state, i):
-        newfreq = float(sys.argv[i+1])
+    def exec_SDG1032XFrequency(self, state, args):
+        newfreq = float(args[0])
         if not state['sdg1032x']:
             if state['cfg']['verbose']:
                 print("Failed to set frequency on SDG1032X, not connected")
@@ -375,8 +584,8 @@ class PyAvaSpecCli:
             print("Setting SDG1032X frequency on channel {} to {} Hz".format(state['cfg']['sdg1032xch'], newfreq))
         state['sdg1032x'].setWaveFrequency(newfreq, state['cfg']['sdg1032xch'])
         return state
-    def exec_SDG1032XPeriod(self, state, i):
-        newfreq = float(sys.argv[i+1])
+    def exec_SDG1032XPeriod(self, state, args):
+        newfreq = float(args[0])
         if not state['sdg1032x']:
             if state['cfg']['verbose']:
                 print("Failed to set period on SDG1032X, not connected")
@@ -385,7 +594,7 @@ class PyAvaSpecCli:
             print("Setting SDG1032X period on channel {} to {} s".format(state['cfg']['sdg1032xch'], newfreq))
         state['sdg1032x'].setWavePeriod(newfreq, channel = state['cfg']['sdg1032xch'])
         return state
-    def exec_GateOn(self, state, i):
+    def exec_GateOn(self, state, args):
         if state['sdg1032x']:
             if state['cfg']['verbose']:
                 print("Enabling channel {} on SDG1032X".format(state['cfg']['sdg1032xch']))
@@ -394,7 +603,7 @@ class PyAvaSpecCli:
             if state['cfg']['verbose']:
                 print("Failed to enable gate, no control device connected")
         return state
-    def exec_GateOff(self, state, i):
+    def exec_GateOff(self, state, args):
         if state['sdg1032x']:
             if state['cfg']['verbose']:
                 print("Disabling channel {} on SDG1032X".format(state['cfg']['sdg1032xch']))
@@ -404,8 +613,105 @@ class PyAvaSpecCli:
                 print("Failed to disable gate, no control device connected")
         return state
 
-    def exec_sleep(self, state, i):
-        sleeptime = int(sys.argv[i+1])
+    def exec_darkcache(self, state, args):
+        if args[0] == "none":
+            state['cfg']['darkcache'] = None
+        elif args[0] == "default":
+            state['cfg']['darkcache'] = defaultDarkFrameLibraryFile()
+        else:
+            state['cfg']['darkcache'] = args[0]
+        if state['cfg']['verbose']:
+            print("Setting dark frame library file to {}".format(state['cfg']['darkcache']))
+        return state
+    def exec_darkmaxage(self, state, args):
+        state['cfg']['darkmaxage'] = int(args[0])
+        if state['cfg']['verbose']:
+            print("Setting maximum age of reused backgrounds to {} s".format(state['cfg']['darkmaxage']))
+        return state
+    def exec_darkinterp(self, state, args):
+        state['cfg']['darkinterp'] = (args[0] == "on")
+        if state['cfg']['verbose']:
+            print("Setting background interpolation {}".format(args[0]))
+        return state
+    def exec_darkclear(self, state, args):
+        if state['cfg']['verbose']:
+            print("Clearing dark frame library")
+        self.getDarkFrameLibrary(state).clear()
+        return state
+
+    def exec_reflib(self, state, args):
+        state['cfg']['reflib'] = args[0]
+        if state['cfg']['verbose']:
+            print("Setting reference library to {}".format(args[0]))
+        return state
+    def exec_refmethod(self, state, args):
+        state['cfg']['refmethod'] = args[0]
+        if state['cfg']['verbose']:
+            print("Setting similarity measure to {}".format(args[0]))
+        return state
+    def exec_identify(self, state, args):
+        # Compares the foreground (usually after bgsub) against all references
+        if not state['fgdata']:
+            if state['cfg']['verbose']:
+                print("Cannot identify spectrum - no foreground data present")
+            return state
+        if not state['cfg']['reflib']:
+            raise PyAvaSpecCliException("No reference library selected (reflib)")
+        state['matches'] = self.getReferenceLibrary(state).search(
+            state['fgdata'],
+            top = int(args[0]),
+            method = state['cfg']['refmethod'],
+            calibration = self.proc.getCalibration()
+        )
+        for match in state['matches']:
+            print("{:8.5f} {}".format(match['score'], match['name']))
+        return state
+
+    def exec_profile(self, state, args):
+        # Profiling covers everything executed after this option, the summary
+        # is written when the command sequence has finished
+        PROFILER.reset()
+        PROFILER.enable()
+        state['cfg']['profile'] = args[0]
+        return state
+
+    def exec_kinetics(self, state, args):
+        # Time series into a binary archive: N frames or a duration ("60s"),
+        # interval 0 captures at maximum rate
+        frames, duration = None, None
+        if args[1].endswith("s"):
+            duration = float(args[1][:-1])
+        else:
+            frames = int(args[1])
+        interval = float(args[2])
+        if state['cfg']['verbose']:
+            print("Capturing {} into {} ({}) ...".format(
+                "{} frames".format(frames) if frames != None else "for {} s".format(duration),
+                args[0],
+                "every {} s".format(interval) if interval > 0 else "maximum rate"
+            ))
+        spec = self.getSpectrometer()
+        with spec.cmdMeasureKinetics(
+            args[0],
+            integrationTime = state['cfg']['inttime'],
+            averageCount = state['cfg']['avghard'],
+            softAverages = state['cfg']['avgsoft'],
+            frames = frames,
+            duration = duration,
+            interval = interval
+        ) as capture:
+            try:
+                capture.wait()
+            except KeyboardInterrupt:
+                if state['cfg']['verbose']:
+                    print("Capture interrupted")
+        if state['cfg']['verbose']:
+            stats = capture.getStatistics()
+            print("... done, {} frames written in {:.3f} s ({:.1f} frames/s, {} late)".format(stats['written'], stats['elapsed'], stats['rate'] or 0, stats['late']))
+        return state
+
+    def exec_sleep(self, state, args):
+        sleeptime = float(args[0])
         if state['cfg']['verbose']:
             print("Sleeping for {} seconds".format(sleeptime))
         time.sleep(sleeptime)
@@ -415,9 +721,20 @@ class PyAvaSpecCli:
         'inttime'          : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_inttime",       'exec' : "exec_inttime",           'desc' : "Set integration time in milliseconds"                                          },
         'avgsoft'          : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_avgcount_soft", 'exec' : "exec_avgsoft",           'desc' : "Set software averaging times (default 1)"                                      },
         'avghard'          : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_avgcount_hard", 'exec' : "exec_avghard",           'desc' : "Set hardware averaging times (default 1)"                                      },
+        'avgmethod'        : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_avgmethod",     'exec' : "exec_avgmethod",         'desc' : "Set software averaging method (mean, median, sigmaclip or spikes, default mean)" },
+        'avgsigma'         : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_avgsigma",      'exec' : "exec_avgsigma",          'desc' : "Set outlier rejection threshold of sigmaclip and spikes averaging (default 3)" },
         'avg'              : { 'nargs' : 2, 'parsevalidate' : "parsevalidate_avgcount",      'exec' : "exec_avg",               'desc' : "Set SOFTWARE and HARDWARE average (default 1 and 1)"                           },
         'peakmaxcount'     : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_peakmaxcount",  'exec' : "exec_maxpeaks",          'desc' : "Set maximum peak count during peak search (default 1)"                         },
         'peakavgwindow'    : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_peakavgwindow", 'exec' : "exec_peakavgwindow",     'desc' : "Set moving average window size (default 10)"                                   },
+        'peakminheight'    : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_peakminheight", 'exec' : "exec_peakminheight",     'desc' : "Set minimum height (counts) of detected peaks (default none)"                  },
+        'peakminprominence': { 'nargs' : 1, 'parsevalidate' : "parsevalidate_peakminprominence", 'exec' : "exec_peakminprominence", 'desc' : "Set minimum prominence (counts) of detected peaks (default none)"          },
+        'peakmindistance'  : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_peakmindistance", 'exec' : "exec_peakmindistance",  'desc' : "Set minimum distance (pixels) between detected peaks (default none)"           },
+        'calibration'      : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_calibration",   'exec' : "exec_calibration",       'desc' : "Set wavelength calibration (comma separated coefficients, highest order first, or JSON file)" },
+        'darkcache'        : { 'nargs' : 1,                                                  'exec' : "exec_darkcache",         'desc' : "Set file of the persistent dark frame library (default uses the user cache, none keeps it in memory only)" },
+        'darkmaxage'       : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_darkmaxage",    'exec' : "exec_darkmaxage",        'desc' : "Reuse backgrounds with the same settings up to N seconds old (default 0 always measures and never stores)" },
+        'darkinterp'       : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_darkinterp",    'exec' : "exec_darkinterp",        'desc' : "Interpolate missing backgrounds between cached integration times in bgsub (on or off)" },
+        'darkclear'        : { 'nargs' : 0,                                                  'exec' : "exec_darkclear",         'desc' : "Remove all backgrounds from the dark frame library"                            },
+        'autoexposure'     : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_autoexposure",  'exec' : "exec_autoexposure",      'desc' : "Select the integration time so the highest pixel reaches the given fraction of full scale" },
         'measure'          : { 'nargs' : 0,                                                  'exec' : "exec_measure",           'desc' : "Acquire signal"                                                                },
         'measurebg'        : { 'nargs' : 0,                                                  'exec' : "exec_measurebg",         'desc' : "Acquire background"                                                            },
         'loadf'            : { 'nargs' : 1,                                                  'exec' : "exec_loadf",             'desc' : "Load signal (foreground) from specified file"                                  },
@@ -427,6 +744,8 @@ class PyAvaSpecCli:
         'dumpbg'           : { 'nargs' : 0,                                                  'exec' : "exec_dumpbg",            'desc' : "Dump background to stdout"                                                     },
         'dumpf'            : { 'nargs' : 1,                                                  'exec' : "exec_dumpf",             'desc' : "Dump foreground data into supplied filename"                                   },
         'dumpfbg'          : { 'nargs' : 1,                                                  'exec' : "exec_dumpfbg",           'desc' : "Dump background data into supplied filename"                                   },
+        'dumpfarc'         : { 'nargs' : 1,                                                  'exec' : "exec_dumpfarc",          'desc' : "Append foreground data to the supplied binary archive"                         },
+        'loadfarc'         : { 'nargs' : 2, 'parsevalidate' : "parsevalidate_loadfarc",      'exec' : "exec_loadfarc",          'desc' : "Load frame N (negative counts from end) of binary archive as foreground"        },
         'dumppeak'         : { 'nargs' : 0,                                                  'exec' : "exec_dumppeak",          'desc' : "Dump peak data on stdout"                                                      },
         'dumpfpeak'        : { 'nargs' : 1,                                                  'exec' : "exec_dumpfpeak",         'desc' : "Dump peak data into supplied filename"                                         },
         'plotformat'       : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_plotformat",    'exec' : "exec_plotfmt",           'desc' : "Select plot format png or svg"                                                 },
@@ -437,10 +756,15 @@ class PyAvaSpecCli:
         'bgsub'            : { 'nargs' : 0,                                                  'exec' : "exec_subbg",             'desc' : "Subtract recorded background"                                                  },
         'moveavg'          : { 'nargs' : 0,                                                  'exec' : "exec_moveavg",           'desc' : "Apply moving average filter"                                                   },
         'peaks'            : { 'nargs' : 0,                                                  'exec' : "exec_peaks",             'desc' : "Perform peak search (usually requires subbg and moveavg)"                      },
+        'reflib'           : { 'nargs' : 1,                                                  'exec' : "exec_reflib",            'desc' : "Select the reference library file (built with avaref)"                        },
+        'refmethod'        : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_refmethod",     'exec' : "exec_refmethod",         'desc' : "Select the similarity measure for identify (cosine or correlation)"            },
+        'identify'         : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_identify",      'exec' : "exec_identify",          'desc' : "Print the N most similar spectra of the reference library (usually after bgsub)" },
+        'kinetics'         : { 'nargs' : 3, 'parsevalidate' : "parsevalidate_kinetics",      'exec' : "exec_kinetics",          'desc' : "Capture a time series into binary archive FILE: N frames (or Ns seconds) every INTERVAL seconds (0 = maximum rate)" },
         'gateon'           : { 'nargs' : 0,                                                  'exec' : "exec_GateOn",            'desc' : "Enable attached gate (SDG1032X or similar) - enable light source"              },
         'gateoff'          : { 'nargs' : 0,                                                  'exec' : "exec_GateOff",           'desc' : "Disable attached gate (SDG1032X or similar) - i.e. disable light source"       },
         'sleep'            : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_sleep",         'exec' : "exec_sleep",             'desc' : "Sleep for the specified amount of seconds before proceeding"                   },
 
+        '--profile'        : { 'nargs' : 1,                                                  'exec' : "exec_profile",           'desc' : "Collect timings and counters, write a JSON summary to the supplied file (- for stdout) when done" },
         '--sdg1032xdev'    : { 'nargs' : 1,                                                  'exec' : "exec_SDG1032XDEV",       'desc' : "Select hostname or IP of SDG1032X function generator for gating"               },
         '--sdg1032xch'     : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_sdg1032xCh",    'exec' : "exec_SDG1032XChannel",   'desc' : "Set channel of SDG1032X function generator for gate function"                  },
         '--sdg1032xfrq'    : { 'nargs' : 1, 'parsevalidate' : "parsevalidate_sdg1032xFrq",   'exec' : "exec_SDG1032XFrequency", 'desc' : "Set frequency of the SDG1032X function generator"                              },
@@ -458,20 +782,39 @@ class PyAvaSpecCli:
         print("")
         for cmd in self.commandsAndOptions:
             print("{}\t{}".format(cmd, self.commandsAndOptions[cmd]['desc']))
+        print("")
+        print("Control keywords:")
+        print("")
+        for cmd in self.controlKeywords:
+            print("{}\t{}".format(cmd, self.controlKeywords[cmd]))
 
     def getDefaultConfiguration(self):
         return {
             'inttime'       : 1000,
             'avgsoft'       : 1,
             'avghard'       : 1,
+            'avgmethod'     : 'mean',
+            'avgsigma'      : 3.0,
             'peakmaxcount'  : 1,
             'peakavgwindow' : 10,
+            'peakminheight'     : None,
+            'peakminprominence' : None,
+            'peakmindistance'   : None,
             'plotformat'    : 'png',
             'plottitle'     : 'Spectrometer output',
             'plottimeout'   : 0,
 
             'xrange'        : None,
 
+            'profile'       : None,
+
+            'darkcache'     : None,
+            'darkmaxage'    : 0,
+            'darkinterp'    : False,
+
+            'reflib'        : None,
+            'refmethod'     : 'cosine',
+
             'sdg1032xdev'   : None,
             'sdg1032xch'    : 1,
 
@@ -483,39 +826,284 @@ class PyAvaSpecCli:
             'bgdata'       : None,
             'fgdata'       : None,
             'peaks'        : None,
+            'matches'      : None,
             'bgsubtracted' : False,
-            'sdg1032x'     : None
+            'fgkey'        : None,
+            'bgkey'        : None,
+            'sdg1032x'     : None,
+            'vars'         : {}
         }
 
-    def parseCommandOptions_Validation(self):
-        skipEntries = 0
-        for i in range(1, len(sys.argv)):
-            if skipEntries > 0:
-                skipEntries = skipEntries - 1
-                continue
-            cmd = sys.argv[i].strip()
+    # Command sequences are compiled once into a plan (nested list of steps)
+    # that is validated before anything is executed. Besides the commands
+    # above the following control keywords are supported:
+    #
+    #   repeat N ... end              Execute the enclosed commands N times, the
+    #                                 iteration (starting at 0) is available as {i}
+    #   if QUANTITY OP VALUE ... [else ...] end
+    #                                 Conditional execution depending on the peak
+    #                                 search result or data (see conditionQuantities)
+    #   break                         Leave the innermost repeat loop
+    #   set NAME VALUE                Set variable NAME
+    #   inc NAME [STEP]               Increment variable NAME (starting at 0)
+    #   script FILENAME               Include commands from a script file (# starts a comment)
+    #
+    # Arguments may reference variables using Python format syntax, for
+    # example "dumpf spectrum_{i:04d}.dat". Such arguments are validated
+    # after substitution when the step is executed.
+
+    controlKeywords = {
+        'repeat' : "repeat N ... end - Repeat the enclosed commands N times ({i} is the iteration)",
+        'if'     : "if QUANTITY OP VALUE ... [else ...] end - Conditional execution",
+        'else'   : "Alternative branch of an if block",
+        'end'    : "Terminates repeat and if blocks",
+        'break'  : "Leave the innermost repeat loop",
+        'set'    : "set NAME VALUE - Set a variable usable as {NAME} in arguments",
+        'inc'    : "inc NAME [STEP] - Increment variable NAME (default step 1, starting at 0)",
+        'script' : "script FILENAME - Include commands from the supplied script file"
+    }
+
+    conditionOperators = {
+        '<'  : lambda a, b: a < b,
+        '<=' : lambda a, b: a <= b,
+        '>'  : lambda a, b: a > b,
+        '>=' : lambda a, b: a >= b,
+        '==' : lambda a, b: a == b,
+        '!=' : lambda a, b: a != b
+    }
+
+    def conditionQuantity(self, state, name):
+        # Quantities usable in if conditions. Peak quantities refer to the highest peak
+        peaks = state['peaks'] or []
+        if name == "peakcount":
+            return len(peaks)
+        if name == "maxcounts":
+            return max(state['fgdata']) if state['fgdata'] else None
+        if name == "matchscore":
+            return state['matches'][0]['score'] if state['matches'] else None
+        if not peaks:
+            return None
+        if name == "peakcounts":
+            return float(peaks[0]['counts'])
+        if name == "peakwavelength":
+            return float(peaks[0]['peak'])
+        if name == "peakfwhm":
+            return float(peaks[0]['fwhm'])
+        raise PyAvaSpecCliException("Unknown condition quantity {}".format(name))
 
-            if not cmd in self.commandsAndOptions:
-                raise PyAvaSpecCliException("Unknown command {}".format(cmd))
+    conditionQuantities = [ "peakcount", "peakcounts", "peakwavelength", "peakfwhm", "maxcounts", "matchscore" ]
 
-            if 'parsevalidate' in self.commandsAndOptions[cmd]:
-                getattr(self, self.commandsAndOptions[cmd].get("parsevalidate"))(i)
-            skipEntries = self.commandsAndOptions[cmd]['nargs']
+    def loadScript(self, filename):
+        try:
+            with open(filename, 'r') as f:
+                return shlex.split(f.read(), comments = True)
+        except OSError as e:
+            raise PyAvaSpecCliException("Failed to read script {}: {}".format(filename, e))
 
-    def executeCommands(self):
+    def compileCommands(self, tokens, pos = 0, terminators = [], includeDepth = 0):
+        # Returns the compiled steps, the position after the block and the
+        # terminator keyword that ended the block (None at the end of tokens)
+        steps = []
+        while pos < len(tokens):
+            cmd = tokens[pos].strip()
+
+            if cmd in terminators:
+                return steps, pos + 1, cmd
+            if cmd in [ "end", "else" ]:
+                raise PyAvaSpecCliException("Unexpected {} without matching block".format(cmd))
+
+            if cmd == "repeat":
+                if pos + 1 >= len(tokens):
+                    raise PyAvaSpecCliException("Missing repeat count")
+                try:
+                    count = int(tokens[pos+1])
+                    if count < 0:
+                        raise ValueError()
+                except ValueError:
+                    raise PyAvaSpecCliException("Repeat count {} is not a valid non negative number".format(tokens[pos+1]))
+                body, pos, term = self.compileCommands(tokens, pos + 2, [ "end" ], includeDepth)
+                if term != "end":
+                    raise PyAvaSpecCliException("Missing end for repeat block")
+                steps.append({ 'type' : 'repeat', 'count' : count, 'body' : body })
+            elif cmd == "if":
+                if pos + 3 >= len(tokens):
+                    raise PyAvaSpecCliException("Incomplete if condition")
+                quantity, op, value = tokens[pos+1], tokens[pos+2], tokens[pos+3]
+                if quantity not in self.conditionQuantities:
+                    raise PyAvaSpecCliException("Unknown condition quantity {}, supported are {}".format(quantity, ", ".join(self.conditionQuantities)))
+                if op not in self.conditionOperators:
+                    raise PyAvaSpecCliException("Unknown comparison operator {}".format(op))
+                if "{" not in value:
+                    try:
+                        float(value)
+                    except ValueError:
+                        raise PyAvaSpecCliException("Condition value {} is not a valid numeric expression".format(value))
+                body, pos, term = self.compileCommands(tokens, pos + 4, [ "else", "end" ], includeDepth)
+                elseBody = []
+                if term == "else":
+                    elseBody, pos, term = self.compileCommands(tokens, pos, [ "end" ], includeDepth)
+                if term != "end":
+                    raise PyAvaSpecCliException("Missing end for if block")
+                steps.append({ 'type' : 'if', 'quantity' : quantity, 'op' : self.conditionOperators[op], 'value' : value, 'body' : body, 'else' : elseBody })
+            elif cmd == "break":
+                steps.append({ 'type' : 'break' })
+                pos = pos + 1
+            elif cmd == "set":
+                if pos + 2 >= len(tokens):
+                    raise PyAvaSpecCliException("set requires a variable name and a value")
+                steps.append({ 'type' : 'set', 'name' : tokens[pos+1], 'value' : tokens[pos+2] })
+                pos = pos + 3
+            elif cmd == "inc":
+                if pos + 1 >= len(tokens):
+                    raise PyAvaSpecCliException("inc requires a variable name")
+                name = tokens[pos+1]
+                step = 1
+                pos = pos + 2
+                if (pos < len(tokens)) and tokens[pos].lstrip("-").isdigit():
+                    step = int(tokens[pos])
+                    pos = pos + 1
+                steps.append({ 'type' : 'inc', 'name' : name, 'step' : step })
+            elif cmd == "script":
+                if pos + 1 >= len(tokens):
+                    raise PyAvaSpecCliException("Missing script filename")
+                if includeDepth > 16:
+                    raise PyAvaSpecCliException("Scripts nested too deeply (recursive include?)")
+                included, _, _ = self.compileCommands(self.loadScript(tokens[pos+1]), 0, [], includeDepth + 1)
+                steps.extend(included)
+                pos = pos + 2
+            else:
+                if not cmd in self.commandsAndOptions:
+                    raise PyAvaSpecCliException("Unknown command {}".format(cmd))
+                desc = self.commandsAndOptions[cmd]
+                args = tokens[pos + 1 : pos + 1 + desc['nargs']]
+                if len(args) != desc['nargs']:
+                    raise PyAvaSpecCliException("Command {} requires {} arguments".format(cmd, desc['nargs']))
+
+                validate = getattr(self, desc['parsevalidate']) if 'parsevalidate' in desc else None
+                templated = len([ a for a in args if "{" in a ]) > 0
+                if validate and not templated:
+                    validate(args)
+                steps.append({
+                    'type'      : 'cmd',
+                    'name'      : cmd,
+                    'exec'      : getattr(self, desc['exec']) if 'exec' in desc else None,
+                    'validate'  : validate,
+                    'args'      : args,
+                    'templated' : templated
+                })
+                pos = pos + 1 + desc['nargs']
+
+        return steps, pos, None
+
+    def substituteArguments(self, state, args):
+        try:
+            return [ a.format_map(state['vars']) if "{" in a else a for a in args ]
+        except (KeyError, ValueError, IndexError) as e:
+            raise PyAvaSpecCliException("Failed to substitute variables in {}: {}".format(" ".join(args), e))
+
+    def runPlan(self, state, steps):
+        # Executes compiled steps, returns False if a break has been requested
+        for step in steps:
+            stype = step['type']
+            if stype == 'cmd':
+                args = step['args']
+                if step['templated']:
+                    args = self.substituteArguments(state, args)
+                    if step['validate']:
+                        step['validate'](args)
+                if step['exec']:
+                    with PROFILER.stage("cli." + step['name']):
+                        state = step['exec'](state, args)
+            elif stype == 'repeat':
+                # The iteration variable of an enclosing loop is restored,
+                # outside of any loop {i} stays undefined
+                hadPrevious = 'i' in state['vars']
+                previous = state['vars'].get('i')
+                try:
+                    for iteration in range(step['count']):
+                        state['vars']['i'] = iteration
+                        if not self.runPlan(state, step['body']):
+                            break
+                finally:
+                    if hadPrevious:
+                        state['vars']['i'] = previous
+                    else:
+                        state['vars'].pop('i', None)
+            elif stype == 'if':
+                current = self.conditionQuantity(state, step['quantity'])
+                value = float(self.substituteArguments(state, [ step['value'] ])[0])
+                if (current != None) and step['op'](current, value):
+                    branch = step['body']
+                else:
+                    branch = step['else']
+                if not self.runPlan(state, branch):
+                    return False
+            elif stype == 'break':
+                return False
+            elif stype == 'set':
+                value = self.substituteArguments(state, [ step['value'] ])[0]
+                try:
+                    value = int(value)
+                except ValueError:
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        pass
+                state['vars'][step['name']] = value
+            elif stype == 'inc':
+                state['vars'][step['name']] = state['vars'].get(step['name'], 0) + step['step']
+        return True
+
+    def parseCommandOptions_Validation(self, tokens = None):
+        if tokens == None:
+            tokens = sys.argv[1:]
+        self.plan, _, _ = self.compileCommands(tokens)
+        return self.plan
+
+    def executeCommands(self, plan = None):
+        if plan == None:
+            plan = self.plan
         state = self.initializeState()
-        skipEntries = 0
-        for i in range(1, len(sys.argv)):
-            if skipEntries > 0:
-                skipEntries = skipEntries - 1
-                continue
-            cmd = sys.argv[i].strip()
-            if 'exec' in self.commandsAndOptions[cmd]:
-                state = getattr(self, self.commandsAndOptions[cmd].get("exec"))(state, i)
-            skipEntries = self.commandsAndOptions[cmd]['nargs']
+        try:
+            self.runPlan(state, plan)
+        finally:
+            if state['cfg']['profile']:
+                PROFILER.disable()
+                PROFILER.dumpJson(state['cfg']['profile'])
+        return state
 
     def __init__(self):
-        self.spec = PyAvaSpec_2048_2()
+        # The spectrometer is only opened by the first command that acquires
+        # data so pure post processing runs do not require a device
+        self.spec = None
+        self.proc = PyAvaSpecProcessing()
+        self.darkLibrary = None
+        self.referenceLibrary = None
+        self.plan = []
+
+    def getAcquisitionKey(self, state):
+        # Device and settings a measurement has been taken with (dark frame library key)
+        return PyAvaSpecDarkFrameLibrary.makeKey(self.getSpectrometer().serial, state['cfg']['inttime'], state['cfg']['avgsoft'], state['cfg']['avghard'], state['cfg']['avgmethod'], state['cfg']['avgsigma'])
+
+    def getDarkFrameLibrary(self, state):
+        # Created on first use, recreated when the library file changes
+        if (self.darkLibrary == None) or (self.darkLibrary.filename != state['cfg']['darkcache']):
+            self.darkLibrary = PyAvaSpecDarkFrameLibrary(state['cfg']['darkcache'])
+        self.darkLibrary.maxAge = state['cfg']['darkmaxage']
+        self.darkLibrary.interpolate = state['cfg']['darkinterp']
+        return self.darkLibrary
+
+    def getReferenceLibrary(self, state):
+        if (self.referenceLibrary == None) or (self.referenceLibrary.filename != state['cfg']['reflib']):
+            if not os.path.isfile(state['cfg']['reflib']):
+                raise PyAvaSpecCliException("Reference library {} does not exist".format(state['cfg']['reflib']))
+            self.referenceLibrary = PyAvaSpecReferenceLibrary(state['cfg']['reflib'])
+        return self.referenceLibrary
+
+    def getSpectrometer(self):
+        if not self.spec:
+            self.spec = PyAvaSpec_2048_2()
+        return self.spec
 
     def __enter__(self):
         return self
@@ -0,0 +1,197 @@
+import numpy as np
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+class PyAvaSpecAverageResult:
+    # count is the number of stacked frames, counts the number of samples
+    # per pixel that entered the average (lower than count where samples have
+    # been rejected by robust stacking) and rejected the total number of
+    # rejected samples
+    def __init__(self, mean, variance, minimum, maximum, count, counts = None, rejected = 0):
+        self.mean = mean
+        self.variance = variance
+        self.std = np.sqrt(variance)
+        self.min = minimum
+        self.max = maximum
+        self.count = count
+        self.counts = counts if counts is not None else np.full(len(mean), count, dtype = np.int64)
+        self.rejected = rejected
+
+    def stderr(self):
+        # Standard error of the mean per pixel
+        if self.count < 1:
+            return np.zeros_like(self.mean)
+        return self.std / np.sqrt(np.maximum(self.counts, 1))
+
+    def snr(self):
+        # Per pixel signal to noise ratio of a single frame (mean / std),
+        # pixels without any spread are reported as infinite
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            res = np.abs(self.mean) / self.std
+        res[self.std == 0] = np.inf
+        return res
+
+class PyAvaSpecAccumulator:
+    # Streaming per pixel statistics (Welford's algorithm). Every update is a
+    # fixed number of in place array operations on preallocated buffers so
+    # accumulating does not allocate per frame.
+
+    def __init__(self, pixelCount = 2048):
+        self.pixelCount = pixelCount
+        self.mean = np.zeros(pixelCount, dtype = np.float64)
+        self.m2 = np.zeros(pixelCount, dtype = np.float64)
+        self.minimum = np.full(pixelCount, np.inf)
+        self.maximum = np.full(pixelCount, -np.inf)
+        self.delta = np.zeros(pixelCount, dtype = np.float64)
+        self.delta2 = np.zeros(pixelCount, dtype = np.float64)
+        self.count = 0
+
+    def reset(self):
+        self.mean.fill(0)
+        self.m2.fill(0)
+        self.minimum.fill(np.inf)
+        self.maximum.fill(-np.inf)
+        self.count = 0
+
+    def update(self, frame):
+        if len(frame) != self.pixelCount:
+            raise ValueError("Frame has {} pixels, accumulator expects {}".format(len(frame), self.pixelCount))
+
+        self.count = self.count + 1
+        np.subtract(frame, self.mean, out = self.delta)
+        np.divide(self.delta, self.count, out = self.delta2)
+        self.mean += self.delta2
+        np.subtract(frame, self.mean, out = self.delta2)
+        self.delta2 *= self.delta
+        self.m2 += self.delta2
+        np.minimum(self.minimum, frame, out = self.minimum)
+        np.maximum(self.maximum, frame, out = self.maximum)
+
+    def result(self):
+        if self.count < 1:
+            raise ValueError("No frames have been accumulated")
+        if self.count > 1:
+            variance = self.m2 / (self.count - 1)
+        else:
+            variance = np.zeros(self.pixelCount, dtype = np.float64)
+        return PyAvaSpecAverageResult(self.mean.copy(), variance, self.minimum.copy(), self.maximum.copy(), self.count)
+
+# Robust stacking
+#
+# A (frames x pixels) stack is reduced per pixel with one of the following
+# methods. All of them work on whole pixel blocks at once; stacks larger than
+# STACKCHUNKELEMENTS samples are processed in blocks of pixels so the working
+# memory stays bounded (also for memory mapped archives):
+#
+#   mean        Plain mean, nothing is rejected
+#   median      Per pixel median (std is the spread of all samples)
+#   sigmaclip   Samples further than sigma standard deviations from the center
+#               are rejected iteratively. The first pass uses median and MAD so
+#               a single large outlier cannot hide itself by inflating the std,
+#               later passes mean and std of the remaining samples
+#   spikes      Samples deviating by more than sigma times the per pixel noise
+#               from the median of the neighbouring frames (window frames
+#               centered on the sample) are rejected. Short spikes (cosmic rays, gate glitches) are removed
+#               while slow drifts of the signal are followed
+#
+# The noise estimate is limited to at least minScale counts so quantized,
+# nearly noise free pixels do not reject every sample off the center.
+
+STACKMETHODS = [ "mean", "median", "sigmaclip", "spikes" ]
+STACKCHUNKELEMENTS = 1 << 21
+MADSCALE = 1.4826
+
+def poolScale(scale, poolWidth, minScale):
+    # Noise estimates from a few frames scatter strongly. The estimate of a
+    # pixel is raised to the median of its poolWidth neighbours (the noise
+    # changes slowly along the spectrum) and to at least minScale
+    if poolWidth > 1:
+        pad = min(poolWidth // 2, len(scale) - 1)
+        padded = np.pad(scale, pad, mode = "edge")
+        scale = np.maximum(scale, np.median(sliding_window_view(padded, 2 * pad + 1), axis = -1))
+    return np.maximum(scale, minScale)
+
+def clipMask(x, sigma, iterations, minScale, poolWidth):
+    center = np.median(x, axis = 0)
+    scale = MADSCALE * np.median(np.abs(x - center), axis = 0)
+    keep = None
+    for iteration in range(iterations):
+        newKeep = np.abs(x - center) <= sigma * poolScale(scale, poolWidth, minScale)
+        if (keep is not None) and np.array_equal(newKeep, keep):
+            break
+        keep = newKeep
+        center, variance, counts = maskedMoments(x, keep)
+        scale = np.sqrt(variance)
+    return keep
+
+def spikeMask(x, sigma, window, minScale, poolWidth):
+    # The rolling estimate is the median of the neighbouring frames without
+    # the frame itself (borders are mirrored) so a spike cannot mask itself
+    pad = min(window // 2, len(x) - 1)
+    if pad < 1:
+        return np.ones(x.shape, dtype = bool)
+    padded = np.pad(x, ((pad, pad), (0, 0)), mode = "reflect")
+    neighbours = np.delete(sliding_window_view(padded, 2 * pad + 1, axis = 0), pad, axis = -1)
+    residual = np.abs(x - np.median(neighbours, axis = -1))
+    noise = MADSCALE * np.median(residual, axis = 0)
+    return residual <= sigma * poolScale(noise, poolWidth, minScale)
+
+def maskedMoments(x, keep):
+    counts = np.count_nonzero(keep, axis = 0)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        mean = np.where(keep, x, 0.0).sum(axis = 0) / counts
+        d = np.where(keep, x - mean, 0.0)
+        variance = np.where(counts > 1, (d * d).sum(axis = 0) / (counts - 1), 0.0)
+    return mean, variance, counts
+
+def stackFrames(frames, method = "sigmaclip", sigma = 3.0, iterations = 5, window = 5, minScale = 1.0, poolWidth = 9, chunkSize = None):
+    # Returns a PyAvaSpecAverageResult of the (frames x pixels) stack. Arrays
+    # (including memory mapped ones) are used as they are, lists of frames
+    # are converted
+    if method not in STACKMETHODS:
+        raise ValueError("Unknown stacking method {}, supported are {}".format(method, ", ".join(STACKMETHODS)))
+    if not isinstance(frames, np.ndarray):
+        frames = np.asarray(frames, dtype = np.float64)
+    if frames.size == 0:
+        raise ValueError("Cannot stack an empty set of frames")
+    if frames.ndim != 2:
+        raise ValueError("Expecting a (frames x pixels) stack")
+    count, pixelCount = frames.shape
+    if chunkSize == None:
+        chunkSize = max(1, STACKCHUNKELEMENTS // count)
+    # Blocks overlap by the pooling margin so results do not depend on the chunk size
+    margin = poolWidth // 2 if method in [ "sigmaclip", "spikes" ] else 0
+
+    mean = np.zeros(pixelCount, dtype = np.float64)
+    variance = np.zeros(pixelCount, dtype = np.float64)
+    minimum = np.zeros(pixelCount, dtype = np.float64)
+    maximum = np.zeros(pixelCount, dtype = np.float64)
+    counts = np.zeros(pixelCount, dtype = np.int64)
+
+    for start in range(0, pixelCount, chunkSize):
+        block = slice(start, min(start + chunkSize, pixelCount))
+        lo = max(start - margin, 0)
+        x = np.asarray(frames[:, lo:min(block.stop + margin, pixelCount)], dtype = np.float64)
+
+        if method == "median":
+            mean[block] = np.median(x, axis = 0)
+            variance[block] = np.var(x, axis = 0, ddof = 1) if count > 1 else 0.0
+            minimum[block] = np.min(x, axis = 0)
+            maximum[block] = np.max(x, axis = 0)
+            counts[block] = count
+            continue
+
+        if method == "sigmaclip":
+            keep = clipMask(x, sigma, iterations, minScale, poolWidth)
+        elif method == "spikes":
+            keep = spikeMask(x, sigma, window, minScale, poolWidth)
+        else:
+            keep = np.ones(x.shape, dtype = bool)
+
+        inner = slice(start - lo, block.stop - lo)
+        x, keep = x[:, inner], keep[:, inner]
+        mean[block], variance[block], counts[block] = maskedMoments(x, keep)
+        minimum[block] = np.min(np.where(keep, x, np.inf), axis = 0)
+        maximum[block] = np.max(np.where(keep, x, -np.inf), axis = 0)
+
+    return PyAvaSpecAverageResult(mean, variance, minimum, maximum, count, counts = counts, rejected = int(count * pixelCount - np.sum(counts)))
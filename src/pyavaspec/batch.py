@@ -0,0 +1,211 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+# Offline batch processing of measurement directories. Each directory has to
+# contain background.dat and dataraw.dat (or raw.dat). For every directory the
+# same pipeline as
+#
+#   avacli loadfbg background.dat loadf dataraw.dat bgsub moveavg peaks dumpfpeak peaks.dat plotf peaks.png "Peaks"
+#
+# is executed, directories are distributed over a process pool.
+
+BATCHSTAGES = [ "loadf", "loadfbg", "bgsub", "moveavg", "peaks", "dumpfpeak", "plotf" ]
+BATCHRAWFILES = [ "dataraw.dat", "raw.dat" ]
+
+def getDefaultBatchConfiguration():
+    return {
+        'peakavgwindow'     : 10,
+        'peakmaxcount'      : 10,
+        'peakminheight'     : None,
+        'peakminprominence' : None,
+        'peakmindistance'   : None,
+        'outdir'            : None,
+        'plot'              : True,
+        'plotformat'        : 'png',
+        'plottitle'         : 'Peaks'
+    }
+
+def expandMeasurementDirectories(patterns):
+    # Accepts directories and glob patterns, returns the sorted list of
+    # directories that contain a background and a raw data file
+    res = []
+    for pattern in patterns:
+        for entry in sorted(glob.glob(pattern)):
+            if not os.path.isdir(entry):
+                continue
+            if not os.path.isfile(os.path.join(entry, "background.dat")):
+                continue
+            if findRawFile(entry) == None:
+                continue
+            entry = os.path.normpath(entry)
+            if entry not in res:
+                res.append(entry)
+    return res
+
+def findRawFile(directory):
+    for candidate in BATCHRAWFILES:
+        if os.path.isfile(os.path.join(directory, candidate)):
+            return os.path.join(directory, candidate)
+    return None
+
+def initializeBatchWorker(plot):
+    if plot:
+        # Workers only render into files
+        import matplotlib
+        matplotlib.use("Agg")
+
+def processMeasurementDirectory(directory, cfg):
+    from pyavaspec.pyavaspec import PyAvaSpecProcessing
+
+    proc = PyAvaSpecProcessing()
+    run = os.path.basename(os.path.normpath(directory))
+    timings = {}
+    result = { 'directory' : directory, 'run' : run, 'peaks' : [], 'timings' : timings, 'error' : None }
+
+    outdir = None
+    if cfg['outdir']:
+        outdir = os.path.join(cfg['outdir'], run)
+        os.makedirs(outdir, exist_ok = True)
+
+    try:
+        t = time.perf_counter()
+        fgdata = proc.loadData(findRawFile(directory))
+        timings['loadf'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        bgdata = proc.loadData(os.path.join(directory, "background.dat"))
+        timings['loadfbg'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        fgdata = [ fgdata[i] - bgdata[i] for i in range(len(fgdata)) ]
+        timings['bgsub'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        fgdata = proc.applyMovingAverage(fgdata, windowSize = cfg['peakavgwindow'])
+        timings['moveavg'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        peaks = proc.searchPeaks(
+            fgdata,
+            maxPeaks = cfg['peakmaxcount'],
+            minHeight = cfg['peakminheight'],
+            minProminence = cfg['peakminprominence'],
+            minDistance = cfg['peakmindistance']
+        )
+        timings['peaks'] = time.perf_counter() - t
+        result['peaks'] = peaks
+
+        if outdir:
+            t = time.perf_counter()
+            proc.dumpPeaks(peaks, filename = os.path.join(outdir, "peaks.dat"))
+            timings['dumpfpeak'] = time.perf_counter() - t
+
+            if cfg['plot']:
+                t = time.perf_counter()
+                proc.plotData(
+                    fgdata,
+                    peaks = peaks,
+                    filename = os.path.join(outdir, "peaks.{}".format(cfg['plotformat'])),
+                    fileformat = cfg['plotformat'],
+                    title = "{} ({})".format(cfg['plottitle'], run)
+                )
+                timings['plotf'] = time.perf_counter() - t
+    except Exception as e:
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+
+    return result
+
+def runBatch(patterns, cfg = None, processes = None):
+    # Processes all matching measurement directories in a process pool and
+    # returns the per directory results in directory order
+    if cfg == None:
+        cfg = getDefaultBatchConfiguration()
+    directories = expandMeasurementDirectories(patterns)
+    if not directories:
+        return []
+    plot = cfg['plot'] and (cfg['outdir'] != None)
+    with ProcessPoolExecutor(max_workers = processes, initializer = initializeBatchWorker, initargs = (plot,)) as executor:
+        return list(executor.map(processMeasurementDirectory, directories, [ cfg ] * len(directories)))
+
+def summarizeTimings(results):
+    # Total, mean and maximum time per pipeline stage over all runs
+    summary = {}
+    for stage in BATCHSTAGES:
+        values = [ res['timings'][stage] for res in results if stage in res['timings'] ]
+        if not values:
+            continue
+        summary[stage] = {
+            'count' : len(values),
+            'total' : sum(values),
+            'mean'  : sum(values) / len(values),
+            'max'   : max(values)
+        }
+    return summary
+
+def formatPeakTable(results):
+    # Peaks of all runs in the dumpPeaks text format (formatted by the peak
+    # table itself) with a leading run column
+    from pyavaspec.peaktable import asPeakTable
+
+    header = asPeakTable([]).formatText().splitlines()[0]
+    lines = [ "# run " + header[2:] ]
+    for res in results:
+        rows = asPeakTable(res['peaks']).formatText().splitlines()[1:]
+        lines.extend([ "{} {}".format(res['run'], row) for row in rows ])
+    return "\n".join(lines) + "\n"
+
+def mainProg():
+    ap = argparse.ArgumentParser(description = "Batch processing of AvaSpec-2048-2 measurement directories")
+    ap.add_argument("directories", nargs = "+", help = "Measurement directories or glob patterns (for example 'measurements/*')")
+    ap.add_argument("--jobs", type = int, default = None, help = "Number of worker processes (default: number of CPUs)")
+    ap.add_argument("--peakavgwindow", type = int, default = 10, help = "Moving average window size (default 10)")
+    ap.add_argument("--peakmaxcount", type = int, default = 10, help = "Maximum number of peaks per run (default 10)")
+    ap.add_argument("--peakminheight", type = float, default = None, help = "Minimum peak height in counts")
+    ap.add_argument("--peakminprominence", type = float, default = None, help = "Minimum peak prominence in counts")
+    ap.add_argument("--peakmindistance", type = int, default = None, help = "Minimum distance between peaks in pixels")
+    ap.add_argument("--outdir", default = None, help = "Write peaks.dat and plots per run into this directory")
+    ap.add_argument("--noplot", action = "store_true", help = "Do not render plots")
+    ap.add_argument("--plotformat", choices = [ "png", "svg" ], default = "png", help = "Plot format (default png)")
+    ap.add_argument("--table", default = None, help = "Write the combined peak table into this file instead of stdout")
+    args = ap.parse_args()
+
+    cfg = getDefaultBatchConfiguration()
+    cfg['peakavgwindow'] = args.peakavgwindow
+    cfg['peakmaxcount'] = args.peakmaxcount
+    cfg['peakminheight'] = args.peakminheight
+    cfg['peakminprominence'] = args.peakminprominence
+    cfg['peakmindistance'] = args.peakmindistance
+    cfg['outdir'] = args.outdir
+    cfg['plot'] = not args.noplot
+    cfg['plotformat'] = args.plotformat
+
+    t = time.perf_counter()
+    results = runBatch(args.directories, cfg, processes = args.jobs)
+    elapsed = time.perf_counter() - t
+
+    for res in results:
+        if res['error']:
+            print("{}: {}".format(res['directory'], res['error']), file = sys.stderr)
+
+    table = formatPeakTable(results)
+    if args.table:
+        with open(args.table, 'w') as f:
+            f.write(table)
+    else:
+        sys.stdout.write(table)
+
+    print("Processed {} runs in {:.3f} s".format(len(results), elapsed), file = sys.stderr)
+    summary = summarizeTimings(results)
+    for stage in summary:
+        print("{:10s} total {:.4f} s mean {:.4f} s max {:.4f} s".format(stage, summary[stage]['total'], summary[stage]['mean'], summary[stage]['max']), file = sys.stderr)
+
+    if [ res for res in results if res['error'] ]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    mainProg()
@@ -0,0 +1,252 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Hardware free benchmark suite for the hot paths of the library.
+#
+# Every benchmark works on the spectra shipped in measurements/ (or the
+# synthetic reference of the simulated device when they are not available)
+# and on synthetic USB payloads with the byte layout of the real device. The
+# results are written as JSON and can be compared against a stored baseline:
+#
+#   avabench --output baseline.json
+#   avabench --baseline baseline.json --tolerance 0.25
+#
+# Each benchmark is calibrated to run for at least --mintime seconds per
+# round, the best, median and mean time per call over --repeat rounds are
+# reported. Comparison uses the best time since it is the least noisy.
+
+BENCHMARKFORMAT = 1
+
+class PyAvaSpecBenchmarkContext:
+    # Shared inputs for all benchmarks, created once per run
+    def __init__(self, measurement = None, seed = 0):
+        from pyavaspec.pyavaspec import PyAvaSpec_2048_2, PyAvaSpecProcessing
+        from pyavaspec.simulator import PyAvaSpecSimulatedDevice
+
+        self.device = PyAvaSpecSimulatedDevice(measurement = measurement, seed = seed)
+        self.spec = PyAvaSpec_2048_2(transport = self.device)
+        self.proc = PyAvaSpecProcessing()
+        self.tempdir = tempfile.TemporaryDirectory(prefix = "avabench")
+
+        # Raw payload as received from the device (header followed by the frame)
+        self.frame = self.device.renderFrame(1000, 1)
+        self.payload = memoryview(bytearray(bytes(self.device.MEASUREHEADER) + self.frame.tobytes()))
+        self.out = np.zeros(self.spec.PIXELCOUNT, dtype = np.uint16)
+
+        self.spectrumList = self.frame.tolist()
+        self.spectrumArray = np.asarray(self.spectrumList)
+        self.smoothedList = self.proc.applyMovingAverage(self.device.signal.tolist())
+
+        # Comb of gaussian lines so that at least 100 peaks can be found
+        rng = np.random.default_rng(seed)
+        idx = np.arange(self.spec.PIXELCOUNT, dtype = np.float64)
+        self.comb = np.zeros(self.spec.PIXELCOUNT)
+        for center in np.linspace(10, self.spec.PIXELCOUNT - 10, 120):
+            self.comb = self.comb + rng.uniform(1000, 30000) * np.exp(-0.5 * ((idx - center) / 2.5)**2)
+        self.combList = self.comb.tolist()
+
+        self.datFile = os.path.join(self.tempdir.name, "spectrum.dat")
+        self.proc.dumpData(self.spectrumList, filename = self.datFile)
+        self.dumpFile = os.path.join(self.tempdir.name, "dump.dat")
+        self.plotFile = os.path.join(self.tempdir.name, "plot.png")
+        self.peaks = self.proc.searchPeaks(self.smoothedList, maxPeaks = 10)
+
+    def close(self):
+        self.tempdir.cleanup()
+
+def benchDecodeList(ctx):
+    ctx.spec.decodeFrame(ctx.payload)
+
+def benchDecodeArray(ctx):
+    ctx.spec.decodeFrame(ctx.payload, asArray = True)
+
+def benchDecodeInto(ctx):
+    ctx.spec.decodeFrame(ctx.payload, out = ctx.out)
+
+def benchMeasure(ctx):
+    ctx.spec.cmdMeasure(integrationTime = 10, out = ctx.out)
+
+def benchSoftAverages(ctx):
+    ctx.spec.cmdMeasureSoftAverages(integrationTime = 10, softAverages = 100, statistics = True)
+
+def benchMoveAvgList(ctx):
+    ctx.proc.applyMovingAverage(ctx.spectrumList)
+
+def benchMoveAvgArray(ctx):
+    ctx.proc.applyMovingAverage(ctx.spectrumArray)
+
+def benchPeaks1(ctx):
+    ctx.proc.searchPeaks(ctx.combList, maxPeaks = 1)
+
+def benchPeaks10(ctx):
+    ctx.proc.searchPeaks(ctx.combList, maxPeaks = 10)
+
+def benchPeaks100(ctx):
+    ctx.proc.searchPeaks(ctx.combList, maxPeaks = 100)
+
+def benchLoadData(ctx):
+    ctx.proc.loadData(ctx.datFile)
+
+def benchDumpData(ctx):
+    ctx.proc.dumpData(ctx.spectrumList, filename = ctx.dumpFile)
+
+def benchPlotData(ctx):
+    ctx.proc.plotData(ctx.smoothedList, peaks = ctx.peaks, peakFwhmLine = True, filename = ctx.plotFile)
+
+BENCHMARKS = {
+    'decode.list'   : benchDecodeList,
+    'decode.array'  : benchDecodeArray,
+    'decode.into'   : benchDecodeInto,
+    'measure'       : benchMeasure,
+    'softavg.100'   : benchSoftAverages,
+    'moveavg.list'  : benchMoveAvgList,
+    'moveavg.array' : benchMoveAvgArray,
+    'peaks.1'       : benchPeaks1,
+    'peaks.10'      : benchPeaks10,
+    'peaks.100'     : benchPeaks100,
+    'loaddata'      : benchLoadData,
+    'dumpdata'      : benchDumpData,
+    'plotdata'      : benchPlotData
+}
+
+def timeBenchmark(func, ctx, repeat = 5, minTime = 0.2):
+    # Determines the number of calls per round so a round takes at least
+    # minTime, then returns per call timings of repeat rounds
+    func(ctx)
+    number = 1
+    while True:
+        t = time.perf_counter()
+        for i in range(number):
+            func(ctx)
+        elapsed = time.perf_counter() - t
+        if (elapsed >= minTime) or (number >= 1000000):
+            break
+        number = number * 10 if elapsed < minTime / 10 else number * 2
+
+    rounds = [ elapsed / number ]
+    for r in range(repeat - 1):
+        t = time.perf_counter()
+        for i in range(number):
+            func(ctx)
+        rounds.append((time.perf_counter() - t) / number)
+
+    return {
+        'number' : number,
+        'repeat' : repeat,
+        'best'   : min(rounds),
+        'median' : statistics.median(rounds),
+        'mean'   : statistics.mean(rounds),
+        'rounds' : rounds
+    }
+
+def runBenchmarks(names = None, repeat = 5, minTime = 0.2, measurement = None, progress = None):
+    if names == None:
+        names = list(BENCHMARKS)
+
+    ctx = PyAvaSpecBenchmarkContext(measurement = measurement)
+    results = {}
+    try:
+        for name in names:
+            results[name] = timeBenchmark(BENCHMARKS[name], ctx, repeat = repeat, minTime = minTime)
+            if progress:
+                progress(name, results[name])
+    finally:
+        ctx.close()
+
+    return {
+        'format'  : BENCHMARKFORMAT,
+        'meta'    : {
+            'timestamp' : datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python'    : platform.python_version(),
+            'numpy'     : np.__version__,
+            'platform'  : platform.platform(),
+            'machine'   : platform.machine(),
+            'repeat'    : repeat,
+            'mintime'   : minTime
+        },
+        'results' : results
+    }
+
+def compareBenchmarks(current, baseline, tolerance = 0.25):
+    # Ratio of the best time per benchmark present in both runs. Benchmarks
+    # slower than baseline * (1 + tolerance) are flagged as regressions
+    comparison = {}
+    for name in current['results']:
+        if name not in baseline['results']:
+            continue
+        ratio = current['results'][name]['best'] / baseline['results'][name]['best']
+        comparison[name] = {
+            'baseline'   : baseline['results'][name]['best'],
+            'current'    : current['results'][name]['best'],
+            'ratio'      : ratio,
+            'regression' : ratio > 1.0 + tolerance
+        }
+    return comparison
+
+def formatTime(seconds):
+    if seconds < 1e-3:
+        return "{:9.2f} us".format(seconds * 1e6)
+    if seconds < 1:
+        return "{:9.3f} ms".format(seconds * 1e3)
+    return "{:9.3f} s ".format(seconds)
+
+def mainProg():
+    ap = argparse.ArgumentParser(description = "Hardware free benchmarks of the pyavaspec hot paths")
+    ap.add_argument("benchmarks", nargs = "*", help = "Benchmarks to run (default all: {})".format(", ".join(BENCHMARKS)))
+    ap.add_argument("--output", default = None, help = "Write the results as JSON into this file")
+    ap.add_argument("--baseline", default = None, help = "Compare against the results stored in this JSON file")
+    ap.add_argument("--tolerance", type = float, default = 0.25, help = "Allowed relative slowdown against the baseline (default 0.25)")
+    ap.add_argument("--repeat", type = int, default = 5, help = "Number of timed rounds (default 5)")
+    ap.add_argument("--mintime", type = float, default = 0.2, help = "Minimum duration of a round in seconds (default 0.2)")
+    ap.add_argument("--measurement", default = None, help = "Measurement from the measurements directory used as input (default first available)")
+    args = ap.parse_args()
+
+    # The plotdata benchmark only renders into a file. The backend is selected
+    # here and not in runBenchmarks so library users keep their own backend
+    import matplotlib
+    matplotlib.use("Agg")
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            print("Unknown benchmark {}, available are {}".format(name, ", ".join(BENCHMARKS)), file = sys.stderr)
+            sys.exit(2)
+
+    def progress(name, res):
+        print("{:14s} {} (best, {} calls x {} rounds)".format(name, formatTime(res['best']), res['number'], res['repeat']), file = sys.stderr)
+
+    current = runBenchmarks(args.benchmarks if args.benchmarks else None, repeat = args.repeat, minTime = args.mintime, measurement = args.measurement, progress = progress)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent = 2)
+    elif not args.baseline:
+        print(json.dumps(current, indent = 2))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        comparison = compareBenchmarks(current, baseline, tolerance = args.tolerance)
+        regressions = [ name for name in comparison if comparison[name]['regression'] ]
+        for name in comparison:
+            print("{:14s} {} -> {} {:6.2f}x{}".format(
+                name,
+                formatTime(comparison[name]['baseline']),
+                formatTime(comparison[name]['current']),
+                comparison[name]['ratio'],
+                "  REGRESSION" if comparison[name]['regression'] else ""
+            ))
+        if regressions:
+            print("{} of {} benchmarks regressed by more than {:.0f}%".format(len(regressions), len(comparison), args.tolerance * 100), file = sys.stderr)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    mainProg()
@@ -0,0 +1,149 @@
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Wavelength calibration
+#
+# The calibration is a polynomial in the pixel index with coefficients ordered
+# from the highest order to the offset (the order used by numpy.polyval and by
+# the [ 0.546875, 299.67 ] default used throughout the package). The wavelength
+# axis is computed once and cached. Calibration objects (per coefficient list)
+# and resampling weights (per target grid) are kept in bounded least recently
+# used caches.
+
+class PyAvaSpecCalibration:
+    cache = OrderedDict()
+    cacheSize = 32
+    cacheLock = threading.Lock()
+
+    def __init__(self, coefficients = [ 0.546875, 299.67 ], pixelCount = 2048, weightCacheSize = 8):
+        if len(coefficients) < 1:
+            raise ValueError("Calibration requires at least one coefficient")
+        self.coefficients = [ float(c) for c in coefficients ]
+        self.pixelCount = pixelCount
+        self.axes = {}
+        self.weights = OrderedDict()
+        self.weightCacheSize = weightCacheSize
+        self.weightLock = threading.Lock()
+
+        self.wavelengths = self.axis(pixelCount)
+
+        # Resampling by interpolation requires a strictly monotonic axis
+        steps = np.diff(self.wavelengths)
+        self.increasing = bool(np.all(steps > 0))
+        if not self.increasing and not np.all(steps < 0):
+            raise ValueError("Calibration polynomial is not monotonic over the pixel range")
+
+    @staticmethod
+    def get(calibration, pixelCount = 2048):
+        # Returns a calibration object for a coefficient list (cached) or
+        # passes an existing PyAvaSpecCalibration through
+        if isinstance(calibration, PyAvaSpecCalibration):
+            return calibration
+        key = (tuple([ float(c) for c in calibration ]), pixelCount)
+        with PyAvaSpecCalibration.cacheLock:
+            cal = PyAvaSpecCalibration.cache.get(key)
+            if cal != None:
+                PyAvaSpecCalibration.cache.move_to_end(key)
+                return cal
+        cal = PyAvaSpecCalibration(calibration, pixelCount)
+        with PyAvaSpecCalibration.cacheLock:
+            PyAvaSpecCalibration.cache[key] = cal
+            PyAvaSpecCalibration.cache.move_to_end(key)
+            while len(PyAvaSpecCalibration.cache) > PyAvaSpecCalibration.cacheSize:
+                PyAvaSpecCalibration.cache.popitem(last = False)
+        return cal
+
+    @staticmethod
+    def fit(pixels, wavelengths, order = 1, pixelCount = 2048):
+        # Least squares polynomial fit through known lines (pixel position,
+        # for example sub-pixel peak positions, and reference wavelength)
+        pixels = np.asarray(pixels, dtype = np.float64)
+        wavelengths = np.asarray(wavelengths, dtype = np.float64)
+        if len(pixels) != len(wavelengths):
+            raise ValueError("Pixel positions and wavelengths have to be of same length")
+        if len(pixels) < order + 1:
+            raise ValueError("A calibration of order {} requires at least {} lines".format(order, order + 1))
+        return PyAvaSpecCalibration(np.polyfit(pixels, wavelengths, order).tolist(), pixelCount)
+
+    @staticmethod
+    def load(filename):
+        with open(filename, 'r') as f:
+            cfg = json.load(f)
+        return PyAvaSpecCalibration(cfg['coefficients'], cfg.get('pixelcount', 2048))
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({ 'coefficients' : self.coefficients, 'pixelcount' : self.pixelCount }, f)
+
+    def axis(self, length):
+        # Wavelength axis for the given number of samples (cached per length)
+        if length not in self.axes:
+            wavelengths = np.polyval(self.coefficients, np.arange(length, dtype = np.float64))
+            wavelengths.flags.writeable = False
+            self.axes[length] = wavelengths
+        return self.axes[length]
+
+    def indexToWavelength(self, pixelIndex):
+        # Accepts scalar or array (also fractional) pixel positions
+        if np.isscalar(pixelIndex):
+            return float(np.polyval(self.coefficients, pixelIndex))
+        return np.polyval(self.coefficients, np.asarray(pixelIndex, dtype = np.float64))
+
+    def wavelengthToIndex(self, wavelength):
+        # Fractional pixel position of the wavelength (NaN outside the covered range)
+        if self.increasing:
+            return np.interp(wavelength, self.wavelengths, np.arange(self.pixelCount, dtype = np.float64), left = np.nan, right = np.nan)
+        return np.interp(wavelength, self.wavelengths[::-1], np.arange(self.pixelCount, dtype = np.float64)[::-1], left = np.nan, right = np.nan)
+
+    def resamplingWeights(self, grid):
+        # Lower neighbour index and interpolation weight for every grid point,
+        # grid points outside the calibrated range are flagged invalid. The
+        # (read-only) result is cached per grid
+        grid = np.ascontiguousarray(grid, dtype = np.float64)
+        key = (grid.shape, grid.tobytes())
+        with self.weightLock:
+            weights = self.weights.get(key)
+            if weights != None:
+                self.weights.move_to_end(key)
+                return weights
+
+        pos = self.wavelengthToIndex(grid)
+        valid = ~np.isnan(pos)
+        pos = np.where(valid, pos, 0.0)
+        lower = np.minimum(np.floor(pos).astype(np.intp), self.pixelCount - 2)
+        weights = (lower, pos - lower, valid)
+        for w in weights:
+            w.flags.writeable = False
+
+        with self.weightLock:
+            self.weights[key] = weights
+            self.weights.move_to_end(key)
+            while len(self.weights) > self.weightCacheSize:
+                self.weights.popitem(last = False)
+        return weights
+
+    def resample(self, data, grid, fill = np.nan):
+        # Linearly interpolates one spectrum or a (spectra x pixels) stack onto
+        # the supplied wavelength grid
+        data = np.asarray(data, dtype = np.float64)
+        if data.shape[-1] != self.pixelCount:
+            raise ValueError("Data has {} pixels, calibration covers {}".format(data.shape[-1], self.pixelCount))
+        lower, frac, valid = self.resamplingWeights(grid)
+        res = data[..., lower] * (1.0 - frac) + data[..., lower + 1] * frac
+        res[..., ~valid] = fill
+        return res
+
+def commonGrid(calibrations, step = None):
+    # Wavelength grid covering the range shared by all calibrations. The step
+    # defaults to the smallest mean pixel spacing
+    calibrations = [ PyAvaSpecCalibration.get(c) for c in calibrations ]
+    lo = max([ float(np.min(c.wavelengths)) for c in calibrations ])
+    hi = min([ float(np.max(c.wavelengths)) for c in calibrations ])
+    if hi <= lo:
+        raise ValueError("Calibrations do not share a common wavelength range")
+    if step == None:
+        step = min([ abs(float(c.wavelengths[-1] - c.wavelengths[0])) / (c.pixelCount - 1) for c in calibrations ])
+    return lo + np.arange(int(np.floor((hi - lo) / step)) + 1) * step
@@ -0,0 +1,539 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import threading
+import time
+
+from collections import deque
+
+import numpy as np
+
+# Persistent acquisition daemon
+#
+# The daemon keeps a PyAvaSpec_2048_2 session open and accepts requests over a
+# Unix domain or TCP socket. Every message is framed as
+#
+#   uint32 payload length, uint8 message type, payload
+#
+# Requests and status replies are JSON objects (MSGTYPE_JSON), acquired spectra
+# are sent as binary frames (MSGTYPE_FRAME) consisting of FRAMEHEADER followed
+# by the raw samples (uint16 for single measurements, float32 for software
+# averaged ones). Every acquired frame is sent to the requesting client and
+# fanned out to all subscribed clients.
+#
+# Replies carry the id of their request. When continuous acquisition fails
+# the error is logged, sent to all subscribers as JSON message with id 0
+# ({"ok" : false, "id" : 0, "error" : ...}), their subscription is ended and
+# status reports the error (streamerror) until streaming is started again.
+#
+# Supported requests ({"cmd" : ..., "id" : ...}):
+#
+#   measure       Acquire a spectrum (optional inttime, avgsoft, avghard)
+#   configure     Set default inttime, avgsoft, avghard
+#   subscribe     Receive all acquired frames
+#   unsubscribe   Stop receiving frames
+#   start         Start continuous acquisition (frames go to subscribers)
+#   stop          Stop continuous acquisition
+#   status        Query configuration and counters
+
+class PyAvaSpecDaemonException(Exception):
+    pass
+
+MSGHEADER = struct.Struct("<IB")
+MSGTYPE_JSON = 0x01
+MSGTYPE_FRAME = 0x02
+
+FRAMEHEADER = struct.Struct("<QQdIIIB3x")
+FRAMEDTYPES = {
+    0 : np.dtype('<u2'),
+    1 : np.dtype('<f4')
+}
+
+DEFAULTADDRESS = "unix:/tmp/avaspecd.sock"
+
+def parseAddress(address):
+    # "unix:/path/to/socket" or "tcp:host:port"
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[5:]
+    if address.startswith("tcp:"):
+        host, port = address[4:].rsplit(":", 1)
+        return socket.AF_INET, (host, int(port))
+    raise PyAvaSpecDaemonException("Unknown address {}, use unix:/path or tcp:host:port".format(address))
+
+def removeStaleSocket(path):
+    # Removes a Unix domain socket left behind by a daemon that is no longer
+    # running. Anything else at the path is never touched
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise PyAvaSpecDaemonException("{} exists and is not a socket".format(path))
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise PyAvaSpecDaemonException("{} is in use by a running daemon".format(path))
+
+def recvExact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    received = 0
+    while received < n:
+        cnt = sock.recv_into(view[received:], n - received)
+        if cnt == 0:
+            return None
+        received = received + cnt
+    return buf
+
+def recvMessage(sock):
+    hdr = recvExact(sock, MSGHEADER.size)
+    if hdr == None:
+        return None, None
+    length, msgtype = MSGHEADER.unpack(hdr)
+    payload = recvExact(sock, length)
+    if payload == None:
+        return None, None
+    return msgtype, payload
+
+def encodeMessage(msgtype, payload):
+    return MSGHEADER.pack(len(payload), msgtype) + payload
+
+def encodeJson(obj):
+    return encodeMessage(MSGTYPE_JSON, json.dumps(obj).encode("utf-8"))
+
+def encodeFrame(data, reqid, sequence, timestamp, inttime, avgsoft, avghard):
+    if data.dtype == FRAMEDTYPES[0]:
+        code = 0
+    else:
+        code = 1
+        data = data.astype(FRAMEDTYPES[1])
+    return encodeMessage(MSGTYPE_FRAME, FRAMEHEADER.pack(reqid, sequence, timestamp, inttime, avgsoft, avghard, code) + data.tobytes())
+
+def decodeFrame(payload):
+    reqid, sequence, timestamp, inttime, avgsoft, avghard, code = FRAMEHEADER.unpack_from(payload)
+    data = np.frombuffer(payload, dtype = FRAMEDTYPES[code], offset = FRAMEHEADER.size)
+    return {
+        'id'        : reqid,
+        'sequence'  : sequence,
+        'timestamp' : timestamp,
+        'inttime'   : inttime,
+        'avgsoft'   : avgsoft,
+        'avghard'   : avghard,
+        'data'      : data
+    }
+
+class PyAvaSpecDaemonClientConnection:
+    # Server side state of a connected client. Outgoing messages are queued
+    # and sent by a dedicated thread so a slow subscriber never stalls
+    # acquisition; when more than queueSize frames are queued further frames
+    # are dropped and counted. Replies and errors are never dropped.
+
+    def __init__(self, sock, queueSize = 64):
+        self.sock = sock
+        self.subscribed = False
+        self.dropped = 0
+        self.queueSize = queueSize
+        self.queue = deque()
+        self.queuedFrames = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target = self.senderThread, daemon = True)
+        self.thread.start()
+
+    def send(self, message, droppable = False):
+        with self.condition:
+            if self.closed:
+                return
+            if droppable:
+                if self.queuedFrames >= self.queueSize:
+                    self.dropped = self.dropped + 1
+                    return
+                self.queuedFrames = self.queuedFrames + 1
+            self.queue.append((message, droppable))
+            self.condition.notify()
+
+    def endSubscription(self, message):
+        # Discards the queued frames (counted as dropped) so the final message
+        # is delivered right after the replies already queued
+        with self.condition:
+            self.subscribed = False
+            if self.closed:
+                return
+            self.dropped = self.dropped + self.queuedFrames
+            self.queue = deque([ item for item in self.queue if not item[1] ])
+            self.queuedFrames = 0
+            self.queue.append((message, False))
+            self.condition.notify()
+
+    def senderThread(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                message, droppable = self.queue.popleft()
+                if droppable:
+                    self.queuedFrames = self.queuedFrames - 1
+            if message == None:
+                return
+            try:
+                self.sock.sendall(message)
+            except OSError:
+                with self.condition:
+                    self.closed = True
+                    self.queue.clear()
+                    self.queuedFrames = 0
+                return
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.queue.append((None, False))
+            self.condition.notify()
+        self.thread.join()
+
+class PyAvaSpecDaemonRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        daemon = self.server.avaspecDaemon
+        conn = PyAvaSpecDaemonClientConnection(self.request)
+        daemon.addClient(conn)
+        try:
+            while True:
+                msgtype, payload = recvMessage(self.request)
+                if msgtype == None:
+                    break
+                if msgtype != MSGTYPE_JSON:
+                    conn.send(encodeJson({ 'ok' : False, 'id' : None, 'error' : "Unexpected message type {}".format(msgtype) }))
+                    continue
+                reqid = None
+                try:
+                    request = json.loads(payload.decode("utf-8"))
+                    reqid = request.get('id')
+                    daemon.handleRequest(conn, request)
+                except Exception as e:
+                    conn.send(encodeJson({ 'ok' : False, 'id' : reqid, 'error' : "{}: {}".format(type(e).__name__, e) }))
+        finally:
+            daemon.removeClient(conn)
+            conn.close()
+
+class PyAvaSpecThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class PyAvaSpecThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class PyAvaSpecDaemon:
+    def __init__(self, spec, address = DEFAULTADDRESS, inttime = 1000, avgsoft = 1, avghard = 1):
+        self.spec = spec
+        self.address = address
+        self.cfg = { 'inttime' : inttime, 'avgsoft' : avgsoft, 'avghard' : avghard }
+
+        self.deviceLock = threading.Lock()
+        self.clientLock = threading.Lock()
+        self.clients = []
+        self.sequence = 0
+
+        self.streamThread = None
+        self.streamStop = threading.Event()
+        self.streamError = None
+
+        family, addr = parseAddress(address)
+        if family == socket.AF_UNIX:
+            removeStaleSocket(addr)
+            self.server = PyAvaSpecThreadingUnixServer(addr, PyAvaSpecDaemonRequestHandler)
+        else:
+            self.server = PyAvaSpecThreadingTCPServer(addr, PyAvaSpecDaemonRequestHandler)
+        self.server.avaspecDaemon = self
+
+    def addClient(self, conn):
+        with self.clientLock:
+            self.clients.append(conn)
+
+    def removeClient(self, conn):
+        with self.clientLock:
+            if conn in self.clients:
+                self.clients.remove(conn)
+
+    def acquire(self, inttime, avgsoft, avghard):
+        with self.deviceLock:
+            if avgsoft == 1:
+                data = self.spec.cmdMeasure(integrationTime = inttime, averageCount = avghard, asArray = True)
+            else:
+                data = np.asarray(self.spec.cmdMeasureSoftAverages(integrationTime = inttime, softAverages = avgsoft, hardAverages = avghard), dtype = np.float32)
+            timestamp = time.time()
+            sequence = self.sequence
+            self.sequence = self.sequence + 1
+        return data, sequence, timestamp
+
+    def broadcast(self, data, sequence, timestamp, inttime, avgsoft, avghard, exclude = None):
+        message = None
+        with self.clientLock:
+            subscribers = [ c for c in self.clients if c.subscribed and (c != exclude) ]
+        for conn in subscribers:
+            if message == None:
+                message = encodeFrame(data, 0, sequence, timestamp, inttime, avgsoft, avghard)
+            conn.send(message, droppable = True)
+
+    def settingsFromRequest(self, request):
+        inttime = int(request.get('inttime', self.cfg['inttime']))
+        avgsoft = int(request.get('avgsoft', self.cfg['avgsoft']))
+        avghard = int(request.get('avghard', self.cfg['avghard']))
+        if (inttime < 1) or (inttime > 65535):
+            raise PyAvaSpecDaemonException("Integration time {} out of range".format(inttime))
+        if (avgsoft < 1) or (avghard < 1):
+            raise PyAvaSpecDaemonException("Average counts have to be at least 1")
+        return inttime, avgsoft, avghard
+
+    def handleRequest(self, conn, request):
+        cmd = request.get('cmd')
+        reqid = int(request.get('id', 0))
+
+        if cmd == "measure":
+            inttime, avgsoft, avghard = self.settingsFromRequest(request)
+            data, sequence, timestamp = self.acquire(inttime, avgsoft, avghard)
+            conn.send(encodeFrame(data, reqid, sequence, timestamp, inttime, avgsoft, avghard))
+            self.broadcast(data, sequence, timestamp, inttime, avgsoft, avghard, exclude = conn)
+            return
+        if cmd == "configure":
+            inttime, avgsoft, avghard = self.settingsFromRequest(request)
+            self.cfg = { 'inttime' : inttime, 'avgsoft' : avgsoft, 'avghard' : avghard }
+        elif cmd == "subscribe":
+            conn.subscribed = True
+        elif cmd == "unsubscribe":
+            conn.subscribed = False
+        elif cmd == "start":
+            self.startStream()
+        elif cmd == "stop":
+            self.stopStream()
+        elif cmd == "status":
+            pass
+        else:
+            raise PyAvaSpecDaemonException("Unknown command {}".format(cmd))
+        conn.send(encodeJson({ 'ok' : True, 'id' : reqid, 'status' : self.getStatus() }))
+
+    def getStatus(self):
+        with self.clientLock:
+            clients = len(self.clients)
+            subscribers = len([ c for c in self.clients if c.subscribed ])
+            dropped = sum([ c.dropped for c in self.clients ])
+        return {
+            'cfg'         : dict(self.cfg),
+            'sequence'    : self.sequence,
+            'clients'     : clients,
+            'subscribers' : subscribers,
+            'dropped'     : dropped,
+            'streaming'   : (self.streamThread != None) and self.streamThread.is_alive(),
+            'streamerror' : self.streamError
+        }
+
+    def streamLoop(self):
+        try:
+            while not self.streamStop.is_set():
+                cfg = self.cfg
+                data, sequence, timestamp = self.acquire(cfg['inttime'], cfg['avgsoft'], cfg['avghard'])
+                self.broadcast(data, sequence, timestamp, cfg['inttime'], cfg['avgsoft'], cfg['avghard'])
+        except Exception as e:
+            self.streamError = "{}: {}".format(type(e).__name__, e)
+            self.streamStop.set()
+            print("Continuous acquisition stopped: {}".format(self.streamError), file = sys.stderr)
+            message = encodeJson({ 'ok' : False, 'id' : 0, 'error' : "Continuous acquisition stopped: {}".format(self.streamError) })
+            with self.clientLock:
+                subscribers = [ c for c in self.clients if c.subscribed ]
+            for conn in subscribers:
+                conn.endSubscription(message)
+
+    def startStream(self):
+        if (self.streamThread != None) and self.streamThread.is_alive():
+            return
+        self.streamStop.clear()
+        self.streamError = None
+        self.streamThread = threading.Thread(target = self.streamLoop, daemon = True)
+        self.streamThread.start()
+
+    def stopStream(self):
+        if self.streamThread != None:
+            self.streamStop.set()
+            self.streamThread.join()
+            self.streamThread = None
+
+    def serveForever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+
+    def close(self):
+        self.stopStream()
+        self.server.server_close()
+        family, addr = parseAddress(self.address)
+        if (family == socket.AF_UNIX) and os.path.exists(addr):
+            os.unlink(addr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class PyAvaSpecClient:
+    # Thin client for PyAvaSpecDaemon
+    #
+    #   with PyAvaSpecClient("unix:/tmp/avaspecd.sock") as client:
+    #       data = client.measure(inttime = 100)
+
+    def __init__(self, address = DEFAULTADDRESS, timeout = None):
+        family, addr = parseAddress(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(timeout)
+        self.sock.connect(addr)
+        self.nextId = 1
+        # Frames and stream errors (as PyAvaSpecDaemonException) received
+        # while waiting for a reply, in order of arrival, for readFrame
+        self.pending = []
+
+    def request(self, cmd, **kwargs):
+        reqid = self.nextId
+        self.nextId = self.nextId + 1
+        req = dict(kwargs)
+        req['cmd'] = cmd
+        req['id'] = reqid
+        self.sock.sendall(encodeJson(req))
+        return reqid
+
+    def waitReply(self, reqid):
+        # Subscription frames and stream errors (id 0) arriving while waiting
+        # are kept for readFrame. Errors without id are answers to the pending
+        # request since the daemon could not parse it
+        while True:
+            msgtype, payload = recvMessage(self.sock)
+            if msgtype == None:
+                raise PyAvaSpecDaemonException("Connection closed by daemon")
+            if msgtype == MSGTYPE_JSON:
+                reply = json.loads(payload.decode("utf-8"))
+                ok = reply.get('ok', False)
+                if (reply.get('id') == reqid) or ((not ok) and (reply.get('id') == None)):
+                    if not ok:
+                        raise PyAvaSpecDaemonException(reply.get('error', "Request failed"))
+                    return reply
+                if (not ok) and (reply.get('id') == 0):
+                    self.pending.append(PyAvaSpecDaemonException(reply.get('error', "Stream failed")))
+            else:
+                frame = decodeFrame(payload)
+                if frame['id'] == reqid:
+                    return frame
+                self.pending.append(frame)
+
+    def measureFrame(self, inttime = None, avgsoft = None, avghard = None):
+        args = {}
+        if inttime != None:
+            args['inttime'] = inttime
+        if avgsoft != None:
+            args['avgsoft'] = avgsoft
+        if avghard != None:
+            args['avghard'] = avghard
+        return self.waitReply(self.request("measure", **args))
+
+    def measure(self, inttime = None, avgsoft = None, avghard = None):
+        return self.measureFrame(inttime, avgsoft, avghard)['data']
+
+    def configure(self, inttime = None, avgsoft = None, avghard = None):
+        args = {}
+        if inttime != None:
+            args['inttime'] = inttime
+        if avgsoft != None:
+            args['avgsoft'] = avgsoft
+        if avghard != None:
+            args['avghard'] = avghard
+        return self.waitReply(self.request("configure", **args))['status']
+
+    def subscribe(self):
+        return self.waitReply(self.request("subscribe"))['status']
+
+    def unsubscribe(self):
+        return self.waitReply(self.request("unsubscribe"))['status']
+
+    def startStream(self):
+        return self.waitReply(self.request("start"))['status']
+
+    def stopStream(self):
+        return self.waitReply(self.request("stop"))['status']
+
+    def status(self):
+        return self.waitReply(self.request("status"))['status']
+
+    def readFrame(self):
+        # Next frame pushed to this subscriber. Raises PyAvaSpecDaemonException
+        # when the daemon reports an error (for example failed streaming)
+        if self.pending:
+            frame = self.pending.pop(0)
+            if isinstance(frame, PyAvaSpecDaemonException):
+                raise frame
+            return frame
+        while True:
+            msgtype, payload = recvMessage(self.sock)
+            if msgtype == None:
+                return None
+            if msgtype == MSGTYPE_FRAME:
+                return decodeFrame(payload)
+            reply = json.loads(payload.decode("utf-8"))
+            if (not reply.get('ok', False)) and (reply.get('id') in [ 0, None ]):
+                raise PyAvaSpecDaemonException(reply.get('error', "Request failed"))
+
+    def frames(self):
+        while True:
+            frame = self.readFrame()
+            if frame == None:
+                return
+            yield frame
+
+    def close(self):
+        if self.sock != None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def mainProg():
+    ap = argparse.ArgumentParser(description = "Acquisition daemon keeping an AvaSpec-2048-2 session open")
+    ap.add_argument("--listen", default = DEFAULTADDRESS, help = "unix:/path or tcp:host:port (default {})".format(DEFAULTADDRESS))
+    ap.add_argument("--inttime", type = int, default = 1000, help = "Default integration time in milliseconds")
+    ap.add_argument("--avgsoft", type = int, default = 1, help = "Default software average count")
+    ap.add_argument("--avghard", type = int, default = 1, help = "Default hardware average count")
+    ap.add_argument("--simulate", nargs = "?", const = "", default = None, metavar = "MEASUREMENT", help = "Use the simulated device (optionally replaying the given measurement)")
+    args = ap.parse_args()
+
+    from pyavaspec.pyavaspec import PyAvaSpec_2048_2
+
+    transport = None
+    if args.simulate != None:
+        from pyavaspec.simulator import PyAvaSpecSimulatedDevice
+        transport = PyAvaSpecSimulatedDevice(measurement = args.simulate if args.simulate else None)
+
+    spec = PyAvaSpec_2048_2(transport = transport)
+    try:
+        with PyAvaSpecDaemon(spec, address = args.listen, inttime = args.inttime, avgsoft = args.avgsoft, avghard = args.avghard) as daemon:
+            try:
+                daemon.serveForever()
+            except KeyboardInterrupt:
+                pass
+    finally:
+        spec.close()
+
+if __name__ == "__main__":
+    mainProg()
@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+import numpy as np
+
+# Dark frame (background) library
+#
+# Backgrounds are cached keyed by device serial, integration time and the
+# averaging mode (software and hardware averages, software averaging method
+# and its rejection threshold sigma). Entries expire after
+# maxAge seconds and at most maxEntries are kept (least recently used entries
+# are evicted first). When a filename is supplied the library is loaded from
+# and written back to a single .npz file so backgrounds survive between runs.
+#
+# With interpolation enabled a missing integration time is linearly
+# interpolated per pixel from the nearest cached shorter and longer
+# integration time of the same device and averaging mode (dark counts grow
+# linearly with the exposure). There is no extrapolation.
+#
+#   library = PyAvaSpecDarkFrameLibrary("darkframes.npz", maxAge = 1800)
+#   bg, cached = library.acquire(spec, integrationTime = 1000, softAverages = 100)
+
+class PyAvaSpecDarkFrameLibrary:
+    FORMAT = 1
+
+    def __init__(self, filename = None, maxAge = 1800, maxEntries = 32, interpolate = False):
+        self.filename = filename
+        self.maxAge = maxAge
+        self.maxEntries = maxEntries
+        self.interpolate = interpolate
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.interpolated = 0
+        self.misses = 0
+
+        if filename and os.path.isfile(filename):
+            self.load()
+
+    @staticmethod
+    def makeKey(serial, integrationTime, softAverages = 1, hardAverages = 1, method = "mean", sigma = 3.0):
+        # A single frame is the same for every method and sigma only matters
+        # for the rejecting methods, so both are normalized to share entries
+        if int(softAverages) == 1:
+            method = "mean"
+        sigma = float(sigma) if method in [ "sigmaclip", "spikes" ] else None
+        return (str(serial), int(integrationTime), int(softAverages), int(hardAverages), str(method), sigma)
+
+    def isFresh(self, entry, now, maxAge):
+        return (maxAge == None) or (now - entry['timestamp'] <= maxAge)
+
+    def expire(self, now = None):
+        # Removes entries older than maxAge, returns the number of removed entries
+        if self.maxAge == None:
+            return 0
+        if now == None:
+            now = time.time()
+        expired = [ key for key in self.entries if not self.isFresh(self.entries[key], now, self.maxAge) ]
+        for key in expired:
+            del self.entries[key]
+        return len(expired)
+
+    def put(self, serial, integrationTime, softAverages, hardAverages, data, timestamp = None, method = "mean", sigma = 3.0):
+        key = self.makeKey(serial, integrationTime, softAverages, hardAverages, method, sigma)
+        data = np.array(data, dtype = np.float64)
+        data.flags.writeable = False
+        with self.lock:
+            self.entries[key] = { 'data' : data, 'timestamp' : time.time() if timestamp == None else timestamp }
+            self.entries.move_to_end(key)
+            self.expire()
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last = False)
+            if self.filename:
+                self.save()
+        return data
+
+    def get(self, serial, integrationTime, softAverages = 1, hardAverages = 1, maxAge = -1, interpolate = None, method = "mean", sigma = 3.0):
+        # Returns the cached (or interpolated) background as read-only float64
+        # array or None. maxAge defaults to the library setting, None accepts
+        # entries of any age
+        if maxAge == -1:
+            maxAge = self.maxAge
+        if interpolate == None:
+            interpolate = self.interpolate
+        key = self.makeKey(serial, integrationTime, softAverages, hardAverages, method, sigma)
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if (entry != None) and self.isFresh(entry, now, maxAge):
+                self.entries.move_to_end(key)
+                self.hits = self.hits + 1
+                return entry['data']
+
+            if interpolate:
+                lower, upper = None, None
+                for other in self.entries:
+                    if (other[0] != key[0]) or (other[2:] != key[2:]) or not self.isFresh(self.entries[other], now, maxAge):
+                        continue
+                    if (other[1] < key[1]) and ((lower == None) or (other[1] > lower[1])):
+                        lower = other
+                    if (other[1] > key[1]) and ((upper == None) or (other[1] < upper[1])):
+                        upper = other
+                if (lower != None) and (upper != None):
+                    weight = (key[1] - lower[1]) / (upper[1] - lower[1])
+                    res = self.entries[lower]['data'] + weight * (self.entries[upper]['data'] - self.entries[lower]['data'])
+                    self.interpolated = self.interpolated + 1
+                    return res
+
+            self.misses = self.misses + 1
+            return None
+
+    def acquire(self, spec, integrationTime = 1000, softAverages = 1, hardAverages = 1, maxAge = -1, method = "mean", sigma = 3.0):
+        # Returns a cached background for the spectrometer or measures (and
+        # caches) a new one together with a flag telling whether the cached
+        # frame has been used. Interpolated frames are not used here since an
+        # acquisition has been requested explicitly. method selects the
+        # software averaging and sigma its rejection threshold (see
+        # pyavaspec.averaging.stackFrames)
+        data = self.get(spec.serial, integrationTime, softAverages, hardAverages, maxAge = maxAge, interpolate = False, method = method, sigma = sigma)
+        if data is not None:
+            return data, True
+        if softAverages == 1:
+            data = spec.cmdMeasure(integrationTime = integrationTime, averageCount = hardAverages, asArray = True)
+        else:
+            data = spec.cmdMeasureSoftAverages(integrationTime = integrationTime, softAverages = softAverages, hardAverages = hardAverages, statistics = True, method = method, sigma = sigma).mean
+        return self.put(spec.serial, integrationTime, softAverages, hardAverages, data, method = method, sigma = sigma), False
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.filename:
+                self.save()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self):
+        return list(self.entries)
+
+    def save(self, filename = None):
+        # Written into a temporary file first so a crash never leaves a
+        # truncated library behind
+        if filename == None:
+            filename = self.filename
+        index = []
+        arrays = {}
+        for i, key in enumerate(self.entries):
+            index.append({ 'serial' : key[0], 'inttime' : key[1], 'avgsoft' : key[2], 'avghard' : key[3], 'avgmethod' : key[4], 'avgsigma' : key[5], 'timestamp' : self.entries[key]['timestamp'] })
+            arrays["frame{}".format(i)] = self.entries[key]['data']
+
+        directory = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(directory, exist_ok = True)
+        tmpname = filename + ".tmp"
+        with open(tmpname, 'wb') as f:
+            np.savez(f, index = np.array(json.dumps({ 'format' : self.FORMAT, 'entries' : index })), **arrays)
+        os.replace(tmpname, filename)
+
+    def load(self, filename = None):
+        if filename == None:
+            filename = self.filename
+        with np.load(filename, allow_pickle = False) as npz:
+            index = json.loads(str(npz['index']))
+            if index.get('format') != self.FORMAT:
+                raise ValueError("Unsupported dark frame library format {}".format(index.get('format')))
+            entries = OrderedDict()
+            # Entries are stored in least recently used order
+            for i, entry in enumerate(index['entries']):
+                data = np.array(npz["frame{}".format(i)], dtype = np.float64)
+                data.flags.writeable = False
+                entries[self.makeKey(entry['serial'], entry['inttime'], entry['avgsoft'], entry['avghard'], entry['avgmethod'], entry['avgsigma'])] = { 'data' : data, 'timestamp' : entry['timestamp'] }
+        with self.lock:
+            self.entries = entries
+            self.expire()
+
+def defaultDarkFrameLibraryFile():
+    cachedir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cachedir, "pyavaspec", "darkframes.npz")
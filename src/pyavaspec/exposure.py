@@ -0,0 +1,101 @@
+import numpy as np
+
+# Automatic exposure
+#
+# The counts of every pixel grow linearly with the integration time on top of
+# a constant dark offset. Instead of scanning integration times the search
+# measures a short exposure and extrapolates the integration time at which
+# the first pixel reaches the requested fraction of full scale. After a single
+# exposure the offset is taken from the supplied dark level or the median of
+# the frame (most pixels of a spectrum are dark). Once two unsaturated
+# exposures are available offset and slope are determined per pixel, so hot
+# pixels with a high dark level but no signal do not disturb the estimate.
+# Saturated exposures are shortened by a factor of four or bisected towards
+# the longest unsaturated exposure.
+
+class PyAvaSpecExposureResult:
+    def __init__(self, integrationTime, peakCounts, peakIndex, fraction, saturated, converged, history):
+        self.integrationTime = integrationTime
+        self.peakCounts = peakCounts
+        self.peakIndex = peakIndex
+        self.fraction = fraction
+        self.saturated = saturated
+        self.converged = converged
+        self.history = history
+
+    @property
+    def iterations(self):
+        return len(self.history)
+
+    def __repr__(self):
+        return "PyAvaSpecExposureResult(integrationTime = {}, peakCounts = {}, fraction = {:.3f}, saturated = {}, converged = {}, iterations = {})".format(
+            self.integrationTime, self.peakCounts, self.fraction, self.saturated, self.converged, self.iterations
+        )
+
+def countSaturated(frame, level):
+    return int(np.count_nonzero(frame >= level))
+
+def searchExposure(spec, targetFraction = 0.75, tolerance = 0.1, startIntegrationTime = 10, minIntegrationTime = 1, maxIntegrationTime = 1000, averageCount = 1, maxIterations = 8, darkLevel = None):
+    if not (0 < targetFraction < 1):
+        raise ValueError("Target fraction has to be between 0 and 1")
+    if not (minIntegrationTime <= startIntegrationTime <= maxIntegrationTime):
+        raise ValueError("Start integration time {} is outside of {} to {} ms".format(startIntegrationTime, minIntegrationTime, maxIntegrationTime))
+
+    fullScale = float(spec.SATURATIONCOUNTS)
+    target = targetFraction * fullScale
+    frame = np.zeros(spec.PIXELCOUNT, dtype = np.uint16)
+    history = []
+    unsaturated = []
+
+    integrationTime = int(startIntegrationTime)
+    for iteration in range(maxIterations):
+        spec.cmdMeasure(integrationTime = integrationTime, averageCount = averageCount, out = frame)
+        peakIndex = int(np.argmax(frame))
+        peakCounts = int(frame[peakIndex])
+        saturated = countSaturated(frame, spec.SATURATIONCOUNTS)
+        history.append({ 'integrationTime' : integrationTime, 'peakCounts' : peakCounts, 'peakIndex' : peakIndex, 'saturated' : saturated })
+
+        if saturated == 0:
+            if abs(peakCounts - target) <= tolerance * fullScale:
+                return PyAvaSpecExposureResult(integrationTime, peakCounts, peakIndex, peakCounts / fullScale, saturated, True, history)
+            unsaturated = [ u for u in unsaturated if u[0] != integrationTime ]
+            unsaturated.append((integrationTime, frame.astype(np.float64)))
+
+        if saturated > 0:
+            # The real peak height is unknown. Bisect towards the longest
+            # shorter exposure that was unsaturated, otherwise shorten strongly
+            shorter = [ u[0] for u in unsaturated if u[0] < integrationTime ]
+            if shorter:
+                nextTime = (max(shorter) + integrationTime) // 2
+            else:
+                nextTime = integrationTime // 4
+        else:
+            if len(unsaturated) >= 2:
+                (timeA, frameA), (timeB, frameB) = unsaturated[-2], unsaturated[-1]
+                slope = (frameB - frameA) / float(timeB - timeA)
+                offset = frameA - slope * timeA
+            else:
+                offset = float(darkLevel) if darkLevel != None else float(np.median(frame))
+                slope = np.array([ (peakCounts - offset) / integrationTime ])
+            rising = slope > 0
+            if not np.any(rising):
+                # No signal above the dark level - go for the longest exposure
+                nextTime = maxIntegrationTime
+            else:
+                offset = np.broadcast_to(offset, slope.shape)
+                nextTime = int(round(float(np.min((target - offset[rising]) / slope[rising]))))
+
+        nextTime = int(min(max(nextTime, minIntegrationTime), maxIntegrationTime))
+        if nextTime == integrationTime:
+            # Limited by the allowed range (too bright at the shortest or too
+            # dark at the longest exposure) or by the 1 ms resolution
+            break
+        integrationTime = nextTime
+
+    # Not converged: report the unsaturated exposure closest to the target
+    candidates = [ h for h in history if h['saturated'] == 0 ]
+    if candidates:
+        best = min(candidates, key = lambda h: abs(h['peakCounts'] - target))
+    else:
+        best = history[-1]
+    return PyAvaSpecExposureResult(best['integrationTime'], best['peakCounts'], best['peakIndex'], best['peakCounts'] / fullScale, best['saturated'], False, history)
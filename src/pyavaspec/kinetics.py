@@ -0,0 +1,168 @@
+import threading
+import time
+
+import numpy as np
+
+from pyavaspec.stream import PyAvaSpecRingBuffer
+from pyavaspec.archive import PyAvaSpecArchive, PyAvaSpecArchiveWriter
+
+# Kinetics (time series) capture
+#
+# An acquisition thread takes frames back to back (or at a fixed cadence)
+# and hands them to a writer thread via a preallocated ring buffer. The
+# writer appends them in batches to a binary archive (see pyavaspec.archive),
+# so acquisition only waits for the disk when the buffer is completely full.
+# Every frame is stamped with time.monotonic() directly after the transfer;
+# the archive stores these stamps shifted by a constant to wall clock time so
+# intervals are exact and absolute times are still meaningful.
+#
+#   with spec.cmdMeasureKinetics("warmup.avs", integrationTime = 50, duration = 600, interval = 1.0) as capture:
+#       capture.wait()
+#
+#   times, frames = PyAvaSpecArchive("warmup.avs").series()    # (time x pixel) view
+
+class PyAvaSpecKineticsCapture:
+    def __init__(self, spec, filename, integrationTime = 1000, averageCount = 1, softAverages = 1, frames = None, duration = None, interval = None, bufferSize = 256, batchSize = 32, calibration = None):
+        if (frames == None) and (duration == None):
+            raise ValueError("Either a frame count or a duration is required")
+        if softAverages < 1:
+            raise ValueError("At least one software average is required, got {}".format(softAverages))
+        self.spec = spec
+        self.filename = filename
+        self.integrationTime = integrationTime
+        self.averageCount = averageCount
+        self.softAverages = softAverages
+        self.frames = frames
+        self.duration = duration
+        self.interval = interval if (interval != None) and (interval > 0) else None
+        self.batchSize = batchSize
+
+        dtype = np.uint16 if softAverages == 1 else np.float32
+        if calibration == None:
+            calibration = spec.getCalibration().coefficients
+
+        self.writer = PyAvaSpecArchiveWriter(
+            filename,
+            pixelCount = spec.PIXELCOUNT,
+            dtype = dtype,
+            calibration = calibration,
+            integrationTime = integrationTime,
+            softAverages = softAverages,
+            hardAverages = averageCount
+        )
+
+        self.buffer = PyAvaSpecRingBuffer(capacity = bufferSize, pixelCount = spec.PIXELCOUNT, dtype = dtype, policy = "block")
+        self.stopEvent = threading.Event()
+        self.error = None
+
+        self.framesAcquired = 0
+        self.framesWritten = 0
+        self.framesLate = 0
+        self.started = None
+        self.finished = None
+        self.wallOffset = time.time() - time.monotonic()
+
+        self.writerThread = threading.Thread(target = self.writerLoop, name = "pyavaspec-kinetics-writer", daemon = True)
+        self.acquisitionThread = threading.Thread(target = self.acquisitionLoop, name = "pyavaspec-kinetics", daemon = True)
+        self.writerThread.start()
+        self.acquisitionThread.start()
+
+    def acquisitionLoop(self):
+        frame = np.zeros(self.spec.PIXELCOUNT, dtype = self.buffer.data.dtype)
+        try:
+            self.started = time.monotonic()
+            nextStart = self.started
+            while not self.stopEvent.is_set():
+                if (self.frames != None) and (self.framesAcquired >= self.frames):
+                    break
+                if (self.duration != None) and (time.monotonic() - self.started >= self.duration):
+                    break
+
+                if self.interval != None:
+                    delay = nextStart - time.monotonic()
+                    if delay > 0:
+                        if self.stopEvent.wait(delay):
+                            break
+                    elif self.framesAcquired > 0:
+                        # Acquisition slower than the requested cadence
+                        self.framesLate = self.framesLate + 1
+                    nextStart = max(nextStart + self.interval, time.monotonic())
+
+                if self.softAverages == 1:
+                    self.spec.cmdMeasure(integrationTime = self.integrationTime, averageCount = self.averageCount, out = frame)
+                else:
+                    frame[:] = self.spec.cmdMeasureSoftAverages(integrationTime = self.integrationTime, softAverages = self.softAverages, hardAverages = self.averageCount, statistics = True).mean
+                timestamp = time.monotonic()
+                self.buffer.put(frame, self.framesAcquired, timestamp)
+                self.framesAcquired = self.framesAcquired + 1
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = time.monotonic()
+            self.buffer.close()
+
+    def writerLoop(self):
+        batch = np.zeros((self.batchSize, self.spec.PIXELCOUNT), dtype = self.buffer.data.dtype)
+        timestamps = np.zeros(self.batchSize, dtype = np.float64)
+        try:
+            while True:
+                # Block for the first frame, then take whatever is already buffered
+                frame = self.buffer.get(out = batch[0])
+                if frame is None:
+                    break
+                timestamps[0] = frame.timestamp
+                n = 1
+                while (n < self.batchSize) and (len(self.buffer) > 0):
+                    frame = self.buffer.get(out = batch[n])
+                    if frame is None:
+                        break
+                    timestamps[n] = frame.timestamp
+                    n = n + 1
+                self.writer.appendMany(batch[:n], timestamps[:n] + self.wallOffset)
+                self.writer.flush()
+                self.framesWritten = self.framesWritten + n
+        except Exception as e:
+            self.error = e
+            # Unblock the acquisition thread
+            self.stopEvent.set()
+            self.buffer.close()
+        finally:
+            self.writer.close()
+
+    def getStatistics(self):
+        elapsed = None
+        if self.started != None:
+            elapsed = (self.finished if self.finished != None else time.monotonic()) - self.started
+        return {
+            'acquired' : self.framesAcquired,
+            'written'  : self.framesWritten,
+            'buffered' : len(self.buffer),
+            'late'     : self.framesLate,
+            'elapsed'  : elapsed,
+            'rate'     : self.framesAcquired / elapsed if elapsed else None
+        }
+
+    def wait(self, timeout = None):
+        # Waits till the capture has finished and all frames are on disk
+        self.acquisitionThread.join(timeout)
+        if self.acquisitionThread.is_alive():
+            return False
+        self.writerThread.join()
+        if self.error != None:
+            raise self.error
+        return True
+
+    def stop(self):
+        self.stopEvent.set()
+        self.acquisitionThread.join()
+        self.writerThread.join()
+
+    def series(self):
+        # Memory mapped archive of everything written so far
+        return PyAvaSpecArchive(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -0,0 +1,124 @@
+import threading
+import time
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Synchronized acquisition from several spectrometers. Every device gets its
+# own I/O thread, all threads meet at a barrier right before sending the
+# measurement command so exposures start together. Frames are tagged with
+# monotonic start and end timestamps and returned aligned by acquisition.
+
+class PyAvaSpecGroupFrame:
+    def __init__(self, sequence, serials, data, startTimestamps, endTimestamps):
+        self.sequence = sequence
+        self.serials = serials
+        self.data = data
+        self.startTimestamps = startTimestamps
+        self.endTimestamps = endTimestamps
+
+    def __len__(self):
+        return len(self.serials)
+
+    def __getitem__(self, key):
+        # Frame of a device by index or serial number
+        if isinstance(key, str):
+            key = self.serials.index(key)
+        return self.data[key]
+
+    def skew(self):
+        # Spread of the exposure start times between devices (seconds)
+        return float(np.max(self.startTimestamps) - np.min(self.startTimestamps))
+
+class PyAvaSpecDeviceGroup:
+    def __init__(self, specs):
+        if len(specs) < 1:
+            raise ValueError("A device group requires at least one spectrometer")
+        self.specs = list(specs)
+        self.serials = [ spec.serial if spec.serial != None else str(i) for i, spec in enumerate(self.specs) ]
+        self.executors = [ ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "pyavaspec-dev{}".format(i)) for i in range(len(self.specs)) ]
+        self.barrier = threading.Barrier(len(self.specs))
+        self.sequence = 0
+
+    @staticmethod
+    def open(serials = None, locations = None, transports = None):
+        # Opens the spectrometers selected by serial number or by (bus, address)
+        # tuples. Without a selection all attached devices are opened. Devices
+        # are enumerated once and every device is identified only once.
+        # transports replaces the attached devices (for example simulated ones)
+        from pyavaspec.pyavaspec import PyAvaSpec_2048_2, PyAvaSpecUSBTransport, PyAvaSpecDeviceNotFoundException
+
+        if serials != None:
+            return PyAvaSpecDeviceGroup(PyAvaSpec_2048_2.openSerials(serials, transports = transports))
+
+        if transports == None:
+            transports = PyAvaSpecUSBTransport.enumerate()
+        specs = []
+        try:
+            if locations != None:
+                byLocation = { (t.bus, t.address) : t for t in transports }
+                for bus, address in locations:
+                    if (bus, address) not in byLocation:
+                        raise PyAvaSpecDeviceNotFoundException("No AvaSpec-2048-2 device at bus {} address {}".format(bus, address))
+                    specs.append(PyAvaSpec_2048_2(transport = byLocation[(bus, address)]))
+            else:
+                for transport in transports:
+                    specs.append(PyAvaSpec_2048_2(transport = transport))
+        except Exception:
+            for spec in specs:
+                spec.close()
+            raise
+        return PyAvaSpecDeviceGroup(specs)
+
+    def measureDevice(self, idx, integrationTime, averageCount, out):
+        spec = self.specs[idx]
+        self.barrier.wait()
+        tStart = time.monotonic()
+        spec.cmdMeasure(integrationTime = integrationTime, averageCount = averageCount, out = out)
+        return tStart, time.monotonic()
+
+    def measure(self, integrationTime = 1000, averageCount = 1):
+        # Triggers all devices at once and returns a PyAvaSpecGroupFrame whose
+        # data is a (devices x pixels) array
+        data = np.zeros((len(self.specs), self.specs[0].PIXELCOUNT), dtype = np.uint16)
+        futures = [ self.executors[i].submit(self.measureDevice, i, integrationTime, averageCount, data[i]) for i in range(len(self.specs)) ]
+
+        startTimestamps = np.zeros(len(self.specs))
+        endTimestamps = np.zeros(len(self.specs))
+        error = None
+        for i, fut in enumerate(futures):
+            try:
+                startTimestamps[i], endTimestamps[i] = fut.result()
+            except threading.BrokenBarrierError:
+                pass
+            except Exception as e:
+                # Release devices still waiting for the failed one
+                self.barrier.abort()
+                if error == None:
+                    error = e
+        if error != None:
+            self.barrier.reset()
+            raise error
+
+        frame = PyAvaSpecGroupFrame(self.sequence, self.serials, data, startTimestamps, endTimestamps)
+        self.sequence = self.sequence + 1
+        return frame
+
+    def frames(self, integrationTime = 1000, averageCount = 1, count = None):
+        n = 0
+        while (count == None) or (n < count):
+            yield self.measure(integrationTime = integrationTime, averageCount = averageCount)
+            n = n + 1
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown(wait = True)
+        for spec in self.specs:
+            spec.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
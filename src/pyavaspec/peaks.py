@@ -0,0 +1,215 @@
+import bisect
+
+import numpy as np
+
+# Peak detection on a single spectrum. All local maxima are located in one
+# vectorized pass and filtered by minimum height and prominence (computed for
+# all candidates at once), the remaining candidates are then ranked by height
+# and filtered by distance to already accepted (higher) peaks.
+
+def localMaxima(data):
+    # Indices of strict local maxima (data[i-1] < data[i] > data[i+1])
+    data = np.asarray(data)
+    if len(data) < 3:
+        return np.zeros(0, dtype = np.intp)
+    center = data[1:-1]
+    return np.flatnonzero((data[:-2] < center) & (data[2:] < center)) + 1
+
+def peakProminence(data, idx):
+    # Height of the peak above the higher of the two minima between the peak
+    # and the nearest higher sample on either side (or the border)
+    data = np.asarray(data)
+    v = data[idx]
+
+    higher = np.flatnonzero(data[:idx] > v)
+    leftBound = higher[-1] + 1 if len(higher) > 0 else 0
+    higher = np.flatnonzero(data[idx+1:] > v)
+    rightBound = idx + 1 + higher[0] if len(higher) > 0 else len(data)
+
+    return v - max(np.min(data[leftBound:idx+1]), np.min(data[idx:rightBound]))
+
+def rangeTable(data, op):
+    # Sparse table with table[k, i] = op(data[i:i+2**k]), valid for
+    # i <= len(data) - 2**k (remaining entries are undefined)
+    n = len(data)
+    table = np.empty((max(1, n.bit_length()), n), dtype = data.dtype)
+    table[0] = data
+    for k in range(1, len(table)):
+        half = 1 << (k - 1)
+        m = n - (1 << k) + 1
+        table[k, :m] = op(table[k-1, :m], table[k-1, half:half+m])
+    return table
+
+def rangeQuery(table, op, lo, hi):
+    # op over data[lo:hi] for arrays of non-empty ranges
+    k = np.floor(np.log2(hi - lo)).astype(np.intp)
+    return op(table[k, lo], table[k, hi - (1 << k)])
+
+def peakProminences(data, indices):
+    # Vectorized peakProminence for all indices. The nearest higher sample on
+    # either side is located for all peaks at once by binary lifting over a
+    # sparse table of range maxima, the minima within the bounds are then
+    # range queries, so the cost is O(n log n) independent of the peak count
+    data = np.asarray(data)
+    indices = np.asarray(indices, dtype = np.intp)
+    n = len(data)
+    if len(indices) == 0:
+        return np.zeros(0, dtype = np.float64)
+
+    maxima = rangeTable(data, np.maximum)
+    minima = rangeTable(data, np.minimum)
+    v = data[indices]
+
+    # Extend [left, idx) and (idx, right) while all samples are not higher
+    left = indices.copy()
+    right = indices + 1
+    for k in reversed(range(len(maxima))):
+        step = 1 << k
+        ok = left - step >= 0
+        ok[ok] = maxima[k, left[ok] - step] <= v[ok]
+        left[ok] -= step
+        ok = right + step <= n
+        ok[ok] = maxima[k, right[ok]] <= v[ok]
+        right[ok] += step
+
+    leftMin = rangeQuery(minima, np.minimum, left, indices + 1)
+    rightMin = rangeQuery(minima, np.minimum, indices, right)
+    return (v - np.maximum(leftMin, rightMin)).astype(np.float64)
+
+def findPeaks(data, maxPeaks = 10, minHeight = None, minProminence = None, minDistance = None):
+    # Returns up to maxPeaks peak indices ordered by descending height. Fewer
+    # peaks are returned if fewer maxima satisfy the filters
+    data = np.asarray(data)
+    candidates = localMaxima(data)
+    if minHeight != None:
+        candidates = candidates[data[candidates] >= minHeight]
+    if (minProminence != None) and (len(candidates) > 0) and (maxPeaks > 0):
+        candidates = candidates[peakProminences(data, candidates) >= minProminence]
+    if (len(candidates) == 0) or (maxPeaks < 1):
+        return np.zeros(0, dtype = np.intp)
+
+    heights = data[candidates].astype(np.float64)
+    if minDistance == None:
+        # Plain top-k selection using a partial sort. Candidates are ordered
+        # by index, so equal heights are ranked lowest index first
+        if len(candidates) > maxPeaks:
+            threshold = heights[np.argpartition(-heights, maxPeaks - 1)[maxPeaks - 1]]
+            top = np.flatnonzero(heights >= threshold)
+            return candidates[top[np.argsort(-heights[top], kind = "stable")[:maxPeaks]]]
+        return candidates[np.argsort(-heights, kind = "stable")]
+
+    # The distance filter depends on the ranking (distance is checked against
+    # higher peaks only) so candidates are visited in descending order till
+    # enough are accepted
+    accepted = []
+    acceptedSorted = []
+    for ci in np.argsort(-heights, kind = "stable"):
+        idx = int(candidates[ci])
+        pos = bisect.bisect_left(acceptedSorted, idx)
+        if (pos > 0) and (idx - acceptedSorted[pos-1] < minDistance):
+            continue
+        if (pos < len(acceptedSorted)) and (acceptedSorted[pos] - idx < minDistance):
+            continue
+
+        accepted.append(idx)
+        bisect.insort(acceptedSorted, idx)
+        if len(accepted) >= maxPeaks:
+            break
+    return np.asarray(accepted, dtype = np.intp)
+
+def halfLevelCrossings(data, indices, levels, direction, window = 32):
+    # For every peak returns the index of the first sample at or below the
+    # supplied level when walking away from the peak in direction (-1 or +1),
+    # -1 if the border is reached first. Searches a window of samples for all
+    # peaks at once and only widens it for peaks that have not been resolved
+    n = len(data)
+    res = np.full(len(indices), -1, dtype = np.intp)
+    todo = np.arange(len(indices))
+    while len(todo) > 0:
+        pos = indices[todo, None] + direction * np.arange(1, window + 1)
+        inside = (pos >= 0) & (pos < n)
+        below = inside & (data[np.clip(pos, 0, n - 1)] <= levels[todo, None])
+        found = np.any(below, axis = 1)
+        first = np.argmax(below, axis = 1)
+        res[todo[found]] = pos[found, first[found]]
+        todo = todo[(~found) & np.all(inside, axis = 1)]
+        window = window * 4
+    return res
+
+def interpolatePeaks(data, indices, window = 32):
+    # Sub-pixel position (parabolic vertex through the maximum and its
+    # neighbours), height and linearly interpolated half maximum crossings of
+    # the supplied maxima (see characterizePeaks). Only samples around the
+    # peaks are accessed, window is the initial crossing search width
+    indices = np.asarray(indices, dtype = np.intp)
+    n = len(data)
+
+    height = data[indices].astype(np.float64)
+    half = height / 2.0
+
+    # Parabolic vertex through three samples
+    inner = (indices > 0) & (indices < n - 1)
+    ym = data[np.clip(indices - 1, 0, n - 1)].astype(np.float64)
+    yp = data[np.clip(indices + 1, 0, n - 1)].astype(np.float64)
+    denom = ym - 2.0 * height + yp
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        shift = np.where(inner & (denom != 0), 0.5 * (ym - yp) / denom, 0.0)
+    position = indices + np.clip(shift, -0.5, 0.5)
+
+    leftidx = halfLevelCrossings(data, indices, half, -1, window = window)
+    rightidx = halfLevelCrossings(data, indices, half, 1, window = window)
+    valid = (leftidx >= 0) & (rightidx >= 0)
+
+    li = np.where(valid, leftidx, indices)
+    ri = np.where(valid, rightidx, indices)
+    dl = data[li].astype(np.float64)
+    dr = data[ri].astype(np.float64)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        left = li + (half - dl) / (data[np.minimum(li + 1, n - 1)].astype(np.float64) - dl)
+        right = ri - (half - dr) / (data[np.maximum(ri - 1, 0)].astype(np.float64) - dr)
+
+    return {
+        'position' : position,
+        'height'   : height,
+        'leftidx'  : np.where(valid, leftidx, -1),
+        'rightidx' : np.where(valid, rightidx, -1),
+        'left'     : np.where(valid, left, np.nan),
+        'right'    : np.where(valid, right, np.nan),
+        'valid'    : valid
+    }
+
+def characterizePeaks(data, indices):
+    # Vectorized characterization of all supplied peaks. Returns a dictionary
+    # of arrays (one entry per peak):
+    #
+    #   position        Sub-pixel peak position (parabolic interpolation through the maximum and its neighbours)
+    #   centroid        Intensity weighted centroid of the samples above half maximum
+    #   height          Counts at the peak pixel
+    #   leftidx         First sample at or below half maximum left of the peak (-1 if not valid)
+    #   rightidx        First sample at or below half maximum right of the peak (-1 if not valid)
+    #   left / right    Linearly interpolated half maximum crossings (fractional pixel index, NaN if not valid)
+    #   fwhm            right - left in pixels (NaN if not valid)
+    #   area            Sum of counts between the half maximum crossings (counts times pixels)
+    #   valid           True if both half maximum crossings have been found
+    data = np.asarray(data, dtype = np.float64)
+    indices = np.asarray(indices, dtype = np.intp)
+    n = len(data)
+
+    res = interpolatePeaks(data, indices)
+    position, valid = res['position'], res['valid']
+    li = np.where(valid, res['leftidx'], indices)
+    ri = np.where(valid, res['rightidx'], indices)
+
+    # Area and centroid over the samples strictly between the crossings via cumulative sums
+    csum = np.concatenate(([ 0.0 ], np.cumsum(data)))
+    cmoment = np.concatenate(([ 0.0 ], np.cumsum(data * np.arange(n))))
+    area = csum[ri] - csum[li + 1]
+    moment = cmoment[ri] - cmoment[li + 1]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        centroid = np.where(valid & (area != 0), moment / area, position)
+    area = np.where(valid, area, np.nan)
+
+    res['centroid'] = centroid
+    res['fwhm'] = res['right'] - res['left']
+    res['area'] = area
+    return res
@@ -0,0 +1,197 @@
+import numpy as np
+
+# Compact peak tables
+#
+# Peaks are stored as rows of a NumPy structured array with fixed, typed
+# columns instead of one dictionary per peak (roughly 100 bytes per peak).
+# Single peaks are still accessed like before (table[0]['peak'], iterating
+# yields records that are indexed by column name), whole columns are
+# available as arrays (table['fwhm']).
+#
+# Missing values are explicit: NaN for floating point columns, -1 for index
+# columns and False for valid. Peaks without both half maximum crossings have
+# valid set to False and NaN FWHM values. frame and timestamp identify the
+# spectrum of a time series the peak has been found in (-1 and NaN for
+# single spectra). counts is stored as float64, integerCounts remembers if
+# the peaks have been found in an integer spectrum so text output keeps
+# writing them without fractional part.
+#
+# Text files keep the format of dumpPeaks (header line naming the columns,
+# one peak per line), .npy files store the records in binary form and can be
+# memory mapped:
+#
+#   peaks = proc.searchPeaks(data)
+#   peaks.save("peaks.dat")
+#   series = PyAvaSpecPeakTable.concatenate(tables, frames = range(len(tables)))
+#   series.save("peaks.npy")
+
+PEAKCOLUMNS = [
+    ( 'peak',          np.float64, np.nan ),
+    ( 'fwhm',          np.float64, np.nan ),
+    ( 'idx',           np.int32,   -1 ),
+    ( 'counts',        np.float64, np.nan ),
+    ( 'fwhm_leftidx',  np.int32,   -1 ),
+    ( 'fwhm_rightidx', np.int32,   -1 ),
+    ( 'fwhm_left',     np.float64, np.nan ),
+    ( 'fwhm_right',    np.float64, np.nan ),
+    ( 'position',      np.float64, np.nan ),
+    ( 'centroid',      np.float64, np.nan ),
+    ( 'area',          np.float64, np.nan ),
+    ( 'valid',         np.bool_,   False ),
+    ( 'frame',         np.int64,   -1 ),
+    ( 'timestamp',     np.float64, np.nan )
+]
+
+PEAKDTYPE = np.dtype([ (name, dtype) for name, dtype, missing in PEAKCOLUMNS ])
+PEAKMISSING = { name : missing for name, dtype, missing in PEAKCOLUMNS }
+
+# Columns (and order) of the text format written by dumpPeaks
+PEAKTEXTCOLUMNS = [ "peak", "fwhm", "idx", "counts", "fwhm_leftidx", "fwhm_rightidx", "fwhm_left", "fwhm_right" ]
+
+class PyAvaSpecPeakTable:
+    def __init__(self, records = None, integerCounts = False):
+        if records is None:
+            records = np.zeros(0, dtype = PEAKDTYPE)
+        if records.dtype != PEAKDTYPE:
+            raise ValueError("Peak records have to be of dtype {}".format(PEAKDTYPE))
+        self.records = records
+        self.integerCounts = integerCounts
+
+    @staticmethod
+    def empty(size, integerCounts = False):
+        # Table of size peaks with all columns set to their missing value
+        records = np.empty(size, dtype = PEAKDTYPE)
+        for name in PEAKMISSING:
+            records[name] = PEAKMISSING[name]
+        return PyAvaSpecPeakTable(records, integerCounts)
+
+    @staticmethod
+    def fromDicts(peaks):
+        # Converts a list of peak dictionaries (the former searchPeaks result),
+        # keys that are not present are filled with the missing value
+        table = PyAvaSpecPeakTable.empty(len(peaks))
+        table.integerCounts = all([ isinstance(pk.get('counts'), (int, np.integer)) for pk in peaks ])
+        for name in PEAKMISSING:
+            values = [ pk.get(name, PEAKMISSING[name]) for pk in peaks ]
+            table.records[name] = values
+        if (len(peaks) > 0) and ('valid' not in peaks[0]):
+            table.records['valid'] = ~np.isnan(table.records['fwhm'])
+        return table
+
+    @staticmethod
+    def concatenate(tables, frames = None, timestamps = None):
+        # Joins the tables of several spectra into one table. When supplied
+        # frames and timestamps (one per table) are assigned to their peaks
+        tables = [ asPeakTable(t) for t in tables ]
+        counts = [ len(t) for t in tables ]
+        integerCounts = all([ t.integerCounts for t in tables ])
+        res = PyAvaSpecPeakTable(np.concatenate([ t.records for t in tables ]) if tables else None, integerCounts)
+        if frames is not None:
+            res.records['frame'] = np.repeat(np.asarray(frames, dtype = np.int64), counts)
+        if timestamps is not None:
+            res.records['timestamp'] = np.repeat(np.asarray(timestamps, dtype = np.float64), counts)
+        return res
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, key):
+        # Integer: single record, string: column, everything else (slices,
+        # masks, index arrays): new table
+        if isinstance(key, str) or np.isscalar(key):
+            return self.records[key]
+        return PyAvaSpecPeakTable(self.records[key], self.integerCounts)
+
+    def __repr__(self):
+        return "PyAvaSpecPeakTable({} peaks)".format(len(self.records))
+
+    @property
+    def nbytes(self):
+        return self.records.nbytes
+
+    def frame(self, frame):
+        # Peaks found in the supplied frame of a series
+        return self[self.records['frame'] == frame]
+
+    def toDicts(self):
+        # List of dictionaries with Python values (for JSON or legacy code)
+        columns = { name : self.records[name].tolist() for name in PEAKMISSING }
+        return [ { name : columns[name][i] for name in columns } for i in range(len(self.records)) ]
+
+    def formatText(self, columns = None):
+        # Header and one line per peak. The whole table is formatted by a
+        # single string operation on Python values, so numbers are written
+        # with their shortest exact representation like before (counts of
+        # integer spectra as integers)
+        if columns == None:
+            columns = PEAKTEXTCOLUMNS
+        for name in columns:
+            if name not in PEAKMISSING:
+                raise ValueError("Unknown peak column {}".format(name))
+        res = "# " + " ".join(columns) + "\n"
+        if len(self.records) == 0:
+            return res
+        values = np.empty((len(self.records), len(columns)), dtype = object)
+        for i, name in enumerate(columns):
+            column = self.records[name]
+            if column.dtype == np.bool_:
+                column = column.astype(np.int8)
+            elif (name == 'counts') and self.integerCounts:
+                column = column.astype(np.int64)
+            values[:, i] = column.tolist()
+        lineFormat = " ".join([ "%r" ] * len(columns)) + "\n"
+        return res + (lineFormat * len(self.records)) % tuple(values.ravel().tolist())
+
+    def save(self, filename, columns = None):
+        # .npy files store all columns in binary form, everything else is
+        # written as text (by default the dumpPeaks columns)
+        if filename.endswith(".npy"):
+            np.save(filename, self.records)
+            return
+        with open(filename, 'w') as f:
+            f.write(self.formatText(columns))
+
+    @staticmethod
+    def load(filename, mmap = False):
+        if filename.endswith(".npy"):
+            records = np.load(filename, mmap_mode = "r" if mmap else None, allow_pickle = False)
+            return PyAvaSpecPeakTable(records)
+        with open(filename, 'r') as f:
+            return PyAvaSpecPeakTable.parseText(f.read().splitlines())
+
+    @staticmethod
+    def parseText(lines):
+        # Columns are taken from the header, files without a header use the
+        # dumpPeaks columns. Unknown columns (for example the run column of
+        # avabatch tables) are skipped
+        columns = PEAKTEXTCOLUMNS
+        if lines and lines[0].startswith("#"):
+            columns = lines[0][1:].split()
+        rows = [ ln for ln in lines if ln.strip() and not ln.lstrip().startswith("#") ]
+
+        table = PyAvaSpecPeakTable.empty(len(rows))
+        if rows and ('counts' in columns):
+            ci = columns.index('counts')
+            table.integerCounts = all([ ln.split()[ci].lstrip("-").isdigit() for ln in rows ])
+        usecols = [ i for i in range(len(columns)) if columns[i] in PEAKMISSING ]
+        if rows and usecols:
+            data = np.loadtxt(rows, dtype = np.float64, ndmin = 2, usecols = usecols)
+            for j, i in enumerate(usecols):
+                table.records[columns[i]] = data[:, j]
+        if 'valid' not in columns:
+            table.records['valid'] = ~np.isnan(table.records['fwhm'])
+        return table
+
+def asPeakTable(peaks):
+    # Accepts a peak table, a structured array of peak records or a list of
+    # peak dictionaries
+    if isinstance(peaks, PyAvaSpecPeakTable):
+        return peaks
+    if isinstance(peaks, np.ndarray) and (peaks.dtype == PEAKDTYPE):
+        return PyAvaSpecPeakTable(peaks)
+    if not peaks:
+        return PyAvaSpecPeakTable()
+    return PyAvaSpecPeakTable.fromDicts(list(peaks))
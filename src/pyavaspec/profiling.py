@@ -0,0 +1,178 @@
+import json
+import math
+import threading
+import time
+
+# Lightweight instrumentation of the acquisition and processing hot paths.
+#
+# A single module level profiler (PROFILER) collects per stage latencies and
+# counters. It is disabled by default; instrumented code only checks the
+# enabled flag (or enters a shared no-op context) so the overhead of disabled
+# profiling is a single attribute lookup per stage:
+#
+#   from pyavaspec.profiling import PROFILER
+#
+#   PROFILER.enable()
+#   spec.cmdMeasure(integrationTime = 10)
+#   print(PROFILER.toJson())
+#
+# Stages recorded by the package:
+#
+#   usb.write, usb.read     Bulk transfers including control commands (counters
+#                           usb.writes / usb.reads, usb.byteswritten /
+#                           usb.bytesread, usb.packets)
+#   measure                 Complete measurement (command, transfer, decode),
+#                           counters frames, frame.reads, frame.bytes and
+#                           frame.packets only cover spectrum transfers
+#   decode                  Conversion of the received payload into counts
+#   loaddata, dumpdata      Text file I/O
+#   moveavg, peaks, plot    Processing and matplotlib rendering
+#   cli.<command>           Every executed avacli command
+
+# Latency histogram buckets: upper bounds in seconds from 1 us to about 67 s
+# in powers of two (the last bucket collects everything above)
+HISTOGRAMBUCKETS = [ 1e-6 * (2**i) for i in range(27) ]
+
+class PyAvaSpecStageStatistics:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.histogram = [ 0 ] * (len(HISTOGRAMBUCKETS) + 1)
+
+    def record(self, elapsed):
+        self.count = self.count + 1
+        self.total = self.total + elapsed
+        if (self.min == None) or (elapsed < self.min):
+            self.min = elapsed
+        if (self.max == None) or (elapsed > self.max):
+            self.max = elapsed
+        if elapsed <= HISTOGRAMBUCKETS[0]:
+            bucket = 0
+        else:
+            bucket = min(int(math.ceil(math.log2(elapsed / HISTOGRAMBUCKETS[0]))), len(HISTOGRAMBUCKETS))
+        self.histogram[bucket] = self.histogram[bucket] + 1
+
+    def percentile(self, p):
+        # Upper bound of the histogram bucket containing the p-th percentile
+        if self.count == 0:
+            return None
+        threshold = self.count * p / 100.0
+        seen = 0
+        for i in range(len(self.histogram)):
+            seen = seen + self.histogram[i]
+            if seen >= threshold:
+                return HISTOGRAMBUCKETS[i] if i < len(HISTOGRAMBUCKETS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            'count'     : self.count,
+            'total'     : self.total,
+            'mean'      : self.total / self.count if self.count > 0 else None,
+            'min'       : self.min,
+            'max'       : self.max,
+            'p50'       : self.percentile(50),
+            'p99'       : self.percentile(99),
+            'histogram' : { ("{:g}".format(HISTOGRAMBUCKETS[i]) if i < len(HISTOGRAMBUCKETS) else "inf") : self.histogram[i] for i in range(len(self.histogram)) if self.histogram[i] > 0 }
+        }
+
+class PyAvaSpecNullStage:
+    # Shared context used while profiling is disabled
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+class PyAvaSpecTimedStage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+        return False
+
+class PyAvaSpecProfiler:
+    NULLSTAGE = PyAvaSpecNullStage()
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.counters = {}
+            self.firstFrame = None
+            self.lastFrame = None
+            self.started = time.perf_counter()
+
+    def stage(self, name):
+        # Context manager timing the enclosed block
+        if not self.enabled:
+            return self.NULLSTAGE
+        return PyAvaSpecTimedStage(self, name)
+
+    def record(self, name, elapsed):
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = PyAvaSpecStageStatistics()
+            self.stages[name].record(elapsed)
+
+    def count(self, name, increment = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + increment
+
+    def frame(self, nbytes, reads, packetSize = 64):
+        # Marks a received spectrum, used for the frame rate and the per frame
+        # transfer statistics (a transfer ends with a short or zero length packet)
+        now = time.perf_counter()
+        with self.lock:
+            for name, increment in [ ('frames', 1), ('frame.reads', reads), ('frame.bytes', nbytes), ('frame.packets', nbytes // packetSize + 1) ]:
+                self.counters[name] = self.counters.get(name, 0) + increment
+            if self.firstFrame == None:
+                self.firstFrame = now
+            self.lastFrame = now
+
+    def summary(self):
+        with self.lock:
+            counters = dict(self.counters)
+            stages = { name : self.stages[name].summary() for name in sorted(self.stages) }
+            frames = counters.get('frames', 0)
+            derived = {
+                'elapsed' : time.perf_counter() - self.started,
+                'fps'     : None
+            }
+            if (frames > 1) and (self.lastFrame > self.firstFrame):
+                derived['fps'] = (frames - 1) / (self.lastFrame - self.firstFrame)
+            if frames > 0:
+                for name, key in [ ('frame.reads', 'readsperframe'), ('frame.packets', 'packetsperframe'), ('frame.bytes', 'bytesperframe') ]:
+                    derived[key] = counters[name] / frames
+        return { 'stages' : stages, 'counters' : counters, 'derived' : derived }
+
+    def toJson(self, indent = 2):
+        return json.dumps(self.summary(), indent = indent)
+
+    def dumpJson(self, filename = None):
+        if not filename or (filename == "-"):
+            print(self.toJson())
+        else:
+            with open(filename, 'w') as f:
+                f.write(self.toJson())
+                f.write("\n")
+
+PROFILER = PyAvaSpecProfiler()
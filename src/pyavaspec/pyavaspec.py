@@ -1,13 +1,25 @@
-import usb
-import usb.core as usbcore
-
-from matplotlib import pyplot as plt
+import array
+import threading
+import time
+
+import numpy as np
+
+from pyavaspec.stream import PyAvaSpecStream
+from pyavaspec.kinetics import PyAvaSpecKineticsCapture
+from pyavaspec.averaging import PyAvaSpecAccumulator, STACKMETHODS, stackFrames
+from pyavaspec import smoothing
+from pyavaspec import peaks as peakfinder
+from pyavaspec.calibration import PyAvaSpecCalibration
+from pyavaspec.peaktable import PyAvaSpecPeakTable, asPeakTable
+from pyavaspec.profiling import PROFILER
+from pyavaspec import exposure
 
 class NetworkException(Exception):
     pass
 
 def close_event():
     # Only used during testing (remove from final code)
+    from matplotlib import pyplot as plt
     plt.close()
 
 class PyAvaSpecCommunicationError(Exception):
@@ -16,7 +28,185 @@ class PyAvaSpecCommunicationError(Exception):
 class PyAvaSpecDeviceNotFoundException(Exception):
     pass
 
-class PyAvaSpec_2048_2:
+class PyAvaSpecUSBTransport:
+    # Thin wrapper around the pyusb device so the spectrometer can also talk
+    # to other transports (for example the simulated device from pyavaspec.simulator)
+    # that provide the same write, read and dispose methods
+    def __init__(self, device):
+        self.device = device
+        self.bus = getattr(device, "bus", None)
+        self.address = getattr(device, "address", None)
+
+    def write(self, endpoint, payload, timeout):
+        return self.device.write(endpoint, payload, timeout)
+
+    def read(self, endpoint, sizeOrBuffer, timeout):
+        return self.device.read(endpoint, sizeOrBuffer, timeout)
+
+    def dispose(self):
+        import usb.util
+        usb.util.dispose_resources(self.device)
+
+    @staticmethod
+    def find():
+        # pyusb is only imported once a device is actually requested so offline
+        # processing works without it
+        import usb.core as usbcore
+        dev = usbcore.find(idVendor=0x1992, idProduct=0x0666)
+        if dev == None:
+            return None
+        return PyAvaSpecUSBTransport(dev)
+
+    @staticmethod
+    def enumerate(bus = None, address = None):
+        # All attached AvaSpec-2048-2 devices, optionally filtered by bus and address
+        import usb.core as usbcore
+        res = []
+        for dev in usbcore.find(find_all = True, idVendor=0x1992, idProduct=0x0666):
+            if (bus != None) and (dev.bus != bus):
+                continue
+            if (address != None) and (dev.address != address):
+                continue
+            res.append(PyAvaSpecUSBTransport(dev))
+        return res
+
+class PyAvaSpecProcessing:
+    # Processing of spectra that does not require a spectrometer (loading,
+    # storing, plotting, filtering and peak search). Can be instantiated on
+    # its own for offline processing, PyAvaSpec_2048_2 inherits all methods.
+    #
+    # Methods accepting a calibration take either a coefficient list (highest
+    # order first) or a PyAvaSpecCalibration. Without one the calibration
+    # assigned to the instance (or the fixed default) is used.
+
+    DEFAULTCALIBRATION = [ 0.546875, 299.67 ]
+    calibration = None
+
+    def getCalibration(self, calibration = None):
+        if calibration is None:
+            calibration = self.calibration if self.calibration is not None else self.DEFAULTCALIBRATION
+        return PyAvaSpecCalibration.get(calibration)
+
+    def loadData(self, filename):
+        data = []
+
+        if not filename:
+            raise ValueError("Missing filename")
+        with PROFILER.stage("loaddata"), open(filename, 'r') as f:
+            lns = f.readlines()
+            for line in lns:
+                parts = line.strip().split()
+                if len(parts) != 2:
+                    continue
+                data.append(int(parts[1]))
+        return data
+
+
+    def dumpData(self, data, filename = None, calibration = None):
+        with PROFILER.stage("dumpdata"):
+            wavelengths = self.getCalibration(calibration).axis(len(data)).tolist()
+            if isinstance(data, np.ndarray):
+                data = data.tolist()
+            lines = "".join([ "{} {}\n".format(wavelengths[i], data[i]) for i in range(len(data)) ])
+            if not filename:
+                print(lines, end = "")
+            else:
+                with open(filename, 'w') as f:
+                    f.write(lines)
+
+    def plotData(self, data, peaks = [], peakFwhmLine = False, xrange = None, calibration = None, filename = None, fileformat = 'png', title = "Spectrometer output", showtimeout = 0):
+        # matplotlib is imported on first use to keep startup of non plotting users fast
+        from matplotlib import pyplot as plt
+
+        with PROFILER.stage("plot"):
+            freqs = self.getCalibration(calibration).axis(len(data))
+
+            plt.clf()
+            plt.title(title)
+            plt.xlabel("Wavelength [nm]")
+            plt.ylabel("Counts")
+
+            if xrange:
+                plt.xlim(xrange)
+
+            plt.plot(freqs, data)
+            if peaks is not None:
+                for pk in asPeakTable(peaks):
+                    plt.plot(freqs[pk['idx']], data[pk['idx']], marker = "H")
+                    if peakFwhmLine and pk['valid']:
+                        plt.plot([freqs[pk['fwhm_leftidx']], freqs[pk['fwhm_rightidx']]], [data[pk['fwhm_leftidx']], data[pk['fwhm_rightidx']]])
+
+            if filename:
+                plt.savefig(filename, format = fileformat)
+            elif showtimeout > 0:
+                fig = plt.figure()
+                timer = fig.canvas.new_timer(interval = showtimeout)
+                timer.add_callback(close_event)
+                timer.start()
+
+        if not filename:
+            # Waiting for the user to close the window is not part of the rendering time
+            plt.show()
+
+    def indexToWavelength(self, pixelIndex, calibration = None):
+        return self.getCalibration(calibration).indexToWavelength(pixelIndex)
+
+    def findSaturatedPixels(self, data, level = 65535):
+        # Indices of all pixels at or above the saturation level
+        return np.flatnonzero(np.asarray(data) >= level)
+
+    def resampleData(self, data, grid, calibration = None):
+        # Interpolates a spectrum (or a stack of spectra) onto a wavelength grid
+        return self.getCalibration(calibration).resample(data, grid)
+
+    def applyMovingAverage(self, data, windowSize = 10):
+        # Centered moving average that keeps the length of the spectrum (edges
+        # use the nearest sample). Lists are returned as lists, arrays (also
+        # 2-D stacks of spectra) as arrays
+        with PROFILER.stage("moveavg"):
+            avgData = smoothing.boxcar(data, windowSize = windowSize)
+        if isinstance(data, list):
+            return avgData.tolist()
+        return avgData
+
+    def searchPeaks(self, data, maxPeaks = 10, minHeight = None, minProminence = None, minDistance = None, calibration = None):
+        cal = self.getCalibration(calibration)
+        with PROFILER.stage("peaks"):
+            indices = peakfinder.findPeaks(data, maxPeaks = maxPeaks, minHeight = minHeight, minProminence = minProminence, minDistance = minDistance)
+            props = peakfinder.characterizePeaks(data, indices)
+
+            # Peaks without both half maximum crossings are reported with valid set
+            # to False, NaN wavelengths and -1 as FWHM indices
+            peaks = PyAvaSpecPeakTable.empty(len(indices), integerCounts = np.asarray(data).dtype.kind in "iu")
+            records = peaks.records
+            records['idx'] = indices
+            records['counts'] = props['height']
+            records['peak'] = cal.indexToWavelength(props['position'])
+            records['position'] = props['position']
+            records['centroid'] = props['centroid']
+            records['area'] = props['area']
+            records['valid'] = props['valid']
+            records['fwhm_leftidx'] = props['leftidx']
+            records['fwhm_rightidx'] = props['rightidx']
+            records['fwhm_left'] = cal.indexToWavelength(props['left'])
+            records['fwhm_right'] = cal.indexToWavelength(props['right'])
+            records['fwhm'] = records['fwhm_right'] - records['fwhm_left']
+
+        return peaks
+
+    def dumpPeaks(self, peaks, filename = None):
+        # Accepts a peak table or a list of peak dictionaries, files ending in
+        # .npy are written in binary form
+        peaks = asPeakTable(peaks)
+        if not filename:
+            print(peaks.formatText(), end = "")
+        else:
+            peaks.save(filename)
+
+    def loadPeaks(self, filename):
+        return PyAvaSpecPeakTable.load(filename)
+
+class PyAvaSpec_2048_2(PyAvaSpecProcessing):
     CMD_GET_IDENT     = [ 0x0F ]
     CMD_2             = [ 0x10, 0x01 ]
     CMD_3             = [ 0x07, 0x01, 0x01 ]
@@ -30,211 +220,326 @@ class PyAvaSpec_2048_2:
     CMD_READ_SPECTRUM = [ 0x03, 0xD2, 0x04, 0x0D, 0x00 ]
     CMD_STOP          = [ 0x07, 0x08, 0x00 ]
 
-    def __init__(self):
-        self.Device = usbcore.find(idVendor=0x1992, idProduct=0x0666)
-        if(self.Device == None):
-            raise PyAvaSpecDeviceNotFoundException("No AvaSpec-2048-2 device found")
+    PIXELCOUNT        = 2048
+    PACKETSIZE        = 64
+    RXBUFFERSIZE      = 8192
+    SATURATIONCOUNTS  = 65535
+
+    # Layout of the identification reply (CMD_GET_IDENT) as used by this
+    # library: two header bytes (reply code and status), the serial number as
+    # 10 byte NUL padded ASCII field and the NUL terminated model name. It has
+    # not been taken from vendor documentation, the simulator implements the
+    # same layout. parseIdentity rejects short replies and serial fields that
+    # are not printable ASCII so a device answering differently fails with an
+    # explicit PyAvaSpecCommunicationError instead of yielding a wrong serial
+    IDENTSERIALOFFSET = 2
+    IDENTSERIALLENGTH = 10
+
+    # Devices opened by an instance, keyed by USB location (or by the
+    # transport object if it has no location), mapped to their serial. Serial
+    # lookups and enumeration skip them so a device in use never sees a
+    # second identification handshake
+    claimedDevices = {}
+    claimLock = threading.Lock()
+
+    def __init__(self, transport = None, bus = None, address = None, serial = None):
+        # Without a transport the first AvaSpec-2048-2 matching the optional
+        # bus, address and serial number (from the identification response) is
+        # used. A list of transports is searched for the serial number the same way
         self.timeout = 120000
         self.adrWrite = 0x02
         self.adrRead = 0x82
+        self.identity = None
+        self.serial = None
+        self.claimKey = None
+        self.lastTransferReads = 0
+
+        # Receive buffer reused for every transfer. It is larger than a full
+        # spectrum frame so a frame is received in a single bulk transfer
+        self.rxBuffer = array.array('B', bytes(self.RXBUFFERSIZE))
+
+        if isinstance(transport, (list, tuple)):
+            candidates = list(transport)
+        elif transport != None:
+            candidates = [ transport ]
+        elif (bus == None) and (address == None) and (serial == None):
+            candidates = [ PyAvaSpecUSBTransport.find() ]
+        else:
+            candidates = PyAvaSpecUSBTransport.enumerate(bus = bus, address = address)
+
+        self.Device = None
+        inUse = 0
+        for candidate in candidates:
+            if candidate == None:
+                continue
+            key = self.deviceKey(candidate)
+            with self.claimLock:
+                if key in self.claimedDevices:
+                    inUse = inUse + 1
+                    continue
+                self.claimedDevices[key] = None
+            self.claimKey = key
+            self.Device = candidate
+            try:
+                self.getVersionInformation()
+            except Exception:
+                self.Device = None
+                self.releaseClaim()
+                raise
+            if (serial == None) or (self.serial == serial):
+                with self.claimLock:
+                    self.claimedDevices[key] = self.serial
+                break
+            self.close()
 
-        self.getVersionInformation()
+        if(self.Device == None):
+            if inUse > 0:
+                raise PyAvaSpecDeviceNotFoundException("No AvaSpec-2048-2 device found ({} matching devices are already in use)".format(inUse))
+            raise PyAvaSpecDeviceNotFoundException("No AvaSpec-2048-2 device found")
+
+    @staticmethod
+    def deviceKey(transport):
+        bus = getattr(transport, "bus", None)
+        address = getattr(transport, "address", None)
+        if (bus != None) and (address != None):
+            return (bus, address)
+        return transport
+
+    def releaseClaim(self):
+        if self.claimKey != None:
+            with self.claimLock:
+                self.claimedDevices.pop(self.claimKey, None)
+            self.claimKey = None
+
+    @staticmethod
+    def openSerials(serials, transports = None):
+        # Opens the spectrometers with the supplied serial numbers (in that
+        # order). Attached devices are enumerated once and every device not in
+        # use is identified exactly once, devices that have not been requested
+        # are stopped and released again
+        if len(set(serials)) != len(serials):
+            raise ValueError("Serial numbers have to be unique")
+        if transports == None:
+            transports = PyAvaSpecUSBTransport.enumerate()
+        found = {}
+        try:
+            for transport in transports:
+                with PyAvaSpec_2048_2.claimLock:
+                    if PyAvaSpec_2048_2.deviceKey(transport) in PyAvaSpec_2048_2.claimedDevices:
+                        continue
+                spec = PyAvaSpec_2048_2(transport = transport)
+                if (spec.serial in serials) and (spec.serial not in found):
+                    found[spec.serial] = spec
+                else:
+                    spec.close()
+            missing = [ serial for serial in serials if serial not in found ]
+            if missing:
+                raise PyAvaSpecDeviceNotFoundException("No AvaSpec-2048-2 device with serial {} found".format(", ".join(missing)))
+        except Exception:
+            for spec in found.values():
+                spec.close()
+            raise
+        return [ found[serial] for serial in serials ]
+
+    @staticmethod
+    def enumerateDevices(transports = None):
+        # Opens every attached spectrometer (or every supplied transport) once
+        # to read its identification and returns a list of dictionaries with
+        # bus, address and serial. Devices in use are reported without
+        # touching them
+        if transports == None:
+            transports = PyAvaSpecUSBTransport.enumerate()
+        res = []
+        for transport in transports:
+            key = PyAvaSpec_2048_2.deviceKey(transport)
+            with PyAvaSpec_2048_2.claimLock:
+                claimed = key in PyAvaSpec_2048_2.claimedDevices
+                serial = PyAvaSpec_2048_2.claimedDevices.get(key)
+            if claimed:
+                res.append({ 'bus' : transport.bus, 'address' : transport.address, 'serial' : serial })
+                continue
+            spec = PyAvaSpec_2048_2(transport = transport)
+            res.append({ 'bus' : transport.bus, 'address' : transport.address, 'serial' : spec.serial })
+            spec.close()
+        return res
 
     def writeDevice(self, payload):
         if self.Device == None:
             raise PyAvaSpecDeviceNotFoundException("Device is not connected")
-        byteswritten = self.Device.write(self.adrWrite, payload, self.timeout)
+        if PROFILER.enabled:
+            t = time.perf_counter()
+            byteswritten = self.Device.write(self.adrWrite, payload, self.timeout)
+            PROFILER.record("usb.write", time.perf_counter() - t)
+            PROFILER.count("usb.writes")
+            PROFILER.count("usb.byteswritten", len(payload))
+        else:
+            byteswritten = self.Device.write(self.adrWrite, payload, self.timeout)
         if byteswritten != len(payload):
             raise PyAvaSpecCommunicationError("Failed to transmit full payload ({} of {} bytes written)".format(byteswritten, len(payload)))
         return None
 
     def readDevice(self, numbytes = 0):
+        # Reads into the preallocated receive buffer and returns a memoryview
+        # of the received bytes. The view is only valid till the next read.
         if self.Device == None:
             raise PyAvaSpecDeviceNotFoundException("Device is not connected")
+        if PROFILER.enabled:
+            t = time.perf_counter()
+            readData, reads = self.readTransfer(numbytes)
+            PROFILER.record("usb.read", time.perf_counter() - t)
+            self.lastTransferReads = reads
+            PROFILER.count("usb.reads", reads)
+            if readData is not None:
+                PROFILER.count("usb.bytesread", len(readData))
+                PROFILER.count("usb.packets", len(readData) // self.PACKETSIZE + 1)
+            return readData
+        return self.readTransfer(numbytes)[0]
+
+    def readTransfer(self, numbytes):
+        # Returns the received data (or None) and the number of read calls
+        reads = 1
         if(numbytes == 0):
-            # Try to read a full packet till we see a packet smaller than 64 bytes
-            data = None
-            while True:
-                datablock = self.Device.read(self.adrRead, 64, self.timeout)
-                if data == None:
-                    data = datablock
-                else:
-                    data = data + datablock
-                if len(datablock) != 64:
-                    break
-            if len(data) == 0:
-                return None
-            return data
+            # Read till the transfer is terminated by a short (or zero length) packet
+            received = self.Device.read(self.adrRead, self.rxBuffer, self.timeout)
+            while received == len(self.rxBuffer):
+                # Buffer exhausted without seeing the end of the transfer - grow
+                # it permanently and continue with packet sized reads
+                newBuffer = array.array('B', bytes(2 * len(self.rxBuffer)))
+                newBuffer[:received] = self.rxBuffer[:received]
+                self.rxBuffer = newBuffer
+                while received < len(self.rxBuffer):
+                    datablock = self.Device.read(self.adrRead, self.PACKETSIZE, self.timeout)
+                    reads = reads + 1
+                    self.rxBuffer[received:received + len(datablock)] = array.array('B', datablock)
+                    received = received + len(datablock)
+                    if len(datablock) != self.PACKETSIZE:
+                        break
+            if received == 0:
+                return None, reads
+            return memoryview(self.rxBuffer)[:received], reads
         else:
-            data = None
-            while len(data) < numbytes:
-                datablock = self.Device.read(self.adrRead, 64, self.timeout)
-                if data == None:
-                    data = datablock
-                else:
-                    data = data + datablock
-            if len(data) != numbytes:
-                return None
-            return data
+            if numbytes > len(self.rxBuffer):
+                self.rxBuffer = array.array('B', bytes(((numbytes + self.PACKETSIZE - 1) // self.PACKETSIZE) * self.PACKETSIZE))
+            received = self.Device.read(self.adrRead, self.rxBuffer, self.timeout)
+            if received != numbytes:
+                return None, reads
+            return memoryview(self.rxBuffer)[:received], reads
 
     def __enter__(self):
-        pass
+        return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         if self.Device != None:
-            usb.util.dispose_resources(self.Device)
+            self.Device.dispose()
             self.Device = None
 
     def close(self):
         if self.Device != None:
-            self.writeDevice(self.CMD_STOP)
-            self.readDevice()
-            usb.util.dispose_resources(self.Device)
-            self.Device = None
-
-    def cmdMeasure(self, integrationTime = 1000, averageCount = 1):
+            try:
+                self.writeDevice(self.CMD_STOP)
+                self.readDevice()
+                self.Device.dispose()
+            finally:
+                self.Device = None
+                self.releaseClaim()
+
+    def decodeFrame(self, readData, asArray = False, out = None):
+        # The spectrum is transmitted as little endian 16 bit values at the end of the payload.
+        # np.frombuffer only reinterprets the receive buffer. Since that buffer is
+        # reused by the next transfer the result is either written into out
+        # (no allocation at all) or copied into a new array
+        if readData is None:
+            raise PyAvaSpecCommunicationError("No data received from device")
+        dataBaseOffset = len(readData) - self.PIXELCOUNT*2
+        if dataBaseOffset < 0:
+            raise PyAvaSpecCommunicationError("Received short frame ({} bytes, expected at least {})".format(len(readData), self.PIXELCOUNT*2))
+        with PROFILER.stage("decode"):
+            newData = np.frombuffer(readData, dtype = '<u2', count = self.PIXELCOUNT, offset = dataBaseOffset)
+            if out is not None:
+                np.copyto(out, newData, casting = 'unsafe')
+                return out
+            if asArray:
+                return newData.copy()
+            return newData.tolist()
+
+    def cmdMeasure(self, integrationTime = 1000, averageCount = 1, asArray = False, out = None):
         cmd = [ 0x03, integrationTime % 256, (integrationTime // 256) % 256, averageCount % 256, (averageCount // 256) % 256 ]
-        self.writeDevice(cmd)
-        readData = self.readDevice()
-#        print(readData)
-        dataBaseOffset = len(readData) - 2048*2
-        newData = [ None ] * 2048
-        for i in range(2048):
-            #pxFrequency = 280 + i * 0.546875 + 19.67
-            pxValue = readData[dataBaseOffset + 2*i + 1] * 256 + readData[dataBaseOffset + 2*i]
-            newData[i] = pxValue
-        return newData
-
-    def cmdMeasureSoftAverages(self, integrationTime = 1000, softAverages = 1, hardAverages = 1):
-        data = None
-
-        for iCapture in range(softAverages):
-            newData = self.cmdMeasure(integrationTime, hardAverages)
-            if data == None:
-                data = newData
-            else:
-                for iData in range(len(data)):
-                    data[iData] = ((float(data[iData]) * float(iCapture)) + float(newData[iData])) / float(iCapture + 1)
-        return data
-
-    def loadData(self, filename):
-        data = []
-
-        if not filename:
-            raise ValueError("Missing filename")
-        with open(filename, 'r') as f:
-            lns = f.readlines()
-            for line in lns:
-                parts = line.strip().split()
-                if len(parts) != 2:
-                    continue
-                data.append(int(parts[1]))
-        return data
-
-
-    def dumpData(self, data, filename = None, calibration = [0.546875, 299.67]):
-        if not filename:
-            for i in range(len(data)):
-                pxFrequency = calibration[1] + i * calibration[0]
-                pxVal = data[i]
-                print("{} {}".format(pxFrequency, pxVal))
+        with PROFILER.stage("measure"):
+            self.writeDevice(cmd)
+            readData = self.readDevice()
+            res = self.decodeFrame(readData, asArray = asArray, out = out)
+        if PROFILER.enabled:
+            PROFILER.frame(len(readData), self.lastTransferReads, self.PACKETSIZE)
+        return res
+
+    def cmdMeasureStream(self, integrationTime = 1000, averageCount = 1, bufferSize = 16, policy = "dropoldest", maxFrames = None):
+        return PyAvaSpecStream(self, integrationTime = integrationTime, averageCount = averageCount, bufferSize = bufferSize, policy = policy, maxFrames = maxFrames)
+
+    def cmdAutoExposure(self, targetFraction = 0.75, tolerance = 0.1, startIntegrationTime = 10, minIntegrationTime = 1, maxIntegrationTime = 1000, averageCount = 1, maxIterations = 8, darkLevel = None):
+        # Searches the integration time at which the brightest pixel reaches
+        # targetFraction of full scale (within tolerance) by extrapolating the
+        # linear response. Returns a PyAvaSpecExposureResult (integrationTime,
+        # peakCounts, fraction, saturated pixel count, converged, history)
+        return exposure.searchExposure(
+            self,
+            targetFraction = targetFraction,
+            tolerance = tolerance,
+            startIntegrationTime = startIntegrationTime,
+            minIntegrationTime = minIntegrationTime,
+            maxIntegrationTime = maxIntegrationTime,
+            averageCount = averageCount,
+            maxIterations = maxIterations,
+            darkLevel = darkLevel
+        )
+
+    def cmdMeasureKinetics(self, filename, integrationTime = 1000, averageCount = 1, softAverages = 1, frames = None, duration = None, interval = None, bufferSize = 256):
+        # Starts a time series capture of frames (or duration seconds) at
+        # maximum rate or every interval seconds into the archive filename
+        return PyAvaSpecKineticsCapture(self, filename, integrationTime = integrationTime, averageCount = averageCount, softAverages = softAverages, frames = frames, duration = duration, interval = interval, bufferSize = bufferSize)
+
+    def cmdMeasureSoftAverages(self, integrationTime = 1000, softAverages = 1, hardAverages = 1, statistics = False, method = "mean", sigma = 3.0):
+        # Averages softAverages frames. Returns the mean as list or, with
+        # statistics set, a PyAvaSpecAverageResult (mean, std, min, max, count).
+        # The plain mean is accumulated on the fly, robust methods (see
+        # pyavaspec.averaging.stackFrames) keep all frames in one buffer
+        if softAverages < 1:
+            raise ValueError("At least one software average is required, got {}".format(softAverages))
+        if method == "mean":
+            acc = PyAvaSpecAccumulator(self.PIXELCOUNT)
+            frame = np.zeros(self.PIXELCOUNT, dtype = np.uint16)
+
+            for iCapture in range(softAverages):
+                self.cmdMeasure(integrationTime, hardAverages, out = frame)
+                acc.update(frame)
+
+            res = acc.result()
         else:
-            with open(filename, 'w') as f:
-                for i in range(len(data)):
-                    pxFrequency = calibration[1] + i * calibration[0]
-                    pxVal = data[i]
-                    f.write("{} {}\n".format(pxFrequency, pxVal))
-
-    def plotData(self, data, peaks = [], peakFwhmLine = False, xrange = None, calibration = [ 0.546875, 299.67 ], filename = None, fileformat = 'png', title = "Spectrometer output", showtimeout = 0):
-        freqs = [ None ] * len(data)
-        for i in range(len(data)):
-            freqs[i] = calibration[1] + i * calibration[0]
-
-        plt.clf()
-        plt.title(title)
-        plt.xlabel("Wavelength [nm]")
-        plt.ylabel("Counts")
-
-        if xrange:
-            plt.xlim(xrange)
-
-        plt.plot(freqs, data)
-        if peaks:
-            for pk in peaks:
-                plt.plot(freqs[pk['idx']], data[pk['idx']], marker = "H")
-                if peakFwhmLine:
-                    plt.plot([freqs[pk['fwhm_leftidx']], freqs[pk['fwhm_rightidx']]], [data[pk['fwhm_leftidx']], data[pk['fwhm_rightidx']]])
-
-        if filename:
-            plt.savefig(filename, format = fileformat)
-        else:
-            if showtimeout > 0:
-                fig = plt.figure()
-                timer = fig.canvas.new_timer(interval = showtimeout)
-                timer.add_callback(close_event)
-                timer.start()
-            plt.show()
-
-    def indexToWavelength(self, pixelIndex, calibration = [ 0.546875, 299.67 ]):
-        return calibration[1] + calibration[0] * pixelIndex
-
-    def applyMovingAverage(self, data, windowSize = 10):
-        avgData = [ None ] * (len(data) - windowSize)
-        for i in range(len(data) - windowSize):
-            avgData[i] = data[i]
-            for j in range(1, windowSize):
-                avgData[i] = avgData[i] + data[i + j]
-            avgData[i] = avgData[i] / windowSize
-        return avgData
-
-    def searchPeaks(self, data, maxPeaks = 10):
-        peaks = []
-        while len(peaks) < maxPeaks:
-            maxPixelV = data[0]
-            maxPixelI = 0
-
-            # Plain linear maximum search
-            for i in range(1, len(data)-1):
-                if (data[i-1] < data[i]) and (data[i+1] < data[i]):
-                    if maxPixelV < data[i]:
-                        isPeak = True
-                        # Check if we already found that peak ...
-                        for pk in peaks:
-                            if pk["idx"] == i:
-                                isPeak = False
-                                break
-                        if isPeak:
-                            maxPixelV = data[i]
-                            maxPixelI = i
-            # Check if this peak is over peak threshold ... (ToDo)
-            peaks.append({ 'idx' : maxPixelI, 'counts' : maxPixelV, 'peak' : self.indexToWavelength(maxPixelI) })
-
-        # For each peak determine FWHM
-        for pk in peaks:
-            #halfMaxValid = True
-            halfMax = pk['counts'] / 2.0
-            halfMaxLeftI = pk['idx']
-            halfMaxRightI = pk['idx']
-            while (data[halfMaxLeftI] > halfMax) and (halfMaxLeftI > 0):
-                halfMaxLeftI = halfMaxLeftI - 1
-            while (data[halfMaxRightI] > halfMax) and (halfMaxRightI < (len(data) - 1)):
-                halfMaxRightI = halfMaxRightI + 1
-
-            if (halfMaxLeftI == 0) or (halfMaxRightI == len(data) - 1):
-                #halfMaxValid = False
-                pass
-            else:
-                pk['fwhm_leftidx'] = halfMaxLeftI
-                pk['fwhm_rightidx'] = halfMaxRightI
-                pk['fwhm_left'] = self.indexToWavelength(halfMaxLeftI)
-                pk['fwhm_right'] = self.indexToWavelength(halfMaxRightI)
-                pk['fwhm'] = pk['fwhm_right'] - pk['fwhm_left']
-
-        return peaks
+            if method not in STACKMETHODS:
+                raise ValueError("Unknown averaging method {}, supported are {}".format(method, ", ".join(STACKMETHODS)))
+            frames = np.zeros((softAverages, self.PIXELCOUNT), dtype = np.uint16)
+            for iCapture in range(softAverages):
+                self.cmdMeasure(integrationTime, hardAverages, out = frames[iCapture])
+            res = stackFrames(frames, method = method, sigma = sigma)
+
+        if statistics:
+            return res
+        return res.mean.tolist()
+
+    def parseIdentity(self, identity):
+        # Serial number from the identification reply (see IDENTSERIALOFFSET)
+        end = self.IDENTSERIALOFFSET + self.IDENTSERIALLENGTH
+        if len(identity) < end:
+            raise PyAvaSpecCommunicationError("Received short identification reply ({} bytes, expected at least {})".format(len(identity), end))
+        field = bytes(identity[self.IDENTSERIALOFFSET:end]).split(b"\x00", 1)[0]
+        if (len(field) == 0) or any([ (c < 0x21) or (c > 0x7E) for c in field ]):
+            raise PyAvaSpecCommunicationError("Malformed serial number field {!r} in identification reply".format(bytes(identity[self.IDENTSERIALOFFSET:end])))
+        return field.decode("ascii")
 
     def getVersionInformation(self):
         self.writeDevice(self.CMD_GET_IDENT)
-        self.readDevice()
+        response = self.readDevice()
+        self.identity = bytes(response) if response != None else b""
+        self.serial = self.parseIdentity(self.identity)
         self.writeDevice(self.CMD_2)
         self.readDevice()
         self.writeDevice(self.CMD_3)
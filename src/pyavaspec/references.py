@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from pyavaspec.calibration import PyAvaSpecCalibration, commonGrid
+
+# Spectral reference library
+#
+# Background subtracted reference spectra are resampled onto one common
+# wavelength grid, normalized to unit length and kept as rows of a single
+# contiguous float32 matrix. A query is prepared the same way and scored
+# against all references with one matrix-vector product:
+#
+#   cosine       r . q / |q|                     (rows have unit length)
+#   correlation  r . (q - mean(q)) / (s_r |q - mean(q)|)
+#
+# where s_r is the precomputed length of the mean free reference row, so both
+# measures use the same matrix. The matrix grows by doubling its capacity,
+# names and metadata are kept in a separate index. Library and index are
+# stored together in one .npz file.
+#
+#   library = PyAvaSpecReferenceLibrary()
+#   library.addMeasurements([ "measurements/*" ])
+#   library.save("references.npz")
+#
+#   matches = PyAvaSpecReferenceLibrary("references.npz").search(data, calibration = [ 0.546875, 299.67 ])
+
+REFERENCEMETHODS = [ "cosine", "correlation" ]
+
+def loadSpectrumFile(filename):
+    # Wavelength and counts columns of a data file written by dumpData
+    data = np.loadtxt(filename, dtype = np.float64, ndmin = 2)
+    if data.shape[1] != 2:
+        raise ValueError("{} is not a two column spectrum file".format(filename))
+    return data[:, 0], data[:, 1]
+
+class PyAvaSpecReferenceLibrary:
+    FORMAT = 1
+
+    def __init__(self, filename = None, grid = None, calibration = [ 0.546875, 299.67 ], dtype = np.float32):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.entries = []
+        self.count = 0
+
+        if filename and os.path.isfile(filename):
+            self.load()
+            return
+
+        if grid is None:
+            grid = commonGrid([ calibration ])
+        self.grid = np.asarray(grid, dtype = np.float64)
+        if (self.grid.ndim != 1) or (len(self.grid) < 2) or not np.all(np.diff(self.grid) > 0):
+            raise ValueError("Reference grid has to be a strictly increasing wavelength axis")
+        self.allocate(16)
+
+    def allocate(self, capacity):
+        data = np.zeros((capacity, len(self.grid)), dtype = self.dtype)
+        norms = np.zeros(capacity, dtype = np.float64)
+        if self.count > 0:
+            data[:self.count] = self.data[:self.count]
+            norms[:self.count] = self.centeredNorms[:self.count]
+        self.data = data
+        self.centeredNorms = norms
+
+    @property
+    def matrix(self):
+        # (references x grid) view of all normalized reference spectra
+        return self.data[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    def names(self):
+        return [ e['name'] for e in self.entries ]
+
+    def prepare(self, data, wavelengths = None, calibration = None, background = None):
+        # Resamples one spectrum onto the library grid. The wavelength axis is
+        # either supplied directly (data files) or derived from the calibration.
+        # Grid points outside the covered range are set to zero
+        data = np.array(data, dtype = np.float64)
+        if background is not None:
+            data = data - np.asarray(background, dtype = np.float64)
+        if wavelengths is not None:
+            wavelengths = np.asarray(wavelengths, dtype = np.float64)
+            if len(wavelengths) != len(data):
+                raise ValueError("Got {} wavelengths for {} samples".format(len(wavelengths), len(data)))
+            if wavelengths[0] > wavelengths[-1]:
+                wavelengths, data = wavelengths[::-1], data[::-1]
+            return np.interp(self.grid, wavelengths, data, left = 0.0, right = 0.0)
+        if calibration is None:
+            calibration = [ 0.546875, 299.67 ]
+        return PyAvaSpecCalibration.get(calibration, len(data)).resample(data, self.grid, fill = 0.0)
+
+    def add(self, data, name, wavelengths = None, calibration = None, background = None, metadata = None):
+        # Adds a spectrum, returns its row index
+        vector = self.prepare(data, wavelengths = wavelengths, calibration = calibration, background = background)
+        norm = np.linalg.norm(vector)
+        if not (norm > 0):
+            raise ValueError("Reference {} contains no signal on the library grid".format(name))
+        vector = vector / norm
+
+        if self.count == len(self.data):
+            self.allocate(2 * len(self.data))
+        self.data[self.count] = vector
+        self.centeredNorms[self.count] = np.linalg.norm(vector - np.mean(vector))
+        self.entries.append({ 'name' : str(name), 'added' : time.time(), 'metadata' : metadata or {} })
+        self.count = self.count + 1
+        return self.count - 1
+
+    def addMeasurement(self, directory, name = None):
+        # Adds a measurement directory (background.dat and dataraw.dat or raw.dat)
+        from pyavaspec.batch import findRawFile
+
+        rawfile = findRawFile(directory)
+        if rawfile == None:
+            raise ValueError("Measurement {} does not contain raw data".format(directory))
+        wavelengths, raw = loadSpectrumFile(rawfile)
+        bgwavelengths, background = loadSpectrumFile(os.path.join(directory, "background.dat"))
+        if (len(background) != len(raw)) or not np.allclose(wavelengths, bgwavelengths):
+            raise ValueError("Background and raw data of {} do not share a wavelength axis".format(directory))
+        if name == None:
+            name = os.path.basename(os.path.normpath(directory))
+        return self.add(raw, name, wavelengths = wavelengths, background = background, metadata = { 'source' : os.path.abspath(directory) })
+
+    def addMeasurements(self, patterns):
+        # Adds all measurement directories matching the patterns, returns their names
+        from pyavaspec.batch import expandMeasurementDirectories
+
+        res = []
+        for directory in expandMeasurementDirectories(patterns):
+            self.addMeasurement(directory)
+            res.append(self.entries[-1]['name'])
+        return res
+
+    def scores(self, vector, method = "cosine"):
+        # Similarity of a prepared (resampled) spectrum to every reference
+        if method not in REFERENCEMETHODS:
+            raise ValueError("Unknown similarity measure {}, supported are {}".format(method, ", ".join(REFERENCEMETHODS)))
+        vector = np.asarray(vector, dtype = np.float64)
+        if method == "correlation":
+            vector = vector - np.mean(vector)
+        norm = np.linalg.norm(vector)
+        if not (norm > 0):
+            return np.zeros(self.count)
+        res = self.matrix @ (vector / norm).astype(self.dtype)
+        if method == "correlation":
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                res = np.where(self.centeredNorms[:self.count] > 0, res / self.centeredNorms[:self.count], 0.0)
+        return res
+
+    def search(self, data, top = 5, method = "cosine", wavelengths = None, calibration = None, background = None):
+        # Returns up to top best matches (highest score first) as list of
+        # dictionaries (index, name, score, metadata)
+        if self.count == 0:
+            return []
+        scores = self.scores(self.prepare(data, wavelengths = wavelengths, calibration = calibration, background = background), method = method)
+        top = min(top, self.count)
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best], kind = "stable")]
+        return [ { 'index' : int(i), 'name' : self.entries[i]['name'], 'score' : float(scores[i]), 'metadata' : self.entries[i]['metadata'] } for i in best ]
+
+    def save(self, filename = None):
+        # Written into a temporary file first so a crash never leaves a
+        # truncated library behind
+        if filename == None:
+            filename = self.filename
+        if not filename:
+            raise ValueError("Missing filename")
+        index = { 'format' : self.FORMAT, 'entries' : self.entries }
+        directory = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(directory, exist_ok = True)
+        tmpname = filename + ".tmp"
+        with open(tmpname, 'wb') as f:
+            np.savez(f, index = np.array(json.dumps(index)), grid = self.grid, matrix = self.matrix, centerednorms = self.centeredNorms[:self.count])
+        os.replace(tmpname, filename)
+        self.filename = filename
+
+    def load(self, filename = None):
+        if filename == None:
+            filename = self.filename
+        with np.load(filename, allow_pickle = False) as npz:
+            index = json.loads(str(npz['index']))
+            if index.get('format') != self.FORMAT:
+                raise ValueError("Unsupported reference library format {}".format(index.get('format')))
+            matrix = npz['matrix']
+            if len(index['entries']) != len(matrix):
+                raise ValueError("Reference library {} is inconsistent ({} entries, {} spectra)".format(filename, len(index['entries']), len(matrix)))
+            self.grid = np.array(npz['grid'], dtype = np.float64)
+            self.dtype = matrix.dtype
+            self.data = np.array(matrix)
+            self.centeredNorms = np.array(npz['centerednorms'], dtype = np.float64)
+        self.entries = index['entries']
+        self.count = len(self.entries)
+        if self.count == 0:
+            self.allocate(16)
+
+def mainProg():
+    ap = argparse.ArgumentParser(description = "Build and query a spectral reference library")
+    ap.add_argument("library", help = "Reference library file (.npz)")
+    ap.add_argument("--add", nargs = "+", default = [], help = "Add measurement directories (or glob patterns)")
+    ap.add_argument("--query", nargs = "+", default = [], help = "Identify the supplied measurement directories or data files")
+    ap.add_argument("--background", default = None, help = "Background data file subtracted from queried data files")
+    ap.add_argument("--top", type = int, default = 5, help = "Number of reported matches (default 5)")
+    ap.add_argument("--method", choices = REFERENCEMETHODS, default = "cosine", help = "Similarity measure (default cosine)")
+    ap.add_argument("--step", type = float, default = None, help = "Grid spacing in nm of a newly created library (default pixel spacing)")
+    args = ap.parse_args()
+
+    grid = None
+    if args.step != None:
+        grid = commonGrid([ [ 0.546875, 299.67 ] ], step = args.step)
+    library = PyAvaSpecReferenceLibrary(args.library, grid = grid)
+
+    if args.add:
+        added = library.addMeasurements(args.add)
+        library.save()
+        print("Added {} references ({} total)".format(len(added), len(library)), file = sys.stderr)
+
+    background = None
+    if args.background:
+        background = loadSpectrumFile(args.background)[1]
+
+    for query in args.query:
+        if os.path.isdir(query):
+            from pyavaspec.batch import findRawFile
+            wavelengths, data = loadSpectrumFile(findRawFile(query))
+            bg = loadSpectrumFile(os.path.join(query, "background.dat"))[1]
+        else:
+            wavelengths, data = loadSpectrumFile(query)
+            bg = background
+        t = time.perf_counter()
+        matches = library.search(data, top = args.top, method = args.method, wavelengths = wavelengths, background = bg)
+        elapsed = time.perf_counter() - t
+        print("{} ({} references, {:.3f} ms)".format(query, len(library), elapsed * 1e3))
+        for match in matches:
+            print("  {:8.5f} {}".format(match['score'], match['name']))
+
+if __name__ == "__main__":
+    mainProg()
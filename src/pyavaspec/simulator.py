@@ -0,0 +1,171 @@
+import os
+import time
+import threading
+
+import numpy as np
+
+from pyavaspec.pyavaspec import PyAvaSpecCommunicationError, PyAvaSpec_2048_2
+
+class PyAvaSpecSimulatedDevice:
+    # Virtual AvaSpec-2048-2 that speaks the same command protocol as the real
+    # device (identification handshake, 0x03 measure command and stop command).
+    # Spectra are replayed from the measurements shipped with the repository
+    # (background.dat and dataraw.dat / raw.dat) and scaled with the requested
+    # integration time. The reference files have been recorded at 1000 ms.
+    #
+    # It can be passed as transport to PyAvaSpec_2048_2:
+    #
+    #   spec = PyAvaSpec_2048_2(transport = PyAvaSpecSimulatedDevice(measurement = "LASER01"))
+
+    PACKETSIZE        = 64
+    PIXELCOUNT        = 2048
+    REFERENCEINTTIME  = 1000
+    MEASUREHEADER     = [ 0x83, 0x00, 0x00, 0x00, 0x00, 0x00 ]
+
+    def __init__(self, measurement = None, measurementDir = None, latency = 0.0, noise = 0.0, simulateExposure = False, seed = None, serial = "SIM0000001", bus = None, address = None):
+        self.bus = bus
+        self.address = address
+        self.latency = latency
+        self.noise = noise
+        self.simulateExposure = simulateExposure
+        self.serial = serial
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+
+        self.pending = bytearray()
+        self.pendingOffset = 0
+        self.zlpPending = False
+        self.running = False
+
+        self.transfersWritten = 0
+        self.transfersRead = 0
+
+        self.background, self.signal = self.loadReference(measurement, measurementDir)
+
+    @staticmethod
+    def defaultMeasurementDir():
+        return os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "measurements"))
+
+    @staticmethod
+    def listMeasurements(measurementDir = None):
+        if measurementDir == None:
+            measurementDir = PyAvaSpecSimulatedDevice.defaultMeasurementDir()
+        if not os.path.isdir(measurementDir):
+            return []
+        res = []
+        for entry in sorted(os.listdir(measurementDir)):
+            if os.path.isfile(os.path.join(measurementDir, entry, "background.dat")):
+                res.append(entry)
+        return res
+
+    def loadReference(self, measurement, measurementDir):
+        if measurementDir == None:
+            measurementDir = self.defaultMeasurementDir()
+
+        if measurement == None:
+            available = self.listMeasurements(measurementDir)
+            if not available:
+                return self.syntheticReference()
+            measurement = available[0]
+
+        basedir = os.path.join(measurementDir, measurement)
+        rawfile = None
+        for candidate in [ "dataraw.dat", "raw.dat" ]:
+            if os.path.isfile(os.path.join(basedir, candidate)):
+                rawfile = os.path.join(basedir, candidate)
+                break
+        if rawfile == None:
+            raise ValueError("Measurement {} does not contain raw data".format(basedir))
+
+        background = np.loadtxt(os.path.join(basedir, "background.dat"), usecols = 1, dtype = np.float64)
+        raw = np.loadtxt(rawfile, usecols = 1, dtype = np.float64)
+        if (len(background) != self.PIXELCOUNT) or (len(raw) != self.PIXELCOUNT):
+            raise ValueError("Measurement {} does not contain {} pixels".format(basedir, self.PIXELCOUNT))
+
+        return background, raw - background
+
+    def syntheticReference(self):
+        # Flat dark level with a single gaussian line, used when the measurement
+        # directory is not available (for example on installed packages)
+        idx = np.arange(self.PIXELCOUNT, dtype = np.float64)
+        background = np.full(self.PIXELCOUNT, 2200.0)
+        signal = 30000.0 * np.exp(-0.5 * ((idx - 308.0) / 5.0)**2)
+        return background, signal
+
+    def renderFrame(self, integrationTime, averageCount):
+        scale = float(integrationTime) / float(self.REFERENCEINTTIME)
+        frame = self.background + self.signal * scale
+        if self.noise > 0:
+            frame = frame + self.rng.normal(0.0, self.noise / np.sqrt(max(averageCount, 1)), self.PIXELCOUNT)
+        return np.clip(np.rint(frame), 0, 65535).astype('<u2')
+
+    def queueResponse(self, payload):
+        self.pending = bytearray(payload)
+        self.pendingOffset = 0
+        self.zlpPending = False
+
+    def write(self, endpoint, payload, timeout):
+        payload = bytes(payload)
+        if len(payload) < 1:
+            raise PyAvaSpecCommunicationError("Empty command sent to simulated device")
+
+        with self.lock:
+            self.transfersWritten = self.transfersWritten + 1
+            if self.latency > 0:
+                time.sleep(self.latency)
+
+            cmd = payload[0]
+            if cmd == 0x03:
+                if len(payload) != 5:
+                    raise PyAvaSpecCommunicationError("Malformed measure command ({} bytes)".format(len(payload)))
+                integrationTime = payload[1] + payload[2] * 256
+                averageCount = max(payload[3] + payload[4] * 256, 1)
+                if self.simulateExposure:
+                    time.sleep(integrationTime * averageCount / 1000.0)
+                self.running = True
+                self.queueResponse(bytes(self.MEASUREHEADER) + self.renderFrame(integrationTime, averageCount).tobytes())
+            elif cmd == 0x0F:
+                # Two byte header, NUL padded serial number field, model name
+                ident = self.serial.encode("ascii")[:PyAvaSpec_2048_2.IDENTSERIALLENGTH].ljust(PyAvaSpec_2048_2.IDENTSERIALLENGTH, b"\x00")
+                self.queueResponse(bytes([ 0x8F, 0x00 ]) + ident + b"AvaSpec-2048-2\x00")
+            elif (cmd == 0x07) and (payload[1:] == bytes([ 0x08, 0x00 ])):
+                self.running = False
+                self.queueResponse(bytes([ 0x87, 0x00 ]))
+            else:
+                self.queueResponse(bytes([ cmd | 0x80, 0x00 ]))
+        return len(payload)
+
+    def read(self, endpoint, sizeOrBuffer, timeout):
+        # Emulates bulk transfer semantics: a read returns at most the requested
+        # amount of bytes and a response ending on a full packet is terminated by
+        # a zero length packet
+        with self.lock:
+            self.transfersRead = self.transfersRead + 1
+            if self.latency > 0:
+                time.sleep(self.latency)
+
+            remaining = len(self.pending) - self.pendingOffset
+            if remaining <= 0:
+                if self.zlpPending:
+                    self.zlpPending = False
+                    chunk = b""
+                else:
+                    raise PyAvaSpecCommunicationError("Simulated device has no pending data (timeout)")
+            else:
+                size = sizeOrBuffer if isinstance(sizeOrBuffer, int) else len(sizeOrBuffer)
+                n = min(size, remaining)
+                chunk = self.pending[self.pendingOffset:self.pendingOffset + n]
+                self.pendingOffset = self.pendingOffset + n
+                if (self.pendingOffset == len(self.pending)) and (n % self.PACKETSIZE == 0):
+                    self.zlpPending = True
+
+            if isinstance(sizeOrBuffer, int):
+                return bytearray(chunk)
+            memoryview(sizeOrBuffer).cast('B')[:len(chunk)] = chunk
+            return len(chunk)
+
+    def dispose(self):
+        with self.lock:
+            self.pending = bytearray()
+            self.pendingOffset = 0
+            self.zlpPending = False
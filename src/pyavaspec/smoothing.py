@@ -0,0 +1,70 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Smoothing filters for single spectra (1-D) or stacks of spectra (2-D, one
+# spectrum per row). All filters are centered and keep the length of the
+# input. Edges are handled by padding the data:
+#
+#   nearest   Repeat the first / last sample
+#   reflect   Mirror the data at the edge (without repeating the edge sample)
+
+EDGEMODES = [ "nearest", "reflect" ]
+
+def padEdges(data, left, right, mode = "nearest"):
+    if mode == "nearest":
+        npmode = "edge"
+    elif mode == "reflect":
+        npmode = "reflect"
+    else:
+        raise ValueError("Unknown edge mode {}, supported are {}".format(mode, ", ".join(EDGEMODES)))
+    padding = [ (0, 0) ] * (data.ndim - 1) + [ (left, right) ]
+    return np.pad(data, padding, mode = npmode)
+
+def applyKernel(data, kernel, mode = "nearest"):
+    # Correlates every spectrum with the supplied (odd length) kernel
+    data = np.asarray(data, dtype = np.float64)
+    kernel = np.asarray(kernel, dtype = np.float64)
+    half = len(kernel) // 2
+    padded = padEdges(data, half, len(kernel) - 1 - half, mode)
+    return sliding_window_view(padded, len(kernel), axis = -1) @ kernel
+
+def boxcar(data, windowSize = 10, mode = "nearest"):
+    # Centered moving average in O(n) per spectrum using cumulative sums. For
+    # even window sizes the window extends one sample further to the right
+    data = np.asarray(data, dtype = np.float64)
+    if windowSize < 1:
+        raise ValueError("Window size has to be at least 1")
+    if windowSize == 1:
+        return data.copy()
+
+    left = (windowSize - 1) // 2
+    right = windowSize - 1 - left
+    padded = padEdges(data, left, right, mode)
+    csum = np.cumsum(padded, axis = -1)
+    csum = np.concatenate((np.zeros(data.shape[:-1] + (1,)), csum), axis = -1)
+    return (csum[..., windowSize:] - csum[..., :-windowSize]) / windowSize
+
+def savitzkyGolayCoefficients(windowSize, order):
+    if (windowSize % 2) != 1:
+        raise ValueError("Savitzky-Golay window size has to be odd")
+    if order >= windowSize:
+        raise ValueError("Savitzky-Golay polynomial order has to be smaller than the window size")
+    half = windowSize // 2
+    x = np.arange(-half, half + 1, dtype = np.float64)
+    vander = np.vander(x, order + 1, increasing = True)
+    # First row of the pseudo inverse evaluates the fitted polynomial at the center
+    return np.linalg.pinv(vander)[0]
+
+def savitzkyGolay(data, windowSize = 11, order = 2, mode = "nearest"):
+    return applyKernel(data, savitzkyGolayCoefficients(windowSize, order), mode)
+
+def gaussianKernel(sigma, truncate = 4.0):
+    if sigma <= 0:
+        raise ValueError("Gaussian sigma has to be positive")
+    half = max(int(truncate * sigma + 0.5), 1)
+    x = np.arange(-half, half + 1, dtype = np.float64)
+    kernel = np.exp(-0.5 * (x / sigma)**2)
+    return kernel / np.sum(kernel)
+
+def gaussian(data, sigma = 2.0, truncate = 4.0, mode = "nearest"):
+    return applyKernel(data, gaussianKernel(sigma, truncate), mode)
@@ -0,0 +1,176 @@
+import threading
+import time
+
+import numpy as np
+
+class PyAvaSpecFrame:
+    def __init__(self, data, sequence, timestamp):
+        self.data = data
+        self.sequence = sequence
+        self.timestamp = timestamp
+
+class PyAvaSpecRingBuffer:
+    # Bounded frame buffer with storage preallocated for capacity frames. Slots
+    # are reused so the producer does not allocate per frame. The policy decides
+    # what happens when the buffer is full:
+    #
+    #   block       The producer waits till the consumer has taken a frame (backpressure)
+    #   dropoldest  The oldest unread frame is overwritten
+    #   dropnewest  The new frame is discarded
+    #
+    # Every dropped frame is counted in overruns.
+
+    POLICIES = [ "block", "dropoldest", "dropnewest" ]
+
+    def __init__(self, capacity = 16, pixelCount = 2048, dtype = np.uint16, policy = "dropoldest"):
+        if capacity < 1:
+            raise ValueError("Ring buffer capacity has to be at least 1")
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown overrun policy {}, supported are {}".format(policy, ", ".join(self.POLICIES)))
+
+        self.capacity = capacity
+        self.policy = policy
+        self.data = np.zeros((capacity, pixelCount), dtype = dtype)
+        self.sequences = np.zeros(capacity, dtype = np.int64)
+        self.timestamps = np.zeros(capacity, dtype = np.float64)
+
+        self.head = 0
+        self.count = 0
+        self.overruns = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def __len__(self):
+        with self.cond:
+            return self.count
+
+    def put(self, frame, sequence, timestamp):
+        with self.cond:
+            if self.count == self.capacity:
+                if self.policy == "block":
+                    while (self.count == self.capacity) and not self.closed:
+                        self.cond.wait()
+                elif self.policy == "dropnewest":
+                    self.overruns = self.overruns + 1
+                    return False
+                else:
+                    self.head = (self.head + 1) % self.capacity
+                    self.count = self.count - 1
+                    self.overruns = self.overruns + 1
+            if self.closed:
+                return False
+
+            slot = (self.head + self.count) % self.capacity
+            self.data[slot, :] = frame
+            self.sequences[slot] = sequence
+            self.timestamps[slot] = timestamp
+            self.count = self.count + 1
+            self.cond.notify_all()
+            return True
+
+    def get(self, timeout = None, out = None):
+        # Returns a PyAvaSpecFrame holding a copy of the oldest frame (or writes
+        # into out if supplied) or None when the buffer has been closed and drained
+        with self.cond:
+            if not self.cond.wait_for(lambda: (self.count > 0) or self.closed, timeout = timeout):
+                raise TimeoutError("No frame available within {} s".format(timeout))
+            if self.count == 0:
+                return None
+
+            slot = self.head
+            if out is None:
+                out = self.data[slot].copy()
+            else:
+                out[:] = self.data[slot]
+            frame = PyAvaSpecFrame(out, int(self.sequences[slot]), float(self.timestamps[slot]))
+            self.head = (self.head + 1) % self.capacity
+            self.count = self.count - 1
+            self.cond.notify_all()
+            return frame
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+class PyAvaSpecStream:
+    # Continuous acquisition: a reader thread keeps the spectrometer busy and
+    # pushes frames into a PyAvaSpecRingBuffer, the consumer iterates over the
+    # stream object. The spectrometer must not be used by anyone else while
+    # the stream is running.
+    #
+    #   with spec.cmdMeasureStream(integrationTime = 10, bufferSize = 32) as stream:
+    #       for frame in stream:
+    #           process(frame.data)
+
+    def __init__(self, spec, integrationTime = 1000, averageCount = 1, bufferSize = 16, policy = "dropoldest", maxFrames = None):
+        self.spec = spec
+        self.integrationTime = integrationTime
+        self.averageCount = averageCount
+        self.maxFrames = maxFrames
+
+        self.buffer = PyAvaSpecRingBuffer(capacity = bufferSize, pixelCount = spec.PIXELCOUNT, policy = policy)
+        self.stopEvent = threading.Event()
+        self.error = None
+
+        self.framesAcquired = 0
+        self.framesDelivered = 0
+
+        self.thread = threading.Thread(target = self.readerThread, name = "pyavaspec-stream", daemon = True)
+        self.thread.start()
+
+    @property
+    def overruns(self):
+        return self.buffer.overruns
+
+    def getStatistics(self):
+        return {
+            'acquired'  : self.framesAcquired,
+            'delivered' : self.framesDelivered,
+            'overruns'  : self.buffer.overruns,
+            'buffered'  : len(self.buffer)
+        }
+
+    def readerThread(self):
+        frame = np.zeros(self.spec.PIXELCOUNT, dtype = np.uint16)
+        try:
+            while not self.stopEvent.is_set():
+                if (self.maxFrames != None) and (self.framesAcquired >= self.maxFrames):
+                    break
+                self.spec.cmdMeasure(integrationTime = self.integrationTime, averageCount = self.averageCount, out = frame)
+                timestamp = time.monotonic()
+                self.buffer.put(frame, self.framesAcquired, timestamp)
+                self.framesAcquired = self.framesAcquired + 1
+        except Exception as e:
+            self.error = e
+        finally:
+            self.buffer.close()
+
+    def read(self, timeout = None, out = None):
+        frame = self.buffer.get(timeout = timeout, out = out)
+        if frame is None:
+            if self.error != None:
+                raise self.error
+            return None
+        self.framesDelivered = self.framesDelivered + 1
+        return frame
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        frame = self.read()
+        if frame is None:
+            raise StopIteration
+        return frame
+
+    def stop(self):
+        self.stopEvent.set()
+        self.buffer.close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
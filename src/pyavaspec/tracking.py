@@ -0,0 +1,163 @@
+import numpy as np
+
+from pyavaspec import peaks as peakfinder
+from pyavaspec.calibration import PyAvaSpecCalibration
+
+# Incremental peak tracking for frame streams
+#
+# The first frame is searched completely (pyavaspec.peaks.findPeaks). For
+# every following frame each tracked peak is only looked up in a window of
+# +/- window pixels around its last position and its half maximum crossings
+# are searched outwards from there, so the cost per frame grows with the
+# number of peaks and the window size instead of the spectrum length.
+#
+# A peak is missed when its maximum inside the window lies on the window
+# border (it moved further or vanished), drops below minHeight or collides
+# with a higher track. Tracks are ended after lostAfter consecutive misses.
+# Every rescanInterval frames a full search is executed to pick up peaks
+# that appeared in the meantime. Data is expected to be background
+# subtracted and smoothed like for searchPeaks.
+#
+#   tracker = PyAvaSpecPeakTracker(maxPeaks = 5, window = 6)
+#   for frame in stream:
+#       tracker.update(smoothing.boxcar(frame.data), frame.timestamp)
+#   trajectories = tracker.trajectories()
+
+class PyAvaSpecPeakTrack:
+    def __init__(self, trackId, idx, created):
+        self.id = trackId
+        self.idx = idx
+        self.misses = 0
+        self.created = created
+        self.timestamps = []
+        self.positions = []
+        self.wavelengths = []
+        self.heights = []
+        self.fwhm = []
+
+    def append(self, timestamp, position, wavelength, height, fwhm):
+        self.timestamps.append(timestamp)
+        self.positions.append(position)
+        self.wavelengths.append(wavelength)
+        self.heights.append(height)
+        self.fwhm.append(fwhm)
+
+    def trajectory(self):
+        return {
+            'id'         : self.id,
+            'timestamp'  : np.asarray(self.timestamps, dtype = np.float64),
+            'position'   : np.asarray(self.positions, dtype = np.float64),
+            'wavelength' : np.asarray(self.wavelengths, dtype = np.float64),
+            'height'     : np.asarray(self.heights, dtype = np.float64),
+            'fwhm'       : np.asarray(self.fwhm, dtype = np.float64)
+        }
+
+class PyAvaSpecPeakTracker:
+    def __init__(self, maxPeaks = 10, window = 8, minHeight = None, minProminence = None, minDistance = None, lostAfter = 3, rescanInterval = 50, calibration = [ 0.546875, 299.67 ]):
+        if window < 1:
+            raise ValueError("Tracking window has to be at least one pixel")
+        self.maxPeaks = maxPeaks
+        self.window = window
+        self.minHeight = minHeight
+        self.minProminence = minProminence
+        self.minDistance = minDistance
+        self.lostAfter = lostAfter
+        self.rescanInterval = rescanInterval
+        self.calibration = PyAvaSpecCalibration.get(calibration)
+
+        self.offsets = np.arange(-window, window + 1)
+        self.active = []
+        self.finished = []
+        self.nextId = 0
+        self.frameCount = 0
+        self.fullSearches = 0
+
+    def fullSearch(self, data, timestamp):
+        # Starts tracks for peaks not yet covered by an active track
+        self.fullSearches = self.fullSearches + 1
+        indices = peakfinder.findPeaks(data, maxPeaks = self.maxPeaks, minHeight = self.minHeight, minProminence = self.minProminence, minDistance = self.minDistance)
+        tracked = np.array([ t.idx for t in self.active ], dtype = np.intp)
+        for idx in indices:
+            if len(self.active) >= self.maxPeaks:
+                break
+            if (len(tracked) > 0) and (np.min(np.abs(tracked - idx)) <= self.window):
+                continue
+            self.active.append(PyAvaSpecPeakTrack(self.nextId, int(idx), timestamp))
+            self.nextId = self.nextId + 1
+            tracked = np.append(tracked, idx)
+
+    def measure(self, data, indices):
+        # Sub-pixel position, height and FWHM (pixels) of the supplied maxima.
+        # Only samples around the peaks are accessed
+        res = peakfinder.interpolatePeaks(data, indices, window = 2 * self.window)
+        return res['position'], res['height'], res['left'], res['right']
+
+    def update(self, data, timestamp = None):
+        # Processes one frame, returns the peaks found in it as list of
+        # dictionaries (id, idx, position, peak wavelength, counts, fwhm in nm)
+        data = np.asarray(data)
+        if timestamp == None:
+            timestamp = float(self.frameCount)
+
+        if (self.frameCount == 0) or ((self.rescanInterval != None) and (self.frameCount % self.rescanInterval == 0)):
+            self.fullSearch(data, timestamp)
+        self.frameCount = self.frameCount + 1
+
+        if not self.active:
+            return []
+
+        # Maximum inside the window around every tracked peak
+        last = np.array([ t.idx for t in self.active ], dtype = np.intp)
+        pos = np.minimum(np.maximum(last[:, None] + self.offsets, 0), len(data) - 1)
+        best = np.argmax(data[pos], axis = 1)
+        indices = pos[np.arange(len(last)), best]
+        found = (best > 0) & (best < len(self.offsets) - 1)
+        found = found | (indices == 0) | (indices == len(data) - 1)
+        if self.minHeight != None:
+            found = found & (data[indices] >= self.minHeight)
+
+        # Two tracks that converged onto the same maximum: the older one keeps it
+        seen = set()
+        for i in range(len(indices)):
+            if found[i]:
+                if int(indices[i]) in seen:
+                    found[i] = False
+                seen.add(int(indices[i]))
+
+        res = []
+        hit = np.flatnonzero(found)
+        if len(hit) > 0:
+            position, height, left, right = self.measure(data, indices[hit])
+            wavelength, wlLeft, wlRight = self.calibration.indexToWavelength(np.stack((position, left, right)))
+            fwhm = wlRight - wlLeft
+            for j, i in enumerate(hit):
+                track = self.active[i]
+                track.idx = int(indices[i])
+                track.misses = 0
+                track.append(timestamp, float(position[j]), float(wavelength[j]), float(height[j]), float(fwhm[j]))
+                res.append({ 'id' : track.id, 'idx' : track.idx, 'position' : float(position[j]), 'peak' : float(wavelength[j]), 'counts' : float(height[j]), 'fwhm' : float(fwhm[j]) })
+
+        stillActive = []
+        for i in range(len(self.active)):
+            track = self.active[i]
+            if not found[i]:
+                track.misses = track.misses + 1
+                if track.misses >= self.lostAfter:
+                    self.finished.append(track)
+                    continue
+            stillActive.append(track)
+        self.active = stillActive
+
+        return res
+
+    def run(self, frames, timestamps = None):
+        # Tracks all rows of a (time x pixel) array, for example the series
+        # view of a kinetics archive, and returns the trajectories
+        for i in range(len(frames)):
+            self.update(frames[i], None if timestamps is None else float(timestamps[i]))
+        return self.trajectories()
+
+    def trajectories(self):
+        # All tracks (finished and active) ordered by id
+        tracks = sorted(self.finished + self.active, key = lambda t: t.id)
+        return [ t.trajectory() for t in tracks ]
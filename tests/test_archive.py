@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+import pytest
+
+from pyavaspec.archive import PyAvaSpecArchive, PyAvaSpecArchiveException, PyAvaSpecArchiveWriter, convertDatToArchive, exportArchiveToDat
+
+MEASUREMENTS = os.path.join(os.path.dirname(__file__), "..", "measurements")
+
+@pytest.mark.parametrize("name, dtype", [
+    ("dataraw.dat", np.uint16),
+    ("datasub.dat", np.int32),
+    ("dataavg.dat", np.float64)
+])
+def test_dat_roundtrip_is_exact(tmp_path, name, dtype):
+    source = os.path.join(MEASUREMENTS, "LASER01", name)
+    archiveFile = str(tmp_path / "run.avs")
+    convertDatToArchive(source, archiveFile)
+
+    with PyAvaSpecArchive(archiveFile) as archive:
+        assert archive.frames.dtype == np.dtype(dtype)
+        assert archive.calibration == [ 0.546875, 299.67 ]
+        assert archive.header['wavelengths'] is None
+
+    exportArchiveToDat(archiveFile, 0, str(tmp_path / "out.dat"))
+    assert open(str(tmp_path / "out.dat")).read() == open(source).read()
+
+def test_dat_roundtrip_keeps_foreign_wavelength_axis(tmp_path):
+    source = str(tmp_path / "foreign.dat")
+    wavelengths = 350.0 + 0.3 * np.arange(2048) + 1e-5 * np.arange(2048)**2
+    with open(source, 'w') as f:
+        f.write("".join([ "{} {}\n".format(w, i % 100) for i, w in enumerate(wavelengths.tolist()) ]))
+    archiveFile = str(tmp_path / "run.avs")
+    convertDatToArchive([ source, source ], archiveFile)
+
+    with PyAvaSpecArchive(archiveFile) as archive:
+        assert len(archive) == 2
+        np.testing.assert_array_equal(archive.wavelengths(), wavelengths)
+
+    exportArchiveToDat(archiveFile, 1, str(tmp_path / "out.dat"))
+    assert open(str(tmp_path / "out.dat")).read() == open(source).read()
+
+    # Appending requires the same wavelength table
+    with pytest.raises(PyAvaSpecArchiveException):
+        convertDatToArchive(os.path.join(MEASUREMENTS, "LASER01", "dataraw.dat"), archiveFile)
+
+def test_writer_validates_reopen_and_values(tmp_path):
+    archiveFile = str(tmp_path / "run.avs")
+    with PyAvaSpecArchiveWriter(archiveFile, pixelCount = 4) as writer:
+        writer.append([ 1, 2, 3, 4 ], timestamp = 1.0)
+        with pytest.raises(PyAvaSpecArchiveException):
+            writer.append([ 4, -52, 3, 4 ])
+        with pytest.raises(PyAvaSpecArchiveException):
+            writer.append([ 1.5, 2, 3, 4 ])
+        with pytest.raises(PyAvaSpecArchiveException):
+            writer.appendMany(np.zeros((2, 5)), [ 2.0, 3.0 ])
+
+    for kwargs in [ { 'pixelCount' : 4, 'dtype' : np.float32 }, { 'pixelCount' : 5 }, { 'pixelCount' : 4, 'calibration' : [ 0.5, 300.0 ] } ]:
+        with pytest.raises(PyAvaSpecArchiveException):
+            PyAvaSpecArchiveWriter(archiveFile, **kwargs)
+
+    with PyAvaSpecArchiveWriter(archiveFile, pixelCount = 4) as writer:
+        writer.appendMany(np.array([[ 5, 6, 7, 8 ]]), [ 2.0 ])
+    with PyAvaSpecArchive(archiveFile) as archive:
+        np.testing.assert_array_equal(archive.frames, [[ 1, 2, 3, 4 ], [ 5, 6, 7, 8 ]])
+        np.testing.assert_array_equal(archive.series()[0], [ 0.0, 1.0 ])
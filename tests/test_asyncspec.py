@@ -0,0 +1,50 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from pyavaspec.asyncspec import PyAvaSpecAsync, PyAvaSpecAsyncGate
+from pyavaspec.pyavaspec import PyAvaSpec_2048_2
+from pyavaspec.simulator import PyAvaSpecSimulatedDevice
+
+class RecordingGate:
+    # Records gate switching and the thread it happened on
+    def __init__(self):
+        self.events = []
+
+    def outputEnable(self, channel = 1):
+        self.events.append(("on", channel, threading.current_thread().name))
+
+    def outputDisable(self, channel = 1):
+        self.events.append(("off", channel, threading.current_thread().name))
+
+def test_measure_and_frames():
+    async def main():
+        spec = PyAvaSpec_2048_2(transport = PyAvaSpecSimulatedDevice(measurement = "LASER01"))
+        reference = spec.cmdMeasure(asArray = True)
+        async with PyAvaSpecAsync(spec) as aspec:
+            data = await aspec.measure(integrationTime = 1000)
+            np.testing.assert_array_equal(data, reference)
+            averaged = await aspec.measure(integrationTime = 1000, softAverages = 3)
+            np.testing.assert_allclose(averaged, reference)
+
+            frames = [ frame async for frame in aspec.frames(count = 5) ]
+            assert [ f.sequence for f in frames ] == [ 2, 3, 4, 5, 6 ]
+
+            # Stopping early waits for the already submitted exposure
+            stream = aspec.frames()
+            assert (await stream.__anext__()).sequence == 7
+            await stream.aclose()
+            assert aspec.sequence == 9
+        assert spec.Device == None
+    asyncio.run(main())
+
+def test_gate_switches_on_its_own_thread():
+    async def main():
+        recorder = RecordingGate()
+        async with PyAvaSpecAsyncGate(recorder, channel = 2) as gate:
+            await gate.on()
+            await gate.off()
+        assert [ e[:2] for e in recorder.events ] == [ ("on", 2), ("off", 2) ]
+        assert all([ e[2].startswith("pyavaspec-gate") for e in recorder.events ])
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from pyavaspec.avacli import PyAvaSpecCli, PyAvaSpecCliException
+from pyavaspec.pyavaspec import PyAvaSpec_2048_2
+from pyavaspec.simulator import PyAvaSpecSimulatedDevice
+
+@pytest.fixture
+def cli():
+    with PyAvaSpecCli() as cli:
+        cli.device = PyAvaSpecSimulatedDevice(measurement = "LASER01")
+        cli.spec = PyAvaSpec_2048_2(transport = cli.device)
+        yield cli
+
+def run(cli, commands):
+    cli.parseCommandOptions_Validation(commands.split())
+    return cli.executeCommands()
+
+def test_measure_bgsub(cli):
+    state = run(cli, "inttime 100 measurebg measure bgsub")
+    assert state['bgsubtracted']
+    assert cli.darkLibrary == None
+
+@pytest.mark.parametrize("commands", [
+    "inttime 100 measurebg inttime 200 measure bgsub",
+    "avgsoft 2 measurebg avgsoft 3 measure bgsub"
+])
+def test_bgsub_default_subtracts_mismatched_background(cli, commands, capsys):
+    state = run(cli, commands)
+    assert state['bgsubtracted']
+    assert "different settings" in capsys.readouterr().out
+
+def test_bgsub_with_dark_library_requires_matching_settings(cli, capsys):
+    state = run(cli, "darkmaxage 60 inttime 100 measurebg inttime 200 measure bgsub")
+    assert not state['bgsubtracted']
+    assert "no background data available" in capsys.readouterr().out
+
+    # The library background of the foreground settings is used instead
+    state = run(cli, "darkmaxage 60 inttime 200 measurebg inttime 100 measurebg inttime 200 measure bgsub")
+    assert state['bgsubtracted']
+    assert "from dark frame library" in capsys.readouterr().out
+
+def test_darkmaxage_zero_never_stores(cli):
+    run(cli, "inttime 100 measurebg darkclear")
+    assert len(cli.darkLibrary) == 0
+    run(cli, "inttime 100 measurebg measurebg")
+    assert len(cli.darkLibrary) == 0
+
+def test_repeat_loops_and_variables(cli, tmp_path):
+    pattern = str(tmp_path / "spectrum_{i:02d}.dat")
+    state = run(cli, "repeat 3 inttime 1{i}0 measure dumpf " + pattern + " inc n end")
+    assert state['cfg']['inttime'] == 120
+    assert state['vars']['n'] == 3
+    assert 'i' not in state['vars']
+    assert sorted([ p.name for p in tmp_path.iterdir() ]) == [ "spectrum_00.dat", "spectrum_01.dat", "spectrum_02.dat" ]
+
+    # Nested loops restore the outer iteration, break leaves the inner loop
+    state = run(cli, "repeat 2 repeat 5 inc inner if peakcount == 0 break end end set last {i} end")
+    assert state['vars']['inner'] == 2
+    assert state['vars']['last'] == 1
+
+    state = run(cli, "set t 150 inttime {t} measure peaks if peakcount > 0 set found 1 else set found 0 end")
+    assert state['cfg']['inttime'] == 150
+    assert state['vars']['found'] == 1
+
+def test_plan_is_validated_before_execution(cli):
+    written = cli.device.transfersWritten
+    for commands in [ "measure repeat 2 measure", "measure end", "measure inttime abc", "measure repeat -1 end", "measure nosuchcommand", "measure if peakcount ~ 1 end" ]:
+        with pytest.raises(PyAvaSpecCliException):
+            cli.parseCommandOptions_Validation(commands.split())
+    assert cli.device.transfersWritten == written
+
+    # Templated arguments are validated after substitution
+    with pytest.raises(PyAvaSpecCliException):
+        run(cli, "set t abc inttime {t}")
@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import pytest
+
+from pyavaspec.averaging import PyAvaSpecAccumulator, STACKMETHODS, stackFrames
+from pyavaspec.pyavaspec import PyAvaSpec_2048_2
+from pyavaspec.simulator import PyAvaSpecSimulatedDevice
+
+MEASUREMENTS = os.path.join(os.path.dirname(__file__), "..", "measurements")
+
+def test_accumulator_matches_numpy():
+    frames = np.random.default_rng(3).normal(1000.0, 25.0, (20, 64)).round()
+    acc = PyAvaSpecAccumulator(64)
+    for frame in frames:
+        acc.update(frame)
+    res = acc.result()
+    assert res.count == 20
+    assert np.allclose(res.mean, frames.mean(axis = 0))
+    assert np.allclose(res.variance, frames.var(axis = 0, ddof = 1))
+    assert np.array_equal(res.min, frames.min(axis = 0))
+    assert np.array_equal(res.max, frames.max(axis = 0))
+    assert np.allclose(res.stderr(), frames.std(axis = 0, ddof = 1) / np.sqrt(20))
+
+    acc.reset()
+    acc.update(frames[0])
+    res = acc.result()
+    assert np.array_equal(res.mean, frames[0])
+    assert not np.any(res.variance)
+    assert np.all(np.isinf(res.snr()))
+
+def test_accumulator_rejects_wrong_frames():
+    acc = PyAvaSpecAccumulator(16)
+    with pytest.raises(ValueError):
+        acc.result()
+    with pytest.raises(ValueError):
+        acc.update(np.zeros(8))
+
+def test_soft_averages_of_simulated_device():
+    device = PyAvaSpecSimulatedDevice(measurement = "LASER01", noise = 20.0, seed = 5)
+    spec = PyAvaSpec_2048_2(transport = device)
+    res = spec.cmdMeasureSoftAverages(softAverages = 8, statistics = True)
+    reference = np.loadtxt(os.path.join(MEASUREMENTS, "LASER01", "dataraw.dat"), usecols = 1)
+    assert res.count == 8
+    assert np.all(res.min <= res.mean) and np.all(res.mean <= res.max)
+    assert abs(np.mean(res.mean - reference)) < 2.0
+    assert 15.0 < np.median(res.std) < 25.0
+    assert len(spec.cmdMeasureSoftAverages(softAverages = 2)) == spec.PIXELCOUNT
+    with pytest.raises(ValueError):
+        spec.cmdMeasureSoftAverages(softAverages = 0)
+    spec.close()
+
+def noisyStack(frames = 15, pixels = 300, seed = 11):
+    rng = np.random.default_rng(seed)
+    signal = 1000.0 + 500.0 * np.sin(np.arange(pixels) / 20.0)
+    return signal, signal + rng.normal(0.0, 10.0, (frames, pixels))
+
+def test_stack_mean_and_median():
+    signal, stack = noisyStack()
+    res = stackFrames(stack, method = "mean")
+    assert np.allclose(res.mean, stack.mean(axis = 0))
+    assert np.allclose(res.variance, stack.var(axis = 0, ddof = 1))
+    assert res.rejected == 0
+    res = stackFrames(stack, method = "median")
+    assert np.array_equal(res.mean, np.median(stack, axis = 0))
+
+@pytest.mark.parametrize("method", [ "sigmaclip", "spikes" ])
+def test_stack_rejects_cosmic_rays(method):
+    signal, stack = noisyStack()
+    stack[4, 100] += 5000.0
+    stack[9, 101:103] += 3000.0
+    res = stackFrames(stack, method = method)
+    assert res.counts[100] < 15 and res.counts[101] < 15 and res.counts[102] < 15
+    assert np.max(np.abs(res.mean - signal)) < 20.0
+    assert res.rejected < 0.05 * stack.size
+    assert abs(stackFrames(stack, method = "mean").mean[100] - signal[100]) > 200.0
+
+def test_spikes_follow_drift():
+    signal, stack = noisyStack()
+    stack += np.arange(len(stack))[:, None] * 5.0
+    res = stackFrames(stack, method = "spikes")
+    assert res.rejected < 0.02 * stack.size
+
+@pytest.mark.parametrize("method", STACKMETHODS)
+def test_stack_is_independent_of_chunk_size(method):
+    signal, stack = noisyStack()
+    stack[3, 50] += 4000.0
+    whole = stackFrames(stack, method = method)
+    chunked = stackFrames(stack, method = method, chunkSize = 37)
+    assert np.array_equal(whole.mean, chunked.mean)
+    assert np.array_equal(whole.counts, chunked.counts)
+
+def test_stack_rejects_invalid_input():
+    with pytest.raises(ValueError):
+        stackFrames(np.zeros((3, 10)), method = "mode")
+    with pytest.raises(ValueError):
+        stackFrames([])
+    with pytest.raises(ValueError):
+        stackFrames(np.zeros(10))
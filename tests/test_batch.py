@@ -0,0 +1,44 @@
+import os
+import shutil
+
+import numpy as np
+
+from pyavaspec.batch import expandMeasurementDirectories, formatPeakTable, getDefaultBatchConfiguration, processMeasurementDirectory, runBatch, summarizeTimings
+from pyavaspec.peaktable import PyAvaSpecPeakTable
+
+MEASUREMENTS = os.path.join(os.path.dirname(__file__), "..", "measurements")
+
+def test_expand_measurement_directories(tmp_path):
+    (tmp_path / "empty").mkdir()
+    pattern = os.path.join(MEASUREMENTS, "LASER0*")
+    directories = expandMeasurementDirectories([ pattern, pattern, str(tmp_path / "*") ])
+    assert [ os.path.basename(d) for d in directories ] == [ "LASER01", "LASER02" ]
+
+def test_parallel_batch_matches_serial_processing(tmp_path):
+    cfg = getDefaultBatchConfiguration()
+    cfg['plot'] = False
+    cfg['outdir'] = str(tmp_path / "out")
+    cfg['peakminprominence'] = 50.0
+
+    # A broken run must not stop the others
+    broken = tmp_path / "in" / "BROKEN"
+    shutil.copytree(os.path.join(MEASUREMENTS, "LASER01"), str(broken))
+    with open(str(broken / "dataraw.dat"), 'w') as f:
+        f.write("not a spectrum\n")
+
+    patterns = [ os.path.join(MEASUREMENTS, "LASER0*"), str(tmp_path / "in" / "*") ]
+    results = runBatch(patterns, cfg, processes = 2)
+    assert [ res['run'] for res in results ] == [ "LASER01", "LASER02", "BROKEN" ]
+    assert results[2]['error'] != None
+    assert results[0]['error'] == None and results[1]['error'] == None
+
+    for res in results[:2]:
+        serial = processMeasurementDirectory(res['directory'], dict(cfg, outdir = None))
+        assert res['peaks'].records.tobytes() == serial['peaks'].records.tobytes()
+        written = PyAvaSpecPeakTable.load(os.path.join(cfg['outdir'], res['run'], "peaks.dat"))
+        assert np.array_equal(written['idx'], res['peaks']['idx'])
+
+    lines = formatPeakTable(results).splitlines()
+    assert lines[0] == "# run peak fwhm idx counts fwhm_leftidx fwhm_rightidx fwhm_left fwhm_right"
+    assert len(lines) == 1 + len(results[0]['peaks']) + len(results[1]['peaks'])
+    assert summarizeTimings(results)['peaks']['count'] == 2
@@ -0,0 +1,17 @@
+from pyavaspec.benchmark import BENCHMARKS, compareBenchmarks, runBenchmarks
+
+def test_run_and_compare_benchmarks():
+    names = [ name for name in BENCHMARKS if name != "plotdata" ]
+    current = runBenchmarks(names, repeat = 2, minTime = 0.001)
+    assert sorted(current['results']) == sorted(names)
+    for name in names:
+        res = current['results'][name]
+        assert len(res['rounds']) == 2
+        assert 0 < res['best'] <= res['median']
+
+    baseline = { 'results' : { name : dict(current['results'][name]) for name in names[:3] } }
+    baseline['results'][names[0]]['best'] = current['results'][names[0]]['best'] / 2.0
+    comparison = compareBenchmarks(current, baseline, tolerance = 0.25)
+    assert sorted(comparison) == sorted(names[:3])
+    assert comparison[names[0]]['regression']
+    assert not comparison[names[1]]['regression']
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from pyavaspec.calibration import PyAvaSpecCalibration, commonGrid
+
+def test_default_axis_and_index_conversion():
+    cal = PyAvaSpecCalibration()
+    assert cal.wavelengths[0] == 299.67
+    assert cal.wavelengths[-1] == pytest.approx(299.67 + 0.546875 * 2047)
+    assert cal.indexToWavelength(100) == pytest.approx(299.67 + 54.6875)
+    assert cal.wavelengthToIndex(299.67 + 54.6875) == pytest.approx(100.0)
+    assert np.isnan(cal.wavelengthToIndex(100.0))
+    with pytest.raises(ValueError):
+        cal.wavelengths[0] = 0.0
+
+def test_fit_save_load(tmp_path):
+    pixels = np.array([ 100.0, 800.0, 1500.0 ])
+    cal = PyAvaSpecCalibration.fit(pixels, 400.0 + 0.5 * pixels)
+    assert cal.coefficients == pytest.approx([ 0.5, 400.0 ])
+    cal.save(str(tmp_path / "cal.json"))
+    loaded = PyAvaSpecCalibration.load(str(tmp_path / "cal.json"))
+    assert loaded.coefficients == cal.coefficients
+    with pytest.raises(ValueError):
+        PyAvaSpecCalibration.fit([ 1.0 ], [ 400.0 ])
+
+def test_non_monotonic_polynomial_is_rejected():
+    with pytest.raises(ValueError):
+        PyAvaSpecCalibration([ -0.001, 1.0, 300.0 ])
+
+def test_resample_matches_interp():
+    cal = PyAvaSpecCalibration([ 1e-5, 0.5, 350.0 ])
+    data = np.random.default_rng(1).random((3, 2048))
+    grid = np.linspace(340.0, 1400.0, 500)
+    res = cal.resample(data, grid)
+    inside = (grid >= cal.wavelengths[0]) & (grid <= cal.wavelengths[-1])
+    assert np.all(np.isnan(res[:, ~inside]))
+    for row, spectrum in zip(res, data):
+        assert np.allclose(row[inside], np.interp(grid[inside], cal.wavelengths, spectrum))
+
+def test_get_cache_is_bounded():
+    first = PyAvaSpecCalibration.get([ 0.5, 300.0 ])
+    assert PyAvaSpecCalibration.get([ 0.5, 300 ]) is first
+    assert PyAvaSpecCalibration.get(first) is first
+    for i in range(PyAvaSpecCalibration.cacheSize + 5):
+        PyAvaSpecCalibration.get([ 0.5, 400.0 + i ])
+    assert len(PyAvaSpecCalibration.cache) == PyAvaSpecCalibration.cacheSize
+    assert PyAvaSpecCalibration.get([ 0.5, 300.0 ]) is not first
+
+def test_resampling_weights_are_cached_per_grid():
+    cal = PyAvaSpecCalibration(weightCacheSize = 2)
+    grid = np.linspace(400.0, 900.0, 100)
+    weights = cal.resamplingWeights(grid)
+    assert cal.resamplingWeights(grid.copy()) is weights
+    assert cal.resamplingWeights(grid + 1.0) is not weights
+    cal.resamplingWeights(grid + 2.0)
+    assert len(cal.weights) == 2
+    assert cal.resamplingWeights(grid) is not weights
+
+def test_common_grid():
+    grid = commonGrid([ [ 0.5, 300.0 ], [ 0.25, 400.0 ] ])
+    assert grid[0] == 400.0
+    assert grid[-1] <= 400.0 + 0.25 * 2047
+    assert np.allclose(np.diff(grid), 0.25)
+    with pytest.raises(ValueError):
+        commonGrid([ [ 0.1, 300.0 ], [ 0.1, 1000.0 ] ])
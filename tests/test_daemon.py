@@ -0,0 +1,126 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+import pytest
+
+from pyavaspec.daemon import PyAvaSpecClient, PyAvaSpecDaemon, PyAvaSpecDaemonException
+from pyavaspec.pyavaspec import PyAvaSpec_2048_2
+from pyavaspec.simulator import PyAvaSpecSimulatedDevice
+
+@pytest.fixture
+def socketdir():
+    # Unix socket paths are limited to about 100 characters
+    directory = tempfile.mkdtemp(prefix = "avad", dir = "/tmp")
+    yield directory
+    shutil.rmtree(directory, ignore_errors = True)
+
+@pytest.fixture
+def failingSpec():
+    spec = PyAvaSpec_2048_2(transport = PyAvaSpecSimulatedDevice(seed = 1))
+    spec.fail = threading.Event()
+    measure = spec.cmdMeasure
+    def cmdMeasure(*args, **kwargs):
+        if spec.fail.is_set():
+            raise IOError("device disconnected")
+        return measure(*args, **kwargs)
+    spec.cmdMeasure = cmdMeasure
+    yield spec
+    spec.close()
+
+def startDaemon(spec, address):
+    daemon = PyAvaSpecDaemon(spec, address = address, inttime = 1)
+    thread = threading.Thread(target = daemon.serveForever, daemon = True)
+    thread.start()
+    return daemon
+
+def waitFor(condition, timeout = 10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timeout")
+        time.sleep(0.01)
+
+def test_measure_roundtrip(socketdir, failingSpec):
+    address = "unix:" + os.path.join(socketdir, "d.sock")
+    daemon = startDaemon(failingSpec, address)
+    try:
+        with PyAvaSpecClient(address, timeout = 10) as client:
+            frame = client.measureFrame(inttime = 5)
+            assert frame['inttime'] == 5
+            assert len(frame['data']) == failingSpec.PIXELCOUNT
+            with pytest.raises(PyAvaSpecDaemonException):
+                client.measure(inttime = 0)
+            assert client.status()['cfg']['inttime'] == 1
+    finally:
+        daemon.shutdown()
+        daemon.close()
+
+def test_stream_error_delivered_to_backlogged_subscriber(socketdir, failingSpec):
+    address = "unix:" + os.path.join(socketdir, "d.sock")
+    daemon = startDaemon(failingSpec, address)
+    try:
+        with PyAvaSpecClient(address, timeout = 10) as subscriber, PyAvaSpecClient(address, timeout = 10) as control:
+            subscriber.subscribe()
+            control.startStream()
+            # The subscriber does not read until its queue overflows
+            waitFor(lambda: control.status()['dropped'] > 0)
+            failingSpec.fail.set()
+            waitFor(lambda: control.status()['streamerror'] != None)
+            assert not control.status()['streaming']
+
+            frames = 0
+            with pytest.raises(PyAvaSpecDaemonException, match = "device disconnected"):
+                while True:
+                    assert subscriber.readFrame() != None
+                    frames = frames + 1
+            assert frames > 0
+            assert control.status()['subscribers'] == 0
+    finally:
+        daemon.shutdown()
+        daemon.close()
+
+def test_stream_error_during_request_is_kept_for_readframe(socketdir, failingSpec):
+    address = "unix:" + os.path.join(socketdir, "d.sock")
+    daemon = startDaemon(failingSpec, address)
+    try:
+        with PyAvaSpecClient(address, timeout = 10) as client:
+            client.subscribe()
+            client.startStream()
+            assert client.readFrame() != None
+            failingSpec.fail.set()
+            waitFor(lambda: daemon.streamError != None)
+
+            # The pending request is answered normally
+            status = client.status()
+            assert status['streamerror'].endswith("device disconnected")
+
+            with pytest.raises(PyAvaSpecDaemonException, match = "device disconnected"):
+                while True:
+                    assert client.readFrame() != None
+    finally:
+        daemon.shutdown()
+        daemon.close()
+
+def test_socket_path_is_only_replaced_when_stale(socketdir, failingSpec):
+    path = os.path.join(socketdir, "d.sock")
+
+    with open(path, 'w') as f:
+        f.write("keep")
+    with pytest.raises(PyAvaSpecDaemonException, match = "not a socket"):
+        PyAvaSpecDaemon(failingSpec, address = "unix:" + path)
+    assert open(path).read() == "keep"
+    os.unlink(path)
+
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    daemon = PyAvaSpecDaemon(failingSpec, address = "unix:" + path)
+    try:
+        with pytest.raises(PyAvaSpecDaemonException, match = "in use"):
+            PyAvaSpecDaemon(failingSpec, address = "unix:" + path)
+    finally:
+        daemon.close()
@@ -0,0 +1,55 @@
+import json
+
+import numpy as np
+import pytest
+
+from pyavaspec.darkframes import PyAvaSpecDarkFrameLibrary
+from pyavaspec.pyavaspec import PyAvaSpec_2048_2
+from pyavaspec.simulator import PyAvaSpecSimulatedDevice
+
+def test_key_normalization():
+    assert PyAvaSpecDarkFrameLibrary.makeKey("A", 100, 1, 1, "sigmaclip", 4.0) == PyAvaSpecDarkFrameLibrary.makeKey("A", 100)
+    assert PyAvaSpecDarkFrameLibrary.makeKey("A", 100, 5, 1, "median", 4.0) == PyAvaSpecDarkFrameLibrary.makeKey("A", 100, 5, 1, "median", 2.0)
+    assert PyAvaSpecDarkFrameLibrary.makeKey("A", 100, 5, 1, "sigmaclip", 4.0) != PyAvaSpecDarkFrameLibrary.makeKey("A", 100, 5, 1, "sigmaclip", 2.0)
+
+def test_put_get_by_method():
+    library = PyAvaSpecDarkFrameLibrary()
+    library.put("A", 100, 5, 1, np.arange(4), method = "sigmaclip", sigma = 3.0)
+    assert library.get("A", 100, 5, 1) is None
+    assert library.get("A", 100, 5, 1, method = "sigmaclip", sigma = 4.0) is None
+    np.testing.assert_array_equal(library.get("A", 100, 5, 1, method = "sigmaclip", sigma = 3.0), np.arange(4))
+
+def test_interpolation_and_expiry():
+    library = PyAvaSpecDarkFrameLibrary(maxAge = 10, interpolate = True)
+    library.put("A", 100, 1, 1, np.full(4, 10.0), timestamp = 1e12)
+    library.put("A", 300, 1, 1, np.full(4, 30.0), timestamp = 1e12)
+    np.testing.assert_allclose(library.get("A", 200, maxAge = None), np.full(4, 20.0))
+    assert library.get("A", 400, maxAge = None) is None
+    library.put("A", 500, 1, 1, np.zeros(4), timestamp = 0)
+    assert library.keys() == [ PyAvaSpecDarkFrameLibrary.makeKey("A", 100), PyAvaSpecDarkFrameLibrary.makeKey("A", 300) ]
+
+def test_save_load_roundtrip(tmp_path):
+    filename = str(tmp_path / "dark.npz")
+    library = PyAvaSpecDarkFrameLibrary(filename)
+    library.put("A", 100, 1, 1, np.arange(4.0))
+    library.put("A", 100, 5, 1, np.arange(4.0) * 2, method = "spikes", sigma = 4.5)
+
+    loaded = PyAvaSpecDarkFrameLibrary(filename)
+    assert loaded.keys() == library.keys()
+    np.testing.assert_array_equal(loaded.get("A", 100, 5, 1, method = "spikes", sigma = 4.5), np.arange(4.0) * 2)
+
+def test_unknown_format_is_rejected(tmp_path):
+    filename = str(tmp_path / "dark.npz")
+    np.savez(filename, index = np.array(json.dumps({ 'format' : 99, 'entries' : [] })))
+    with pytest.raises(ValueError):
+        PyAvaSpecDarkFrameLibrary(filename)
+
+def test_acquire_caches():
+    spec = PyAvaSpec_2048_2(transport = PyAvaSpecSimulatedDevice(measurement = "LASER01"))
+    library = PyAvaSpecDarkFrameLibrary()
+    first, cached = library.acquire(spec, integrationTime = 10, softAverages = 2)
+    assert not cached
+    second, cached = library.acquire(spec, integrationTime = 10, softAverages = 2)
+    assert cached
+    assert second is first
+    spec.close()
@@ -0,0 +1,37 @@
+import pytest
+
+from pyavaspec.pyavaspec import PyAvaSpec_2048_2
+from pyavaspec.simulator import PyAvaSpecSimulatedDevice
+
+@pytest.fixture
+def spec():
+    spec = PyAvaSpec_2048_2(transport = PyAvaSpecSimulatedDevice(measurement = "FLUORESCENT01"))
+    yield spec
+    spec.close()
+
+@pytest.mark.parametrize("start", [ 1, 10, 1000 ])
+def test_converges_in_few_exposures(spec, start):
+    res = spec.cmdAutoExposure(startIntegrationTime = start)
+    assert res.converged
+    assert res.saturated == 0
+    assert abs(res.fraction - 0.75) <= 0.1
+    assert res.iterations <= 4
+
+def test_saturated_exposure_is_shortened(spec):
+    res = spec.cmdAutoExposure(startIntegrationTime = 4000, maxIntegrationTime = 5000)
+    assert res.history[0]['saturated'] > 0
+    assert res.history[1]['integrationTime'] == 1000
+    assert res.converged
+    assert abs(res.fraction - 0.75) <= 0.1
+
+def test_limited_by_maximum_integration_time():
+    spec = PyAvaSpec_2048_2(transport = PyAvaSpecSimulatedDevice(measurement = "LASER01"))
+    res = spec.cmdAutoExposure(maxIntegrationTime = 20)
+    assert not res.converged
+    assert res.integrationTime == 20
+    assert res.history[-1]['integrationTime'] == 20
+    with pytest.raises(ValueError):
+        spec.cmdAutoExposure(targetFraction = 1.5)
+    with pytest.raises(ValueError):
+        spec.cmdAutoExposure(startIntegrationTime = 2000)
+    spec.close()
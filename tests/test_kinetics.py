@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import pytest
+
+from pyavaspec.archive import PyAvaSpecArchive
+from pyavaspec.pyavaspec import PyAvaSpec_2048_2
+from pyavaspec.simulator import PyAvaSpecSimulatedDevice
+
+MEASUREMENTS = os.path.join(os.path.dirname(__file__), "..", "measurements")
+
+@pytest.fixture
+def spec():
+    spec = PyAvaSpec_2048_2(transport = PyAvaSpecSimulatedDevice(measurement = "LASER01"))
+    yield spec
+    spec.close()
+
+def test_frames_are_written_in_order(spec, tmp_path):
+    filename = str(tmp_path / "series.avs")
+    with spec.cmdMeasureKinetics(filename, integrationTime = 1000, frames = 100, bufferSize = 8) as capture:
+        assert capture.wait(timeout = 30)
+        stats = capture.getStatistics()
+    assert stats['acquired'] == 100 and stats['written'] == 100
+
+    with PyAvaSpecArchive(filename) as archive:
+        times, frames = archive.series()
+        assert frames.shape == (100, spec.PIXELCOUNT)
+        assert frames.dtype == np.uint16
+        assert times[0] == 0.0 and np.all(np.diff(times) >= 0)
+        assert archive.header['integrationTime'] == 1000
+        reference = np.loadtxt(os.path.join(MEASUREMENTS, "LASER01", "dataraw.dat"), usecols = 1)
+        assert np.array_equal(frames[57], reference)
+
+def test_interval_and_soft_averages(spec, tmp_path):
+    filename = str(tmp_path / "series.avs")
+    with spec.cmdMeasureKinetics(filename, integrationTime = 500, softAverages = 2, frames = 4, interval = 0.05) as capture:
+        assert capture.wait(timeout = 30)
+    with PyAvaSpecArchive(filename) as archive:
+        times, frames = archive.series()
+        assert frames.dtype == np.float32
+        assert len(frames) == 4
+        assert np.all(np.diff(times) >= 0.045)
+
+def test_stop_ends_open_capture(spec, tmp_path):
+    capture = spec.cmdMeasureKinetics(str(tmp_path / "series.avs"), duration = 60)
+    capture.stop()
+    assert capture.getStatistics()['acquired'] == capture.getStatistics()['written']
+    with pytest.raises(ValueError):
+        spec.cmdMeasureKinetics(str(tmp_path / "other.avs"))
@@ -0,0 +1,83 @@
+import numpy as np
+
+from pyavaspec.peaks import characterizePeaks, findPeaks, interpolatePeaks, localMaxima, peakProminence, peakProminences
+
+def gaussian(n, center, sigma, height):
+    x = np.arange(n)
+    return height * np.exp(-0.5 * ((x - center) / sigma)**2)
+
+def test_local_maxima_are_strict():
+    data = np.array([ 0, 1, 0, 2, 2, 0, 3, 1 ])
+    assert list(localMaxima(data)) == [ 1, 6 ]
+    assert len(localMaxima(np.array([ 1, 2 ]))) == 0
+
+def test_find_peaks_orders_by_height_and_filters():
+    data = gaussian(512, 100, 3, 1000) + gaussian(512, 110, 3, 800) + gaussian(512, 300, 3, 500)
+    assert list(findPeaks(data, maxPeaks = 10)) == [ 100, 110, 300 ]
+    assert list(findPeaks(data, maxPeaks = 2)) == [ 100, 110 ]
+    assert list(findPeaks(data, minDistance = 20)) == [ 100, 300 ]
+    assert list(findPeaks(data, minHeight = 600)) == [ 100, 110 ]
+    assert len(findPeaks(data, maxPeaks = 0)) == 0
+
+def test_characterize_gaussian():
+    sigma = 4.0
+    data = gaussian(512, 200.3, sigma, 10000)
+    res = characterizePeaks(data, [ 200 ])
+    assert res['valid'][0]
+    assert abs(res['position'][0] - 200.3) < 0.05
+    assert abs(res['centroid'][0] - 200.3) < 0.2
+    assert abs(res['fwhm'][0] - 2.0 * np.sqrt(2.0 * np.log(2.0)) * sigma) < 0.1
+    assert data[res['leftidx'][0]] <= 5000 < data[res['leftidx'][0] + 1]
+    assert data[res['rightidx'][0]] <= 5000 < data[res['rightidx'][0] - 1]
+
+def test_invalid_peak_resets_indices_and_edges():
+    # Right flank never drops below half maximum before the border
+    data = gaussian(256, 100, 3, 1000) + gaussian(256, 250, 20, 900)
+    data[255] = 950
+    indices = np.array([ 100, 254 ])
+    for res in (interpolatePeaks(data, indices), characterizePeaks(data, indices)):
+        assert list(res['valid']) == [ True, False ]
+        assert res['leftidx'][1] == -1
+        assert res['rightidx'][1] == -1
+        assert np.isnan(res['left'][1])
+        assert np.isnan(res['right'][1])
+        assert res['leftidx'][0] >= 0 and res['rightidx'][0] >= 0
+    assert np.isnan(characterizePeaks(data, indices)['fwhm'][1])
+
+def bruteForceProminence(data, idx):
+    v = data[idx]
+    left = idx
+    while (left > 0) and (data[left - 1] <= v):
+        left -= 1
+    right = idx
+    while (right < len(data) - 1) and (data[right + 1] <= v):
+        right += 1
+    return float(v - max(min(data[left:idx+1]), min(data[idx:right+1])))
+
+def test_prominences_match_brute_force():
+    rng = np.random.default_rng(7)
+    for n, dtype in [ (3, np.int32), (17, np.int32), (2048, np.uint16), (1000, np.float64) ]:
+        data = (rng.random(n) * 50).astype(dtype)
+        indices = localMaxima(data)
+        expected = [ bruteForceProminence(data, i) for i in indices ]
+        assert list(peakProminences(data, indices)) == expected
+        assert [ float(peakProminence(data, i)) for i in indices ] == expected
+    assert len(peakProminences(np.zeros(10), [])) == 0
+
+def test_find_peaks_prominence_filter():
+    # Small ripple on the flank of a large peak has a low prominence
+    data = gaussian(512, 200, 10, 1000) + gaussian(512, 300, 10, 300)
+    data[220] += 30
+    data[221] += 60
+    data[222] += 30
+    assert list(findPeaks(data)) == [ 200, 300, 221 ]
+    assert list(findPeaks(data, minProminence = 100)) == [ 200, 300 ]
+    assert list(findPeaks(data, minProminence = 100, minDistance = 150)) == [ 200 ]
+    assert list(findPeaks(data, maxPeaks = 1, minProminence = 2000)) == []
+
+def test_equal_heights_are_ranked_by_index():
+    data = np.zeros(200)
+    data[[ 150, 20, 90, 60, 120 ]] = [ 5, 5, 5, 7, 5 ]
+    assert list(findPeaks(data, maxPeaks = 3)) == [ 60, 20, 90 ]
+    assert list(findPeaks(data, maxPeaks = 3, minProminence = 1)) == [ 60, 20, 90 ]
+    assert list(findPeaks(data, maxPeaks = 3, minDistance = 35)) == [ 60, 20, 120 ]
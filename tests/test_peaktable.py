@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+
+from pyavaspec.batch import formatPeakTable
+from pyavaspec.peaktable import PyAvaSpecPeakTable, asPeakTable
+from pyavaspec.pyavaspec import PyAvaSpecProcessing
+
+MEASUREMENTS = os.path.join(os.path.dirname(__file__), "..", "measurements")
+
+def loadSignal(name):
+    return np.loadtxt(os.path.join(MEASUREMENTS, "LASER01", name))[:, 1]
+
+def test_integer_spectrum_counts_are_written_as_integers(tmp_path):
+    proc = PyAvaSpecProcessing()
+    peaks = proc.searchPeaks(loadSignal("dataraw.dat").astype(np.uint16), maxPeaks = 3)
+    lines = peaks.formatText().splitlines()
+    assert lines[0] == "# peak fwhm idx counts fwhm_leftidx fwhm_rightidx fwhm_left fwhm_right"
+    assert [ ln.split()[3] for ln in lines[1:] ] == [ "17476", "8096", "5892" ]
+
+    # Invalid peaks keep missing values in both index columns
+    assert lines[3].split()[4:] == [ "-1", "-1", "nan", "nan" ]
+
+    peaks.save(str(tmp_path / "peaks.dat"))
+    loaded = PyAvaSpecPeakTable.load(str(tmp_path / "peaks.dat"))
+    assert loaded.integerCounts
+    assert loaded.formatText() == peaks.formatText()
+
+def test_float_spectrum_counts_keep_fractional_part():
+    proc = PyAvaSpecProcessing()
+    peaks = proc.searchPeaks(loadSignal("dataraw.dat") * 0.5, maxPeaks = 2)
+    assert [ ln.split()[3] for ln in peaks.formatText().splitlines()[1:] ] == [ "8738.0", "4048.0" ]
+    assert not peaks[:1].integerCounts
+
+def test_text_roundtrip_is_exact(tmp_path):
+    proc = PyAvaSpecProcessing()
+    peaks = proc.searchPeaks(loadSignal("dataavg.dat"), maxPeaks = 5)
+    peaks.save(str(tmp_path / "peaks.dat"))
+    loaded = PyAvaSpecPeakTable.load(str(tmp_path / "peaks.dat"))
+    for name in [ "peak", "fwhm", "idx", "counts", "fwhm_leftidx", "fwhm_rightidx", "fwhm_left", "fwhm_right", "valid" ]:
+        assert np.array_equal(loaded[name], peaks[name], equal_nan = peaks[name].dtype.kind == "f")
+
+def test_npy_roundtrip_and_concatenate(tmp_path):
+    proc = PyAvaSpecProcessing()
+    tables = [ proc.searchPeaks(loadSignal(name), maxPeaks = 2) for name in [ "dataavg.dat", "datasub.dat" ] ]
+    series = PyAvaSpecPeakTable.concatenate(tables, frames = [ 0, 1 ], timestamps = [ 10.0, 11.0 ])
+    assert list(series['frame']) == [ 0, 0, 1, 1 ]
+    assert len(series.frame(1)) == 2
+
+    series.save(str(tmp_path / "peaks.npy"))
+    loaded = PyAvaSpecPeakTable.load(str(tmp_path / "peaks.npy"), mmap = True)
+    assert loaded.records.tobytes() == series.records.tobytes()
+
+def test_dicts_and_batch_table():
+    peaks = [ { 'peak' : 500.5, 'fwhm' : 2.25, 'idx' : 366, 'counts' : 3216, 'fwhm_leftidx' : 362, 'fwhm_rightidx' : 370, 'fwhm_left' : 499.25, 'fwhm_right' : 501.5 } ]
+    table = asPeakTable(peaks)
+    assert table[0]['valid']
+    assert table.toDicts()[0]['counts'] == 3216.0
+    assert formatPeakTable([ { 'run' : "RUN01", 'peaks' : table } ]) == (
+        "# run peak fwhm idx counts fwhm_leftidx fwhm_rightidx fwhm_left fwhm_right\n"
+        "RUN01 500.5 2.25 366 3216 362 370 499.25 501.5\n"
+    )
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from pyavaspec.profiling import PROFILER, PyAvaSpecProfiler, PyAvaSpecStageStatistics
+from pyavaspec.pyavaspec import PyAvaSpec_2048_2
+from pyavaspec.simulator import PyAvaSpecSimulatedDevice
+
+@pytest.fixture
+def profiler():
+    PROFILER.reset()
+    PROFILER.enable()
+    yield PROFILER
+    PROFILER.disable()
+    PROFILER.reset()
+
+def test_stage_statistics_histogram():
+    stats = PyAvaSpecStageStatistics()
+    for elapsed in [ 1e-7, 3e-6, 3e-6, 1e-3, 1e3 ]:
+        stats.record(elapsed)
+    summary = stats.summary()
+    assert summary['count'] == 5
+    assert summary['min'] == 1e-7 and summary['max'] == 1e3
+    assert summary['p50'] == 4e-6
+    assert summary['p99'] == 1e3
+    assert summary['histogram'] == { "1e-06" : 1, "4e-06" : 2, "0.001024" : 1, "inf" : 1 }
+
+def test_disabled_profiler_records_nothing():
+    profiler = PyAvaSpecProfiler()
+    with profiler.stage("measure"):
+        pass
+    assert profiler.stage("measure") is PyAvaSpecProfiler.NULLSTAGE
+    assert profiler.summary()['stages'] == {}
+
+def test_measurements_are_instrumented(profiler, tmp_path):
+    spec = PyAvaSpec_2048_2(transport = PyAvaSpecSimulatedDevice(measurement = "LASER01"))
+    for i in range(3):
+        spec.cmdMeasure()
+    spec.close()
+
+    summary = profiler.summary()
+    assert summary['stages']['measure']['count'] == 3
+    assert summary['stages']['decode']['count'] == 3
+    assert summary['counters']['frames'] == 3
+    assert summary['derived']['bytesperframe'] == len(PyAvaSpecSimulatedDevice.MEASUREHEADER) + 2 * spec.PIXELCOUNT
+    assert summary['derived']['readsperframe'] == 1
+
+    profiler.dumpJson(str(tmp_path / "profile.json"))
+    with open(str(tmp_path / "profile.json")) as f:
+        assert json.load(f)['counters']['frames'] == 3
@@ -0,0 +1,109 @@
+import array
+import os
+
+import numpy as np
+import pytest
+
+from pyavaspec.multi import PyAvaSpecDeviceGroup
+from pyavaspec.pyavaspec import PyAvaSpec_2048_2, PyAvaSpecCommunicationError, PyAvaSpecDeviceNotFoundException
+from pyavaspec.simulator import PyAvaSpecSimulatedDevice
+
+MEASUREMENTS = os.path.join(os.path.dirname(__file__), "..", "measurements")
+
+class CountingDevice(PyAvaSpecSimulatedDevice):
+    # Counts identification handshakes and stop commands
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.identifications = 0
+        self.stops = 0
+
+    def write(self, endpoint, payload, timeout):
+        payload = bytes(payload)
+        if payload[:1] == bytes(PyAvaSpec_2048_2.CMD_GET_IDENT):
+            self.identifications = self.identifications + 1
+        if payload == bytes(PyAvaSpec_2048_2.CMD_STOP):
+            self.stops = self.stops + 1
+        return super().write(endpoint, payload, timeout)
+
+def test_decode_frame():
+    spec = PyAvaSpec_2048_2(transport = PyAvaSpecSimulatedDevice())
+    values = np.arange(spec.PIXELCOUNT, dtype = '<u2')
+    payload = bytes([ 0x83, 0x00, 0x01, 0x02 ]) + values.tobytes()
+    assert spec.decodeFrame(payload) == values.tolist()
+    np.testing.assert_array_equal(spec.decodeFrame(payload, asArray = True), values)
+    out = np.zeros(spec.PIXELCOUNT, dtype = np.uint16)
+    assert spec.decodeFrame(payload, out = out) is out
+    np.testing.assert_array_equal(out, values)
+    with pytest.raises(PyAvaSpecCommunicationError):
+        spec.decodeFrame(payload[:100])
+    spec.close()
+
+def test_measure_matches_simulated_reference():
+    device = PyAvaSpecSimulatedDevice(measurement = "LASER01")
+    spec = PyAvaSpec_2048_2(transport = device)
+    data = spec.cmdMeasure(integrationTime = 1000, asArray = True)
+    np.testing.assert_allclose(data, np.loadtxt(os.path.join(MEASUREMENTS, "LASER01", "dataraw.dat"), usecols = 1))
+    spec.close()
+
+def test_parse_identity():
+    spec = PyAvaSpec_2048_2(transport = PyAvaSpecSimulatedDevice(serial = "AB12"))
+    assert spec.serial == "AB12"
+    assert spec.parseIdentity(b"\x8f\x00" + b"1234567890" + b"AvaSpec") == "1234567890"
+    for reply in [ b"", b"\x8f\x00123", b"\x8f\x00" + b"\x00" * 10, b"\x8f\x00\xff\xfe" + b"\x00" * 8 ]:
+        with pytest.raises(PyAvaSpecCommunicationError):
+            spec.parseIdentity(reply)
+    spec.close()
+
+def test_select_serial_from_transports():
+    devices = [ CountingDevice(serial = s) for s in [ "A1", "B22", "C333" ] ]
+    spec = PyAvaSpec_2048_2(transport = devices, serial = "B22")
+    assert spec.serial == "B22"
+    assert devices[0].stops == 1
+    assert devices[2].identifications == 0
+    with pytest.raises(PyAvaSpecDeviceNotFoundException):
+        PyAvaSpec_2048_2(transport = devices, serial = "D4444")
+    # The opened device is in use and must not be identified again
+    assert devices[1].identifications == 1
+    assert [ d['serial'] for d in PyAvaSpec_2048_2.enumerateDevices(devices) ] == [ "A1", "B22", "C333" ]
+    assert devices[1].identifications == 1
+    spec.close()
+    assert PyAvaSpec_2048_2(transport = devices, serial = "B22").serial == "B22"
+
+def test_group_open_identifies_every_device_once():
+    devices = [ CountingDevice(serial = "S{}".format(i)) for i in range(4) ]
+    with PyAvaSpecDeviceGroup.open(serials = [ "S3", "S1" ], transports = devices) as group:
+        assert group.serials == [ "S3", "S1" ]
+        assert [ d.identifications for d in devices ] == [ 1, 1, 1, 1 ]
+        assert [ d.stops for d in devices ] == [ 1, 0, 1, 0 ]
+
+        # Claimed devices are skipped by a second group
+        with PyAvaSpecDeviceGroup.open(serials = [ "S0" ], transports = devices) as other:
+            assert other.serials == [ "S0" ]
+        assert [ d.identifications for d in devices ] == [ 2, 1, 2, 1 ]
+        with pytest.raises(PyAvaSpecDeviceNotFoundException):
+            PyAvaSpecDeviceGroup.open(serials = [ "S1" ], transports = devices)
+        assert [ d.identifications for d in devices ] == [ 3, 1, 3, 1 ]
+
+        frame = group.measure(integrationTime = 10)
+        assert frame.data.shape == (2, PyAvaSpec_2048_2.PIXELCOUNT)
+    assert [ d.stops for d in devices ] == [ 3, 1, 3, 1 ]
+
+def test_measure_reuses_receive_buffer():
+    device = PyAvaSpecSimulatedDevice(measurement = "LASER01")
+    spec = PyAvaSpec_2048_2(transport = device)
+    reference = np.loadtxt(os.path.join(MEASUREMENTS, "LASER01", "dataraw.dat"), usecols = 1)
+    rxBuffer = spec.rxBuffer
+    reads = device.transfersRead
+    out = np.zeros(spec.PIXELCOUNT, dtype = np.uint16)
+    assert spec.cmdMeasure(out = out) is out
+    assert device.transfersRead - reads == 1
+    assert spec.rxBuffer is rxBuffer
+    np.testing.assert_array_equal(out, reference)
+
+    # A too small buffer is grown once and then kept
+    spec.rxBuffer = array.array('B', bytes(512))
+    np.testing.assert_array_equal(spec.cmdMeasure(asArray = True), reference)
+    reads = device.transfersRead
+    np.testing.assert_array_equal(spec.cmdMeasure(asArray = True), reference)
+    assert device.transfersRead - reads == 1
+    spec.close()
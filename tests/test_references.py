@@ -0,0 +1,76 @@
+import glob
+import json
+import os
+
+import numpy as np
+import pytest
+
+from pyavaspec.batch import findRawFile
+from pyavaspec.references import PyAvaSpecReferenceLibrary, loadSpectrumFile
+
+MEASUREMENTS = os.path.join(os.path.dirname(__file__), "..", "measurements")
+
+@pytest.fixture(scope = "module")
+def library():
+    library = PyAvaSpecReferenceLibrary()
+    library.addMeasurements([ os.path.join(MEASUREMENTS, "*") ])
+    return library
+
+@pytest.mark.parametrize("method", [ "cosine", "correlation" ])
+def test_measurements_identify_themselves(library, method):
+    directories = sorted([ d for d in glob.glob(os.path.join(MEASUREMENTS, "*")) if os.path.isdir(d) ])
+    assert sorted(library.names()) == sorted([ os.path.basename(d) for d in directories ])
+    for name in library.names():
+        wavelengths, raw = loadSpectrumFile(findRawFile(os.path.join(MEASUREMENTS, name)))
+        background = loadSpectrumFile(os.path.join(MEASUREMENTS, name, "background.dat"))[1]
+
+        # Data files (wavelength column) and device frames (calibration) alike
+        for matches in [
+            library.search(raw, top = 3, method = method, wavelengths = wavelengths, background = background),
+            library.search(raw, top = 3, method = method, calibration = [ 0.546875, 299.67 ], background = background)
+        ]:
+            assert len(matches) == 3
+            assert matches[0]['name'] == name
+            assert matches[0]['score'] == pytest.approx(1.0, abs = 1e-4)
+            assert matches[0]['score'] >= matches[1]['score'] >= matches[2]['score']
+
+def test_save_load_roundtrip(library, tmp_path):
+    filename = str(tmp_path / "references.npz")
+    library.save(filename)
+    loaded = PyAvaSpecReferenceLibrary(filename)
+    assert loaded.names() == library.names()
+    assert np.array_equal(loaded.grid, library.grid)
+    assert np.array_equal(loaded.matrix, library.matrix)
+    vector = library.matrix[2].astype(np.float64)
+    assert np.array_equal(loaded.scores(vector), library.scores(vector))
+    assert np.array_equal(loaded.scores(vector, method = "correlation"), library.scores(vector, method = "correlation"))
+
+    # Growing a loaded library
+    loaded.add(np.ones(2048), "flat")
+    assert len(loaded) == len(library) + 1
+
+def test_growth_and_invalid_input(tmp_path):
+    library = PyAvaSpecReferenceLibrary(grid = np.linspace(300.0, 1400.0, 512))
+    x = np.arange(2048)
+    for i in range(40):
+        library.add(np.exp(-0.5 * ((x - 50 * i - 20) / 5.0)**2), "line{}".format(i))
+    assert len(library) == 40
+    assert library.data.shape[0] == 64
+    assert library.search(np.exp(-0.5 * ((x - 520) / 5.0)**2), top = 1)[0]['name'] == "line10"
+
+    with pytest.raises(ValueError):
+        library.add(np.zeros(2048), "empty")
+    with pytest.raises(ValueError):
+        library.scores(library.matrix[0], method = "euclidean")
+    with pytest.raises(ValueError):
+        PyAvaSpecReferenceLibrary(grid = [ 500.0, 400.0 ])
+    assert PyAvaSpecReferenceLibrary().search(np.ones(2048)) == []
+
+    filename = str(tmp_path / "references.npz")
+    library.save(filename)
+    with np.load(filename) as npz:
+        arrays = { key : npz[key] for key in npz.files }
+    arrays['index'] = np.array(json.dumps({ 'format' : 99, 'entries' : [] }))
+    np.savez(filename, **arrays)
+    with pytest.raises(ValueError):
+        PyAvaSpecReferenceLibrary(filename)
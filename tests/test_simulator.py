@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from pyavaspec.pyavaspec import PyAvaSpec_2048_2, PyAvaSpecCommunicationError
+from pyavaspec.simulator import PyAvaSpecSimulatedDevice
+
+def measureCommand(integrationTime, averageCount = 1):
+    return bytes([ 0x03, integrationTime & 0xFF, integrationTime >> 8, averageCount & 0xFF, averageCount >> 8 ])
+
+def test_bulk_transfer_semantics():
+    device = PyAvaSpecSimulatedDevice(measurement = "LASER01")
+    device.write(0x02, measureCommand(1000), 1000)
+    payload = bytearray()
+    while True:
+        chunk = device.read(0x86, 64, 1000)
+        payload.extend(chunk)
+        if len(chunk) < 64:
+            break
+    # 6 header bytes and 2048 pixels end on a partial packet, no zero length packet
+    assert len(payload) == 6 + 2 * 2048
+    assert bytes(payload[:6]) == bytes(device.MEASUREHEADER)
+    with pytest.raises(PyAvaSpecCommunicationError):
+        device.read(0x86, 64, 1000)
+
+    # A response of exactly one packet is terminated by a zero length packet
+    device.queueResponse(bytes(64))
+    buffer = bytearray(256)
+    assert device.read(0x86, buffer, 1000) == 64
+    assert device.read(0x86, buffer, 1000) == 0
+
+def test_signal_scales_with_integration_time():
+    device = PyAvaSpecSimulatedDevice(measurement = "LASER01")
+    full = device.renderFrame(1000, 1).astype(np.float64)
+    half = device.renderFrame(500, 1).astype(np.float64)
+    assert np.allclose(half, np.rint(device.background + 0.5 * device.signal))
+    assert np.argmax(full) == np.argmax(half)
+    assert np.max(full) > np.max(half)
+
+def test_identification_and_synthetic_reference(tmp_path):
+    device = PyAvaSpecSimulatedDevice(measurementDir = str(tmp_path), serial = "SIM0000042")
+    spec = PyAvaSpec_2048_2(transport = device)
+    assert spec.serial == "SIM0000042"
+    data = spec.cmdMeasure(asArray = True)
+    assert np.argmax(data) == 308
+    spec.close()
+
+    assert PyAvaSpecSimulatedDevice.listMeasurements(str(tmp_path)) == []
+    with pytest.raises(ValueError):
+        PyAvaSpecSimulatedDevice(measurement = "MISSING", measurementDir = str(tmp_path))
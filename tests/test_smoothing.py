@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from pyavaspec import smoothing
+from pyavaspec.pyavaspec import PyAvaSpecProcessing
+
+def bruteForceBoxcar(data, windowSize):
+    left = (windowSize - 1) // 2
+    padded = np.concatenate(([ data[0] ] * left, data, [ data[-1] ] * (windowSize - 1 - left)))
+    return np.array([ np.mean(padded[i:i+windowSize]) for i in range(len(data)) ])
+
+@pytest.mark.parametrize("windowSize", [ 1, 2, 5, 10, 11 ])
+def test_boxcar_matches_brute_force(windowSize):
+    data = np.random.default_rng(2).random(200) * 1000.0
+    assert np.allclose(smoothing.boxcar(data, windowSize), bruteForceBoxcar(data, windowSize))
+
+def test_boxcar_stack_and_moving_average():
+    stack = np.random.default_rng(4).random((3, 100))
+    res = smoothing.boxcar(stack, 7, mode = "reflect")
+    assert res.shape == stack.shape
+    for row, spectrum in zip(res, stack):
+        assert np.allclose(row, smoothing.boxcar(spectrum, 7, mode = "reflect"))
+
+    averaged = PyAvaSpecProcessing().applyMovingAverage([ 1, 2, 3, 4, 5 ], windowSize = 3)
+    assert isinstance(averaged, list)
+    assert np.allclose(averaged, [ 4.0 / 3.0, 2.0, 3.0, 4.0, 14.0 / 3.0 ])
+
+def test_kernels_preserve_polynomials():
+    x = np.arange(100, dtype = np.float64)
+    quadratic = 0.01 * x**2 - x + 50.0
+    assert np.allclose(smoothing.savitzkyGolay(quadratic, 11, 2)[5:-5], quadratic[5:-5])
+    assert np.isclose(np.sum(smoothing.gaussianKernel(2.0)), 1.0)
+    assert np.allclose(smoothing.gaussian(3.0 * x + 1.0, 2.0)[10:-10], (3.0 * x + 1.0)[10:-10])
+
+def test_invalid_parameters():
+    with pytest.raises(ValueError):
+        smoothing.boxcar(np.zeros(10), 0)
+    with pytest.raises(ValueError):
+        smoothing.boxcar(np.zeros(10), 3, mode = "wrap")
+    with pytest.raises(ValueError):
+        smoothing.savitzkyGolayCoefficients(10, 2)
+    with pytest.raises(ValueError):
+        smoothing.savitzkyGolayCoefficients(5, 5)
+    with pytest.raises(ValueError):
+        smoothing.gaussianKernel(0.0)
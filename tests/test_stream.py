@@ -0,0 +1,74 @@
+import threading
+
+import numpy as np
+import pytest
+
+from pyavaspec.pyavaspec import PyAvaSpec_2048_2, PyAvaSpecCommunicationError
+from pyavaspec.simulator import PyAvaSpecSimulatedDevice
+from pyavaspec.stream import PyAvaSpecRingBuffer
+
+class FailingDevice(PyAvaSpecSimulatedDevice):
+    # Fails the measure command after a number of frames
+    def __init__(self, failAfter, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failAfter = failAfter
+
+    def write(self, endpoint, payload, timeout):
+        payload = bytes(payload)
+        if payload[:1] == bytes([ 0x03 ]):
+            if self.failAfter == 0:
+                raise PyAvaSpecCommunicationError("Simulated transfer failure")
+            self.failAfter = self.failAfter - 1
+        return super().write(endpoint, payload, timeout)
+
+def fill(buffer, count):
+    return [ buffer.put(np.full(4, i), i, float(i)) for i in range(count) ]
+
+@pytest.mark.parametrize("policy, stored, sequences", [
+    ("dropoldest", [ True ] * 5, [ 2, 3, 4 ]),
+    ("dropnewest", [ True, True, True, False, False ], [ 0, 1, 2 ])
+])
+def test_ring_buffer_drop_policies(policy, stored, sequences):
+    buffer = PyAvaSpecRingBuffer(capacity = 3, pixelCount = 4, policy = policy)
+    assert fill(buffer, 5) == stored
+    assert buffer.overruns == 2
+    buffer.close()
+    frames = []
+    while True:
+        frame = buffer.get()
+        if frame is None:
+            break
+        frames.append(frame)
+    assert [ f.sequence for f in frames ] == sequences
+    assert [ int(f.data[0]) for f in frames ] == sequences
+
+def test_ring_buffer_blocks_and_times_out():
+    buffer = PyAvaSpecRingBuffer(capacity = 2, pixelCount = 4, policy = "block")
+    producer = threading.Thread(target = fill, args = (buffer, 6))
+    producer.start()
+    out = np.zeros(4, dtype = np.uint16)
+    assert [ buffer.get(timeout = 5, out = out).sequence for i in range(6) ] == list(range(6))
+    producer.join()
+    assert buffer.overruns == 0
+    with pytest.raises(TimeoutError):
+        buffer.get(timeout = 0.01)
+    with pytest.raises(ValueError):
+        PyAvaSpecRingBuffer(policy = "dropall")
+
+def test_stream_delivers_every_frame():
+    spec = PyAvaSpec_2048_2(transport = PyAvaSpecSimulatedDevice(measurement = "LASER01"))
+    with spec.cmdMeasureStream(integrationTime = 1000, bufferSize = 4, policy = "block", maxFrames = 50) as stream:
+        frames = list(stream)
+        assert stream.getStatistics()['delivered'] == 50
+    assert [ f.sequence for f in frames ] == list(range(50))
+    assert all([ np.array_equal(f.data, frames[0].data) for f in frames ])
+    assert all([ a.timestamp <= b.timestamp for a, b in zip(frames, frames[1:]) ])
+    spec.close()
+
+def test_stream_error_is_raised_after_buffered_frames():
+    spec = PyAvaSpec_2048_2(transport = FailingDevice(3, measurement = "LASER01"))
+    with spec.cmdMeasureStream(bufferSize = 8, policy = "block") as stream:
+        stream.thread.join()
+        assert [ stream.read().sequence for i in range(3) ] == [ 0, 1, 2 ]
+        with pytest.raises(PyAvaSpecCommunicationError):
+            stream.read()
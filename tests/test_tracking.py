@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from pyavaspec.tracking import PyAvaSpecPeakTracker
+
+def gaussian(n, center, sigma, height):
+    x = np.arange(n)
+    return height * np.exp(-0.5 * ((x - center) / sigma)**2)
+
+def test_drifting_peaks_are_followed():
+    frames = np.array([ gaussian(1024, 200 + 0.5 * t, 4, 1000) + gaussian(1024, 700 - 0.25 * t, 6, 600) for t in range(40) ])
+    tracker = PyAvaSpecPeakTracker(maxPeaks = 5, window = 4, rescanInterval = None)
+    trajectories = tracker.run(frames, timestamps = 0.1 * np.arange(40))
+    assert tracker.fullSearches == 1
+    assert len(trajectories) == 2
+
+    first, second = trajectories
+    assert len(first['position']) == 40 and len(second['position']) == 40
+    assert np.allclose(first['position'], 200 + 0.5 * np.arange(40), atol = 0.1)
+    assert np.allclose(second['position'], 700 - 0.25 * np.arange(40), atol = 0.1)
+    assert np.allclose(first['timestamp'], 0.1 * np.arange(40))
+    assert np.allclose(first['fwhm'], 2.0 * np.sqrt(2.0 * np.log(2.0)) * 4 * 0.546875, rtol = 0.05)
+    assert np.allclose(first['wavelength'], 299.67 + 0.546875 * first['position'])
+
+def test_lost_and_new_peaks():
+    base = gaussian(512, 100, 3, 1000)
+    frames = [ base ] * 3 + [ np.zeros(512) ] * 4 + [ base + gaussian(512, 400, 3, 800) ] * 4
+    tracker = PyAvaSpecPeakTracker(maxPeaks = 5, window = 4, lostAfter = 3, rescanInterval = 7)
+    found = [ tracker.update(frame) for frame in frames ]
+    assert [ len(f) for f in found ] == [ 1, 1, 1, 0, 0, 0, 0, 2, 2, 2, 2 ]
+    assert [ pk['id'] for pk in found[-1] ] == [ 1, 2 ]
+    assert [ len(t['position']) for t in tracker.trajectories() ] == [ 3, 4, 4 ]
+
+def test_invalid_window():
+    with pytest.raises(ValueError):
+        PyAvaSpecPeakTracker(window = 0)